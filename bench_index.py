@@ -0,0 +1,98 @@
+import argparse
+import json
+import time
+import numpy as np
+from face_index import BruteForceIndex, IVFIndex, EMBEDDING_DIM
+
+SAME_PERSON_DISTANCE = 0.45 # Среднее расстояние между двумя фото одного человека (типично для dlib при пороге 0.6)
+
+
+def synthetic_people(size, seed=0, decay=8):
+    """
+    Синтетические личности: нормированные векторы с убывающим по измерениям
+    разбросом (у настоящих эмбеддингов лиц эффективная размерность заметно
+    меньше 128), без четких групп, поэтому границы кластеров IVF проходят
+    между похожими людьми, как на реальной базе.
+    """
+    rng = np.random.default_rng(seed)
+    people = rng.normal(size=(size, EMBEDDING_DIM)) / np.sqrt(1 + np.arange(EMBEDDING_DIM) / decay)
+    people /= np.linalg.norm(people, axis=1, keepdims=True)
+    return people.astype(np.float32)
+
+
+def photo_samples(people, rng, same_person_distance=SAME_PERSON_DISTANCE):
+    """
+    Эмбеддинги новых фото тех же людей: личность плюс разброс снимка (поза,
+    свет), у каждого фото своей силы - среднее расстояние между двумя фото
+    одного человека около same_person_distance, с хвостом до порога.
+    """
+    sigma = same_person_distance / np.sqrt(2 * EMBEDDING_DIM)
+    scale = sigma * rng.uniform(0.5, 1.5, size=(len(people), 1))
+    samples = people + scale * rng.normal(size=people.shape)
+    samples /= np.linalg.norm(samples, axis=1, keepdims=True)
+    return samples.astype(np.float32)
+
+
+def synthetic_gallery(size, seed=0):
+    """Синтетическая база эмбеддингов: по одному эталонному фото на каждую синтетическую личность."""
+    return photo_samples(synthetic_people(size, seed), np.random.default_rng(seed + 2))
+
+
+def _timed_search(index, queries, **kwargs):
+    start = time.perf_counter()
+    results = [index.search(query[None, :], 1, **kwargs)[0] for query in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def run(size, queries_count, nlist, nprobes, seed=0, same_person_distance=SAME_PERSON_DISTANCE):
+    """
+    Сравнивает точный перебор и IVF: recall@1 и задержку на одно лицо.
+    Запросы - новые фото зарегистрированных людей (а не копии эталонов с
+    малым шумом), поэтому часть из них уходит в соседние кластеры IVF.
+    """
+    people = synthetic_people(size, seed)
+    rng = np.random.default_rng(seed + 1)
+    vectors = photo_samples(people, rng, same_person_distance)
+    ids = [str(i) for i in range(size)]
+    targets = rng.integers(0, size, queries_count)
+    queries = photo_samples(people[targets], rng, same_person_distance)
+
+    exact = BruteForceIndex(); exact.add(ids, vectors)
+    exact_results, exact_ms = _timed_search(exact, queries)
+    truth = [result[0][0] for result in exact_results]
+    identified = np.mean([expected == str(target) for expected, target in zip(truth, targets)])
+
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=nlist).build(ids, vectors)
+    build_s = time.perf_counter() - start
+
+    report = {'size': size, 'queries': queries_count, 'nlist': ivf.nlist, 'build_seconds': round(build_s, 3),
+              'same_person_distance': round(float(np.linalg.norm(queries - vectors[targets], axis=1).mean()), 3),
+              'exact_identified': round(float(identified), 4), 'exact_ms_per_query': round(exact_ms, 3), 'ivf': []}
+    for nprobe in nprobes:
+        results, ms = _timed_search(ivf, queries, nprobe=nprobe)
+        recall = np.mean([bool(result) and result[0][0] == expected for result, expected in zip(results, truth)])
+        report['ivf'].append({'nprobe': nprobe, 'recall_at_1': round(float(recall), 4), 'ms_per_query': round(ms, 3),
+                              'speedup': round(exact_ms / ms, 2) if ms else None})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк индекса лиц: полнота против задержки относительно точного перебора.")
+    parser.add_argument('--size', type=int, default=100000, help="Размер синтетической базы")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--nprobe', default="1,4,8,16,32", help="Список значений nprobe через запятую")
+    parser.add_argument('--same-person-distance', type=float, default=SAME_PERSON_DISTANCE,
+                        help="Среднее расстояние между фото одного человека в запросах")
+    parser.add_argument('--json', action='store_true', help="Вывести результат в формате JSON")
+    args = parser.parse_args()
+    result = run(args.size, args.queries, args.nlist, [int(n) for n in args.nprobe.split(',')], same_person_distance=args.same_person_distance)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=4))
+    else:
+        print(f"База: {result['size']}, кластеров: {result['nlist']}, построение: {result['build_seconds']} с")
+        print(f"Точный перебор: {result['exact_ms_per_query']} мс/лицо, опознано верно {result['exact_identified']:.4f}"
+              f" (расстояние до своего эталона {result['same_person_distance']})")
+        for row in result['ivf']:
+            print(f"IVF nprobe={row['nprobe']:>3}: recall@1={row['recall_at_1']:.4f}, {row['ms_per_query']} мс/лицо, ускорение x{row['speedup']}")
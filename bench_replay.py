@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import cv2
+import database as db
+from bench_index import synthetic_gallery
+from bulk_import import analyze_photo
+from face_index import BruteForceIndex, IVFIndex
+from matcher import FaceMatcher
+from recognition import Recognizer, encode_faces
+from tracking import TrackManager, DEFAULT_TRACKER, TRACKER_BACKENDS, create_tracker_backend
+from camera_engine import parse_size
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_FPS = 25.0 # Частота видео, если файл ее не сообщает
+STAGES = ('capture', 'detect', 'track', 'encode', 'match', 'access')
+
+
+def _images(folder):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(folder)
+                  for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def _label(path, folder):
+    """Личность изображения - имя его подпапки (<папка>/<ID пользователя>/*.jpg) или None."""
+    parent = os.path.relpath(os.path.dirname(path), folder)
+    return None if parent == '.' else parent.split(os.sep)[0]
+
+
+def enrollment_set(source, enroll=None):
+    """
+    Эталонные фото и кадры воспроизведения. Из папки с подпапками по
+    пользователям первое фото каждой подпапки регистрируется, остальные
+    воспроизводятся. Папка enroll (файлы <ID>.jpg или подпапки) задает эталоны явно.
+    """
+    enrolled, replay = {}, []
+    if enroll:
+        for path in _images(enroll):
+            enrolled.setdefault(_label(path, enroll) or os.path.splitext(os.path.basename(path))[0], path)
+    if os.path.isdir(source):
+        for path in _images(source):
+            label = _label(path, source)
+            if not enroll and label and label not in enrolled:
+                enrolled[label] = path; continue
+            replay.append((path, label))
+    return enrolled, replay
+
+
+def build_matcher(enrolled_users, gallery_size, index_kind, nlist, seed=0):
+    """База: зарегистрированные пользователи и синтетические эмбеддинги-«статисты» до gallery_size."""
+    distractors = max(0, gallery_size - len(enrolled_users))
+    vectors = synthetic_gallery(distractors, seed) if distractors else np.zeros((0, 128), np.float32)
+    users = list(enrolled_users) + [{'id': f"synthetic-{i}", 'first_name': "Synthetic", 'last_name': str(i), 'departament': None,
+                                     'encoding': vector} for i, vector in enumerate(vectors)]
+    start = time.perf_counter()
+    ids, encodings = [str(user['id']) for user in users], [user['encoding'] for user in users]
+    if index_kind == 'ivf':
+        index = IVFIndex(nlist=nlist).build(ids, encodings)
+    else:
+        index = BruteForceIndex(); index.add(ids, encodings)
+    return FaceMatcher(users, index=index), time.perf_counter() - start
+
+
+def frames(source, replay):
+    """
+    Кадры источника: (кадр BGR, метка, время кадра в секундах) - видеофайл или
+    изображения папки. Для нечитаемого изображения кадр равен None.
+    """
+    if not os.path.isdir(source):
+        capture = cv2.VideoCapture(source)
+        fps = capture.get(cv2.CAP_PROP_FPS) or VIDEO_FPS
+        n = 0
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok: return
+                yield frame, None, n / fps; n += 1
+        finally:
+            capture.release()
+    for n, (path, label) in enumerate(replay):
+        yield cv2.imread(path), label, float(n)
+
+
+def replay(recognizer, source, replay_set, label=None, detection_size=None, detection_interval=1,
+           tracker=DEFAULT_TRACKER, room_id=None, max_frames=None):
+    """
+    Прогоняет кадры через путь камеры: декодирование, YuNet, привязка к
+    трекам и трекер между обнаружениями, кодирование новых треков,
+    сопоставление и проверка доступа. Возвращает задержки этапов и точность.
+    """
+    video = not os.path.isdir(source)
+    tracks, backend = TrackManager(), create_tracker_backend(tracker, max_age=2 * detection_interval)
+    latencies = {stage: [] for stage in STAGES}
+    accuracy = {'faces': 0, 'correct': 0, 'wrong': 0, 'unknown': 0, 'frames_without_face': 0}
+    count, failed_reads, started = 0, 0, time.perf_counter()
+    source_frames = frames(source, replay_set)
+    while max_frames is None or count < max_frames:
+        start = time.perf_counter()
+        item = next(source_frames, None)
+        if item is None: break
+        frame, frame_label, now = item
+        if frame is None:
+            failed_reads += 1; continue # Битый или неподдерживаемый файл не прерывает прогон
+        latencies['capture'].append(time.perf_counter() - start)
+        frame_label = frame_label or label
+        if not video: tracks.clear() # Изображения папки не связаны между собой
+
+        if count % detection_interval == 0 or not video:
+            start = time.perf_counter()
+            boxes = [face[0:4].astype(np.int32) for face in recognizer.detect(frame, detection_size)]
+            latencies['detect'].append(time.perf_counter() - start)
+            prepared = backend.prepare(frame)
+            pending = []
+            for track, box, needs_encoding in tracks.associate(boxes, now):
+                tracks.set_tracker(track, backend.correct(track.tracker, prepared, box))
+                if needs_encoding: pending.append((track, box))
+            if pending:
+                start = time.perf_counter()
+                encodings = encode_faces(frame, [box for _, box in pending])
+                latencies['encode'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                matches = recognizer.matcher.match(encodings)
+                latencies['match'].append(time.perf_counter() - start)
+                for (track, _), encoding, (user, distance) in zip(pending, encodings, matches):
+                    tracks.set_identity(track, user, distance, encoding, now)
+                    start = time.perf_counter()
+                    db.check_access(track.user['departament'] if track.user else None, room_id)
+                    latencies['access'].append(time.perf_counter() - start)
+            if frame_label is not None:
+                # Точность - по личностям треков кадра (с учетом кэша личности трека, как у камеры)
+                if not boxes: accuracy['frames_without_face'] += 1
+                for track in tracks.tracks():
+                    if track.last_seen != now: continue # Трек не найден на этом кадре
+                    accuracy['faces'] += 1
+                    if track.user is None: accuracy['unknown'] += 1
+                    elif str(track.user['id']) == frame_label: accuracy['correct'] += 1
+                    else: accuracy['wrong'] += 1
+        else:
+            start = time.perf_counter()
+            prepared = backend.prepare(frame)
+            for track in tracks.tracks():
+                if track.tracker is not None:
+                    success, box = backend.update(track.tracker, prepared)
+                    if success: track.box = tuple(box)
+                    else: tracks.set_tracker(track, None)
+            latencies['track'].append(time.perf_counter() - start)
+        count += 1
+    elapsed = time.perf_counter() - started
+    if accuracy['faces']:
+        accuracy['accuracy'] = round(accuracy['correct'] / accuracy['faces'], 4)
+    return {'frames': count, 'failed_reads': failed_reads, 'seconds': round(elapsed, 3), 'fps': round(count / elapsed, 2) if elapsed else None,
+            'stages_ms': {stage: _percentiles(values) for stage, values in latencies.items() if values},
+            'identification': accuracy}
+
+
+def _percentiles(values):
+    values = np.asarray(values) * 1000
+    return {'count': len(values), 'mean': round(float(values.mean()), 3),
+            **{f"p{q}": round(float(np.percentile(values, q)), 3) for q in (50, 90, 99)}}
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None # Windows
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) # Linux: КБ
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воспроизведение видео или папки изображений через конвейер распознавания: "
+                                                 "FPS, задержки этапов, память и точность на синтетической базе.")
+    parser.add_argument('source', help="Видеофайл или папка изображений (подпапки - ID пользователей)")
+    parser.add_argument('--enroll', default=None, help="Папка эталонных фото <ID>.jpg (по умолчанию - первое фото подпапки)")
+    parser.add_argument('--label', default=None, help="ID пользователя на всем видео (для оценки точности)")
+    parser.add_argument('--gallery-sizes', default="1000,10000,100000", help="Размеры базы через запятую")
+    parser.add_argument('--index', default='brute', choices=('brute', 'ivf'), help="Индекс поиска лиц")
+    parser.add_argument('--nlist', type=int, default=1024, help="Количество кластеров IVF")
+    parser.add_argument('--detection-size', default=None, help="Разрешение обнаружения, например 640x360")
+    parser.add_argument('--interval', type=int, default=1, help="Интервал обнаружения в кадрах видео (между ними - трекер)")
+    parser.add_argument('--tracker', default=DEFAULT_TRACKER, choices=TRACKER_BACKENDS)
+    parser.add_argument('--room', default=None, help="ID помещения для проверки доступа (правила берутся из базы)")
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--output', default=None, help="Сохранить результаты в JSON-файл")
+    parser.add_argument('--json', action='store_true', help="Вывести результат в формате JSON")
+    args = parser.parse_args()
+
+    if args.room: db.initialize_database()
+    enrolled_paths, replay_set = enrollment_set(args.source, args.enroll)
+    enrolled_users = []
+    for user_id, path in enrolled_paths.items():
+        reason, encoding, _, _, _ = analyze_photo(path)
+        if reason is None:
+            enrolled_users.append({'id': user_id, 'first_name': user_id, 'last_name': "", 'departament': None, 'encoding': encoding})
+        else:
+            print(f"Эталон {path} пропущен: {reason}")
+
+    results = {'source': args.source, 'enrolled': len(enrolled_users), 'index': args.index,
+               'detection_size': args.detection_size, 'interval': args.interval, 'tracker': args.tracker, 'runs': []}
+    for size in (int(size) for size in args.gallery_sizes.split(',')):
+        matcher, build_seconds = build_matcher(enrolled_users, size, args.index, args.nlist)
+        run = replay(Recognizer(matcher), args.source, replay_set, args.label, parse_size(args.detection_size),
+                     args.interval, args.tracker, args.room, args.max_frames)
+        run.update({'gallery_size': len(matcher), 'index_build_seconds': round(build_seconds, 3),
+                    'gallery_mb': round(sum(user['encoding'].nbytes for user in matcher.users) / 1024 ** 2, 1),
+                    'max_rss_mb': _max_rss_mb()})
+        results['runs'].append(run)
+        del matcher
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=4))
+    else:
+        print(f"Источник: {args.source}, зарегистрировано: {results['enrolled']}, индекс: {args.index}")
+        for run in results['runs']:
+            stages = ", ".join(f"{stage} p50={row['p50']} p99={row['p99']}" for stage, row in run['stages_ms'].items())
+            ident = run['identification']
+            print(f"База {run['gallery_size']:>7}: {run['fps']} к/с, память {run['max_rss_mb']} МБ | {stages} мс | "
+                  f"точность {ident.get('accuracy')} ({ident['correct']}/{ident['faces']}, ошибок {ident['wrong']})"
+                  + (f", не прочитано файлов: {run['failed_reads']}" if run['failed_reads'] else ""))
@@ -0,0 +1,67 @@
+import argparse
+import json
+import time
+import numpy as np
+import cv2
+from tracking import TRACKER_BACKENDS, create_tracker_backend
+
+
+def synthetic_sequence(frames, targets, width, height, seed=0):
+    """Синтетическое видео: шумный фон и движущиеся текстурированные квадраты-«лица»."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 3)
+    size = max(24, min(width, height) // 10)
+    patches = [rng.integers(0, 255, (size, size, 3), dtype=np.uint8) for _ in range(targets)]
+    starts = rng.uniform([0, 0], [width - size * 2, height - size * 2], (targets, 2))
+    velocities = rng.uniform(-2, 2, (targets, 2))
+    for f in range(frames):
+        frame = background.copy()
+        boxes = []
+        for patch, start, velocity in zip(patches, starts, velocities):
+            x, y = np.clip(start + velocity * f, 0, [width - size, height - size]).astype(int)
+            frame[y:y + size, x:x + size] = patch
+            boxes.append((int(x), int(y), size, size))
+        yield frame, boxes
+
+
+def run(backend_name, targets, frames, width, height, detection_interval):
+    """Средняя стоимость сопровождения на кадр (мс) для заданного числа целей."""
+    backend = create_tracker_backend(backend_name, max_age=2 * detection_interval)
+    trackers, elapsed, measured = [], 0.0, 0
+    for f, (frame, boxes) in enumerate(synthetic_sequence(frames, targets, width, height)):
+        if f % detection_interval == 0:
+            # Коррекция по «обнаружению» происходит в пуле распознавания и в стоимость кадра не входит
+            prepared = backend.prepare(frame)
+            trackers = [backend.correct(trackers[i] if i < len(trackers) else None, prepared, box)
+                        for i, box in enumerate(boxes)]
+            continue
+        start = time.perf_counter()
+        prepared = backend.prepare(frame)
+        for tracker in trackers:
+            backend.update(tracker, prepared)
+        elapsed += time.perf_counter() - start; measured += 1
+    ms = elapsed * 1000 / max(measured, 1)
+    return {'backend': backend_name, 'targets': targets, 'ms_per_frame': round(ms, 3),
+            'ms_per_target': round(ms / targets, 3) if targets else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк трекеров: стоимость сопровождения на кадр в зависимости от числа лиц.")
+    parser.add_argument('--backends', default=",".join(TRACKER_BACKENDS))
+    parser.add_argument('--targets', default="1,2,4,8,16")
+    parser.add_argument('--frames', type=int, default=150)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--interval', type=int, default=15, help="Интервал обнаружения в кадрах")
+    parser.add_argument('--json', action='store_true', help="Вывести результат в формате JSON")
+    args = parser.parse_args()
+
+    results = [run(name, int(count), args.frames, args.width, args.height, args.interval)
+               for name in args.backends.split(',') for count in args.targets.split(',')]
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=4))
+    else:
+        print(f"Кадр {args.width}x{args.height}, обнаружение каждые {args.interval} кадров")
+        for row in results:
+            print(f"{row['backend']:>7} | лиц: {row['targets']:>3} | {row['ms_per_frame']:>9} мс/кадр | {row['ms_per_target']} мс/лицо")
@@ -0,0 +1,137 @@
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import database as db
+
+# Причины отказа в импорте
+MISSING_FIELDS = 'missing_fields'
+DUPLICATE_ID = 'duplicate_id'
+INVALID_ID = 'invalid_id' # ID становится именем файла фото: только буквы, цифры, '_' и '-'
+MISSING_PHOTO = 'missing_photo'
+UNREADABLE = 'unreadable'
+NO_FACE = 'no_face'
+MULTIPLE_FACES = 'multiple_faces'
+
+PROGRESS_SECONDS = 2.0
+
+
+def read_manifest(path):
+    """
+    Читает манифест CSV или JSON (список объектов). Поля: id, first_name,
+    last_name, photo (имя файла в папке фото), необязательные passport_number
+    (passport) и departament (department).
+    """
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+    # В JSON значения могут быть числами (например, номер паспорта) - все поля приводятся к строке
+    return [{'id': str(row.get('id') or '').strip(),
+             'first_name': str(row.get('first_name') or '').strip(),
+             'last_name': str(row.get('last_name') or '').strip(),
+             'passport_number': str(row.get('passport_number') or row.get('passport') or '').strip(),
+             'departament': str(row.get('departament') or row.get('department') or '').strip(),
+             'photo': str(row.get('photo') or '').strip()} for row in rows]
+
+
+def analyze_photo(path):
+    """
+    Проверяет фото в процессе пула: ровно одно лицо. Возвращает (причина
+    отказа или None, эмбеддинг, sha1, размер, расширение файла).
+    """
+    import io
+    import face_recognition
+    from PIL import Image
+    import face_cache
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        image_format = Image.open(io.BytesIO(data)).format or 'JPEG'
+        image = face_recognition.load_image_file(io.BytesIO(data))
+        locations = face_recognition.face_locations(image)
+        if not locations:
+            return NO_FACE, None, None, None, None
+        if len(locations) > 1:
+            return MULTIPLE_FACES, None, None, None, None
+        encoding = face_recognition.face_encodings(image, locations)[0]
+    except Exception:
+        # Ошибка dlib на одном фото (например, неподдерживаемый режим изображения) не должна прерывать весь импорт
+        return UNREADABLE, None, None, None, None
+    ext = '.jpg' if image_format == 'JPEG' else f".{image_format.lower()}"
+    return None, encoding, face_cache.photo_hash(data), len(data), ext
+
+
+def import_users(manifest, photo_dir, workers=None, dry_run=False, progress=print):
+    """
+    Массовая регистрация пользователей: проверка строк манифеста, параллельная
+    проверка и кодирование фото в пуле процессов и запись всех принятых
+    пользователей одной транзакцией. Возвращает отчет (dict) с принятыми ID,
+    отказами и производительностью. База должна быть инициализирована.
+    """
+    start = time.perf_counter()
+    rows = read_manifest(manifest) if isinstance(manifest, str) else list(manifest)
+    rejected, candidates, seen = [], [], set()
+    existing = db.existing_user_ids([row['id'] for row in rows if row['id']])
+    for row in rows:
+        if not row['id'] or not row['first_name'] or not row['last_name'] or not row['photo']:
+            rejected.append((row['id'], MISSING_FIELDS)); continue
+        if not db.is_valid_user_id(row['id']):
+            rejected.append((row['id'], INVALID_ID)); continue
+        if row['id'] in existing or row['id'] in seen:
+            rejected.append((row['id'], DUPLICATE_ID)); continue
+        seen.add(row['id'])
+        path = os.path.join(photo_dir, row['photo'])
+        if not os.path.isfile(path):
+            rejected.append((row['id'], MISSING_PHOTO)); continue
+        candidates.append((row, path))
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    accepted, last_report = [], time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+        results = pool.map(analyze_photo, [path for _, path in candidates], chunksize=4)
+        for done, ((row, path), (reason, encoding, sha1, size, ext)) in enumerate(zip(candidates, results), 1):
+            if reason is not None:
+                rejected.append((row['id'], reason))
+            else:
+                accepted.append(dict(row, source_path=path, encoding=encoding, sha1=sha1, size=size, ext=ext))
+            now = time.perf_counter()
+            if progress and (now - last_report >= PROGRESS_SECONDS or done == len(candidates)):
+                last_report = now
+                progress(f"Проверено фото: {done}/{len(candidates)} ({done / (now - start):.1f} фото/с), "
+                         f"принято {len(accepted)}, отклонено {len(rejected)}")
+
+    if accepted and not dry_run:
+        db.import_users(accepted)
+    elapsed = time.perf_counter() - start
+    reasons = {}
+    for _, reason in rejected:
+        reasons[reason] = reasons.get(reason, 0) + 1
+    return {'total': len(rows), 'imported': 0 if dry_run else len(accepted), 'accepted': len(accepted),
+            'rejected': len(rejected), 'reasons': reasons, 'seconds': round(elapsed, 2),
+            'photos_per_second': round(len(candidates) / elapsed, 2) if elapsed else None,
+            'imported_ids': [] if dry_run else [user['id'] for user in accepted],
+            'rejections': [{'id': user_id, 'reason': reason} for user_id, reason in rejected]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Массовая регистрация пользователей по манифесту (CSV/JSON) и папке фото.")
+    parser.add_argument('manifest', help="CSV или JSON: id, first_name, last_name, photo, passport_number, departament")
+    parser.add_argument('photo_dir', help="Папка с фото, на которые ссылается поле photo")
+    parser.add_argument('--workers', type=int, default=None, help="Количество процессов кодирования")
+    parser.add_argument('--dry-run', action='store_true', help="Только проверить фото, ничего не записывать")
+    parser.add_argument('--report', default=None, help="Сохранить полный отчет (с отказами) в JSON-файл")
+    args = parser.parse_args()
+
+    db.initialize_database()
+    report = import_users(args.manifest, args.photo_dir, args.workers, args.dry_run)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"Строк в манифесте: {report['total']}, импортировано: {report['imported']}, отклонено: {report['rejected']} {report['reasons']}")
+    print(f"Время: {report['seconds']} с, {report['photos_per_second']} фото/с")
@@ -3,12 +3,10 @@ import sys
 import importlib.util
 import os
 import threading
-import time
-import numpy as np
 import shutil
 import queue
 import json
-import io
+import logging
 import sqlite3
 from datetime import datetime
 from PIL import Image, ImageTk
@@ -45,51 +43,17 @@ if not manage_opencv_installation(): sys.exit("Не удалось настро
 for pkg in ["Pillow", "face_recognition"]: install_package(pkg)
 
 import database as db
-
-# --- Классы AsyncFrameSaver и RTSPVideoCapture ---
-class AsyncFrameSaver:
-    def __init__(self):
-        self.save_queue = queue.Queue(); self.thread = threading.Thread(target=self._worker, daemon=True); self.is_running = False
-    def _worker(self):
-        while self.is_running:
-            try:
-                task = self.save_queue.get(timeout=1)
-                if task is None: break
-                filepath, frame = task; directory = os.path.dirname(filepath); os.makedirs(directory, exist_ok=True)
-                cv2.imwrite(filepath, frame); self.save_queue.task_done()
-            except queue.Empty: continue
-            except Exception as e: print(f"[AsyncSaver] Ошибка при сохранении файла: {e}")
-    def start(self): self.is_running = True; self.thread.start()
-    def save(self, filepath, frame):
-        if self.is_running: self.save_queue.put((filepath, frame))
-    def stop(self):
-        if self.is_running: self.is_running = False; self.save_queue.put(None); self.thread.join(timeout=2)
-
-class RTSPVideoCapture:
-    def __init__(self, rtsp_url):
-        self.rtsp_url = rtsp_url; self.frame = None; self.ret = False; self.is_running = False; self.thread = None; self.cap = None
-    def start(self):
-        if self.is_running: return
-        self.is_running = True; self.thread = threading.Thread(target=self.update, args=()); self.thread.daemon = True; self.thread.start()
-    def update(self):
-        while self.is_running:
-            if self.cap is None or not self.cap.isOpened():
-                print(f"[RTSP] Попытка подключения к {self.rtsp_url}..."); self.cap = cv2.VideoCapture(self.rtsp_url)
-                if not self.cap.isOpened(): self.cap.release(); self.cap = None; time.sleep(5); continue
-                else: print("[RTSP] Соединение установлено успешно.")
-            ret, frame = self.cap.read()
-            if not ret: self.cap.release(); self.cap = None; time.sleep(1); continue
-            self.ret, self.frame = ret, frame
-        if self.cap is not None: self.cap.release(); self.cap = None
-    def read(self): return self.ret, self.frame
-    def stop(self):
-        self.is_running = False
-        if self.thread is not None and self.thread.is_alive(): self.thread.join(timeout=2)
-
+from gallery import Gallery
+from journal import AccessJournal
+from metrics import REGISTRY, MetricsReporter
+from snapshots import SnapshotWriter
+from thumbnails import ThumbnailCache
+from camera_engine import CameraManager
 
 # --- Класс GUI приложения ---
 class App:
     HISTORY_FILE = "camera_history.json"
+    GUI_MIN_DELAY_MS, GUI_MAX_DELAY_MS = 33, 200 # Пределы периода обновления окна видео
 
     def __init__(self, root):
         self.root = root
@@ -97,12 +61,13 @@ class App:
         
         db.initialize_database()
 
-        self.is_running = False; self.video_thread = None; self.rtsp_cap = None
-        self.frame_queue = queue.Queue(maxsize=2)
+        self.is_running = False; self.camera_manager = None; self.display_camera = None
         self.log_queue = queue.Queue()
-        self.frame_saver = AsyncFrameSaver()
-        self.known_users = []; self.load_known_users()
-        self.recent_detections = {}
+        self.snapshot_writer = SnapshotWriter()
+        self.journal = AccessJournal(); self.snapshot_writer.add_drop_listener(self.journal.discard_snapshot)
+        REGISTRY.gauge('fac_queue_depth', lambda: [({'queue': 'log'}, self.log_queue.qsize()),
+                                                   ({'queue': 'journal'}, self.journal.stats()['queue_depth'])], source='gui')
+        self.gallery = Gallery(); self.gallery.subscribe(self.on_gallery_changed); self.load_known_users()
 
         # --- Основная структура GUI ---
         main_frame = Frame(root)
@@ -126,6 +91,12 @@ class App:
         
         self.start_button = Button(setup_frame, text="Запустить", command=self.start_stream); self.start_button.pack(side="left")
         self.stop_button = Button(setup_frame, text="Остановить", command=self.stop_stream, state="disabled"); self.stop_button.pack(side="left", padx=5)
+        self.start_all_button = Button(setup_frame, text="Запустить все камеры", command=self.start_all_streams); self.start_all_button.pack(side="left")
+
+        display_frame = Frame(center_frame); display_frame.pack(pady=2, fill="x")
+        Label(display_frame, text="Показывать камеру:").pack(side="left")
+        self.display_var = StringVar(root); self.display_var.trace_add("write", lambda *args: self.show_camera(self.display_var.get()))
+        self.display_menu = OptionMenu(display_frame, self.display_var, ""); self.display_menu.pack(side="left", padx=5)
         
         management_frame = Frame(center_frame)
         management_frame.pack(pady=5)
@@ -142,7 +113,7 @@ class App:
         self.log_widget.tag_configure("granted", foreground="#007ACC"); self.log_widget.tag_configure("denied", foreground="red")
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.frame_saver.start()
+        self.snapshot_writer.start(); self.journal.start()
         self.process_log_queue()
 
     # --- Методы управления камерами ---
@@ -232,11 +203,18 @@ class App:
 
     # --- Методы управления пользователями ---
     def load_known_users(self):
-        self.known_users = db.get_known_face_encodings()
-        print(f"Загружено {len(self.known_users)} пользователей из базы данных.")
+        self.gallery.load()
+        print(f"Загружено {len(self.gallery)} пользователей из базы данных.")
+
+    def on_gallery_changed(self, matcher, version):
+        # Запущенные камеры получают новый снимок галереи без перезапуска
+        self.matcher = matcher
+        if self.camera_manager is not None: self.camera_manager.set_matcher(matcher)
+
+    USER_ROW_HEIGHT = 120 # Высота строки списка пользователей (строки фиксированной высоты)
+    USER_PAGE_SIZE = 100 # Пользователи читаются из базы страницами по мере прокрутки
 
     def open_user_database_window(self):
-        # ... (код этого и других методов для пользователей без изменений) ...
         self.db_window = Toplevel(self.root)
         self.db_window.title("База пользователей")
         self.db_window.geometry("600x700")
@@ -246,47 +224,118 @@ class App:
         bottom_frame.pack(side="bottom", fill="x", pady=10, padx=10)
         add_button = Button(bottom_frame, text="Добавить нового пользователя", command=self.open_add_user_window)
         add_button.pack()
+        search_frame = Frame(self.db_window); search_frame.pack(fill="x", padx=10, pady=5)
+        Label(search_frame, text="Поиск:").pack(side="left")
+        self.user_search_var = StringVar(self.db_window)
+        Entry(search_frame, textvariable=self.user_search_var, width=30).pack(side="left", padx=5)
+        self.user_count_label = Label(search_frame, text=""); self.user_count_label.pack(side="left", padx=5)
+        self._search_job = None
+        self.user_search_var.trace_add("write", lambda *args: self._schedule_user_search())
         canvas_frame = Frame(self.db_window)
         canvas_frame.pack(fill=BOTH, expand=True)
         self.user_canvas = Canvas(canvas_frame)
-        scrollbar = Scrollbar(canvas_frame, orient="vertical", command=self.user_canvas.yview)
-        self.scrollable_frame = Frame(self.user_canvas)
-        self.scrollable_frame.bind("<Configure>",lambda e: self.user_canvas.configure(scrollregion=self.user_canvas.bbox("all")))
-        self.user_canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
+        scrollbar = Scrollbar(canvas_frame, orient="vertical", command=lambda *args: (self.user_canvas.yview(*args), self._render_visible_users()))
         self.user_canvas.configure(yscrollcommand=scrollbar.set)
+        self.user_canvas.bind("<Configure>", lambda e: self._render_visible_users())
+        self.user_canvas.bind("<MouseWheel>", lambda e: (self.user_canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"), self._render_visible_users()))
+        self.user_canvas.bind("<Button-4>", lambda e: (self.user_canvas.yview_scroll(-1, "units"), self._render_visible_users()))
+        self.user_canvas.bind("<Button-5>", lambda e: (self.user_canvas.yview_scroll(1, "units"), self._render_visible_users()))
+        self.user_canvas.configure(yscrollincrement=self.USER_ROW_HEIGHT // 4)
         self.user_canvas.pack(side="left", fill=BOTH, expand=True)
         scrollbar.pack(side="right", fill="y")
+        if not hasattr(self, 'thumbnails'): self.thumbnails = ThumbnailCache()
         self.populate_user_list()
+        self._poll_thumbnails()
+
+    def _schedule_user_search(self):
+        # Поиск запускается после паузы в наборе, а не на каждую букву
+        if self._search_job is not None: self.db_window.after_cancel(self._search_job)
+        self._search_job = self.db_window.after(300, self.populate_user_list)
 
     def populate_user_list(self):
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        users = db.get_all_users_with_photos()
-        if not users:
-            Label(self.scrollable_frame, text="База данных пуста.").pack(pady=20)
+        """
+        Сбрасывает виртуальный список: считает подходящих пользователей и
+        рисует только строки в видимой области. Данные читаются страницами
+        при прокрутке, миниатюры готовятся в фоне.
+        """
+        self._search_job = None
+        self.user_query = self.user_search_var.get().strip()
+        self.user_total = db.count_users(self.user_query)
+        self.user_pages = {}
+        self.user_rows = {} # индекс строки -> (id окна на холсте, рамка строки, метка фото, хэш фото)
+        self.user_canvas.delete("all")
+        self.user_canvas.yview_moveto(0)
+        if not self.user_total:
+            self.user_count_label.config(text="")
+            self.user_canvas.configure(scrollregion=(0, 0, 0, 0))
+            self.user_canvas.create_text(20, 20, anchor="nw", text="База данных пуста." if not self.user_query else "Никто не найден.")
             return
-        for user_data in users:
-            user_frame = Frame(self.scrollable_frame, borderwidth=1, relief="solid", padx=5, pady=5)
-            try:
-                image_stream = io.BytesIO(user_data['photo'])
-                img = Image.open(image_stream).resize((100, 100), Image.Resampling.LANCZOS)
-                photo_img = ImageTk.PhotoImage(img)
-                photo_label = Label(user_frame, image=photo_img); photo_label.image = photo_img
-                photo_label.grid(row=0, column=0, rowspan=3, padx=10, pady=5)
-            except Exception as e:
-                print(f"Ошибка загрузки фото для GUI: {e}")
-                Label(user_frame, text="Нет фото", width=12, height=6).grid(row=0, column=0, rowspan=3, padx=10, pady=5)
-            info_frame = Frame(user_frame)
-            Label(info_frame, text=f"Имя: {user_data['first_name']}", font=("Arial", 10)).pack(anchor="w")
-            Label(info_frame, text=f"Фамилия: {user_data['last_name']}", font=("Arial", 10)).pack(anchor="w")
-            Label(info_frame, text=f"ID: {user_data['id']}", font=("Arial", 8)).pack(anchor="w")
-            info_frame.grid(row=0, column=1, sticky="w", rowspan=2)
-            buttons_frame = Frame(user_frame)
-            Button(buttons_frame, text="Подробнее", command=lambda u_id=user_data['id']: self.show_user_details(u_id)).pack(side="left", padx=5)
-            Button(buttons_frame, text="Редактировать", command=lambda u_id=user_data['id']: self.open_edit_user_window(u_id)).pack(side="left", padx=5)
-            Button(buttons_frame, text="Удалить", fg="red", command=lambda u_id=user_data['id']: self.delete_user_action(u_id)).pack(side="left", padx=5)
-            buttons_frame.grid(row=2, column=1, sticky="w", pady=5)
-            user_frame.pack(fill="x", padx=10, pady=5, expand=True)
+        self.user_count_label.config(text=f"Найдено: {self.user_total}")
+        self.user_canvas.configure(scrollregion=(0, 0, 0, self.user_total * self.USER_ROW_HEIGHT))
+        self._render_visible_users()
+
+    def _user_at(self, index):
+        page = index // self.USER_PAGE_SIZE
+        if page not in self.user_pages:
+            self.user_pages[page] = db.search_users(self.user_query, page * self.USER_PAGE_SIZE, self.USER_PAGE_SIZE)
+        rows = self.user_pages[page]
+        offset = index - page * self.USER_PAGE_SIZE
+        return rows[offset] if offset < len(rows) else None
+
+    def _render_visible_users(self):
+        if not getattr(self, 'user_total', 0) or not self.db_window.winfo_exists():
+            return
+        top = self.user_canvas.canvasy(0)
+        first = max(0, int(top // self.USER_ROW_HEIGHT) - 1)
+        last = min(self.user_total, int((top + self.user_canvas.winfo_height()) // self.USER_ROW_HEIGHT) + 2)
+        for index in [i for i in self.user_rows if i < first or i >= last]:
+            window_id, user_frame, _, _ = self.user_rows.pop(index)
+            self.user_canvas.delete(window_id); user_frame.destroy()
+        width = max(self.user_canvas.winfo_width() - 20, 200)
+        for index in range(first, last):
+            if index in self.user_rows: continue
+            user_data = self._user_at(index)
+            if user_data is None: continue
+            user_frame, photo_label = self._build_user_row(user_data)
+            window_id = self.user_canvas.create_window(10, index * self.USER_ROW_HEIGHT + 5, window=user_frame, anchor="nw",
+                                                       width=width, height=self.USER_ROW_HEIGHT - 10)
+            self.user_rows[index] = (window_id, user_frame, photo_label, user_data['photo_hash'])
+
+    def _build_user_row(self, user_data):
+        user_frame = Frame(self.user_canvas, borderwidth=1, relief="solid", padx=5, pady=5)
+        photo_label = Label(user_frame, text="Нет фото" if not user_data['photo_hash'] else "...", width=12, height=6)
+        photo_label.grid(row=0, column=0, rowspan=3, padx=10, pady=5)
+        if user_data['photo_hash']:
+            thumbnail = self.thumbnails.get(user_data['photo_hash'])
+            if thumbnail is not None: self._set_thumbnail(photo_label, thumbnail)
+            else: self.thumbnails.request(user_data['photo_hash'], user_data['photo_path'])
+        info_frame = Frame(user_frame)
+        Label(info_frame, text=f"Имя: {user_data['first_name']}", font=("Arial", 10)).pack(anchor="w")
+        Label(info_frame, text=f"Фамилия: {user_data['last_name']}", font=("Arial", 10)).pack(anchor="w")
+        Label(info_frame, text=f"ID: {user_data['id']}", font=("Arial", 8)).pack(anchor="w")
+        info_frame.grid(row=0, column=1, sticky="w", rowspan=2)
+        buttons_frame = Frame(user_frame)
+        Button(buttons_frame, text="Подробнее", command=lambda u_id=user_data['id']: self.show_user_details(u_id)).pack(side="left", padx=5)
+        Button(buttons_frame, text="Редактировать", command=lambda u_id=user_data['id']: self.open_edit_user_window(u_id)).pack(side="left", padx=5)
+        Button(buttons_frame, text="Удалить", fg="red", command=lambda u_id=user_data['id']: self.delete_user_action(u_id)).pack(side="left", padx=5)
+        buttons_frame.grid(row=2, column=1, sticky="w", pady=5)
+        return user_frame, photo_label
+
+    def _set_thumbnail(self, photo_label, thumbnail):
+        photo_img = ImageTk.PhotoImage(thumbnail)
+        photo_label.config(image=photo_img, text="", width=0, height=0); photo_label.image = photo_img
+
+    def _poll_thumbnails(self):
+        """Подставляет миниатюры, подготовленные фоновым потоком, в видимые строки."""
+        if not self.db_window.winfo_exists():
+            return
+        ready = set(self.thumbnails.ready())
+        if ready:
+            for _, _, photo_label, photo_hash in self.user_rows.values():
+                if photo_hash in ready:
+                    thumbnail = self.thumbnails.get(photo_hash)
+                    if thumbnail is not None: self._set_thumbnail(photo_label, thumbnail)
+        self.db_window.after(100, self._poll_thumbnails)
 
     def open_add_user_window(self):
         # ... (аналогично предыдущему коду)
@@ -307,7 +356,7 @@ class App:
             if not all([user_id, first_name, last_name, self.new_user_photo_path]): messagebox.showerror("Ошибка", "ID, Имя, Фамилия и Фото являются обязательными полями.", parent=add_window); return
             try:
                 with open(self.new_user_photo_path, 'rb') as f: photo_data = f.read()
-                if db.add_user(user_id, first_name, last_name, passport, departament, photo_data): messagebox.showinfo("Успех", "Новый пользователь успешно добавлен.", parent=add_window); add_window.destroy(); self.refresh_user_db_window()
+                if db.add_user(user_id, first_name, last_name, passport, departament, photo_data): messagebox.showinfo("Успех", "Новый пользователь успешно добавлен.", parent=add_window); add_window.destroy(); self.refresh_user_db_window(user_id)
                 else: messagebox.showerror("Ошибка", f"Пользователь с ID '{user_id}' уже существует.", parent=add_window)
             except Exception as e: messagebox.showerror("Ошибка сохранения", f"Произошла ошибка: {e}", parent=add_window)
         Button(add_window, text="Сохранить пользователя", command=_save_user).pack(pady=10)
@@ -324,7 +373,7 @@ class App:
         def _save_changes():
             first_name, last_name = first_name_entry.get().strip(), last_name_entry.get().strip()
             if not first_name or not last_name: messagebox.showerror("Ошибка", "Имя и Фамилия не могут быть пустыми.", parent=edit_window); return
-            try: db.update_user(user_id, first_name, last_name, passport_entry.get().strip(), departament_entry.get().strip()); messagebox.showinfo("Успех", "Данные пользователя обновлены.", parent=edit_window); edit_window.destroy(); self.refresh_user_db_window()
+            try: db.update_user(user_id, first_name, last_name, passport_entry.get().strip(), departament_entry.get().strip()); messagebox.showinfo("Успех", "Данные пользователя обновлены.", parent=edit_window); edit_window.destroy(); self.refresh_user_db_window(user_id)
             except Exception as e: messagebox.showerror("Ошибка", f"Произошла ошибка: {e}", parent=edit_window)
         Button(edit_window, text="Сохранить изменения", command=_save_changes).pack(pady=10)
 
@@ -335,10 +384,13 @@ class App:
         
     def delete_user_action(self, user_id):
         if messagebox.askyesno("Подтверждение", f"Вы уверены, что хотите удалить пользователя с ID {user_id}? Это действие необратимо."):
-            db.delete_user(user_id); messagebox.showinfo("Успех", "Пользователь удален."); self.refresh_user_db_window()
+            db.delete_user(user_id); messagebox.showinfo("Успех", "Пользователь удален."); self.refresh_user_db_window(user_id, removed=True)
 
-    def refresh_user_db_window(self):
-        self.populate_user_list(); self.load_known_users()
+    def refresh_user_db_window(self, user_id, removed=False):
+        self.populate_user_list()
+        # В галерее обновляется только этот пользователь; кодирование фото - вне потока GUI
+        if removed: self.gallery.remove_user(user_id)
+        else: threading.Thread(target=self.gallery.refresh_user, args=(user_id,), daemon=True).start()
 
     # --- Методы управления помещениями и доступом ---
     def open_rooms_management_window(self):
@@ -417,131 +469,76 @@ class App:
                 self.log_widget.config(state="disabled"); self.log_widget.see(END)
         finally: self.root.after(100, self.process_log_queue)
 
+    def get_camera_manager(self):
+        if self.camera_manager is None:
+            try:
+                self.camera_manager = CameraManager(self.matcher, snapshot_writer=self.snapshot_writer)
+            except FileNotFoundError as e:
+                messagebox.showerror("Ошибка", str(e)); return None
+            self.camera_manager.add_listener(self.on_camera_event); self.camera_manager.add_listener(self.journal.record)
+        return self.camera_manager
+
+    def on_camera_event(self, event): self.log_event(event['message'], event['level'])
+
     def start_stream(self):
         ip_address = self.ip_entry.get(); port = self.port_entry.get(); location = self.location_entry.get().strip()
         if not ip_address or not port or not port.isdigit() or not location:
             messagebox.showerror("Ошибка", "Название/Место, IP-адрес и порт должны быть корректно заполнены."); return
-        self.recent_detections.clear()
+        manager = self.get_camera_manager()
+        if manager is None: return
         if location not in self.camera_history: self.history_listbox.insert(0, location)
-        self.camera_history[location] = {"ip": ip_address, "port": port}; self.save_camera_history()
-        rtsp_url = f"rtsp://admin:admin@{ip_address}:{port}"; self.is_running = True
-        self.start_button.config(state="disabled"); self.stop_button.config(state="normal")
-        self.rtsp_cap = RTSPVideoCapture(rtsp_url); self.rtsp_cap.start()
-        self.video_thread = threading.Thread(target=self.video_loop, args=(location, ip_address), daemon=True)
-        self.video_thread.start(); self.update_gui_frame()
+        entry = {"ip": ip_address, "port": port}
+        if self.camera_history.get(location) != entry: # Файл переписывается только при изменении истории
+            self.camera_history[location] = entry; self.save_camera_history()
+        manager.start_camera({'camera_ip': ip_address, 'port': port, 'location': location})
+        self.on_streams_started(ip_address)
+
+    def start_all_streams(self):
+        cameras = db.get_all_camera_configs()
+        if not cameras: messagebox.showerror("Ошибка", "Нет зарегистрированных камер."); return
+        manager = self.get_camera_manager()
+        if manager is None: return
+        manager.start_all(cameras)
+        self.on_streams_started(cameras[0]['camera_ip'])
+
+    def on_streams_started(self, camera_ip):
+        self.stop_button.config(state="normal"); self.refresh_display_menu(); self.display_var.set(camera_ip)
+        if not self.is_running: self.is_running = True; self.update_gui_frame()
+
+    def refresh_display_menu(self):
+        menu = self.display_menu["menu"]; menu.delete(0, END)
+        streams = self.camera_manager.streams if self.camera_manager else {}
+        for camera_ip, stream in streams.items():
+            menu.add_command(label=f"{stream.location} ({camera_ip})", command=lambda ip=camera_ip: self.display_var.set(ip))
+
+    def show_camera(self, camera_ip): self.display_camera = camera_ip or None
 
     def stop_stream(self):
         self.is_running = False
-        if self.rtsp_cap: self.rtsp_cap.stop()
-        if self.video_thread: self.video_thread.join(timeout=1.0)
-        while not self.frame_queue.empty():
-            try: self.frame_queue.get_nowait()
-            except queue.Empty: continue
-        self.start_button.config(state="normal"); self.stop_button.config(state="disabled")
+        if self.camera_manager: self.camera_manager.stop()
+        self.stop_button.config(state="disabled"); self.refresh_display_menu(); self.display_var.set("")
         self.video_label.config(image='', background="black"); self.video_label.image = None
 
     def on_closing(self):
-        self.stop_stream(); self.frame_saver.stop(); self.root.destroy()
+        self.stop_stream(); self.snapshot_writer.stop(); self.journal.stop(); self.root.destroy()
 
     def update_gui_frame(self):
-        try:
-            frame = self.frame_queue.get_nowait()
-            img = Image.fromarray(frame); imgtk = ImageTk.PhotoImage(image=img)
-            self.video_label.imgtk = imgtk; self.video_label.config(image=imgtk)
-        except queue.Empty: pass
-        if self.is_running: self.root.after(33, self.update_gui_frame)
-
-    def video_loop(self, location_name, ip_address):
-        SAVE_FOLDER = "detected_faces"; os.makedirs(SAVE_FOLDER, exist_ok=True)
-        import face_recognition
-        room_id = db.get_room_by_camera_ip(ip_address)
-        if not room_id: print(f"ВНИМАНИЕ: Камера с IP {ip_address} не привязана к помещению.")
-        else: print(f"Камера {ip_address} работает в помещении '{room_id}'")
-
-        known_encodings = [user["encoding"] for user in self.known_users]
-        user_data_by_index = {i: user for i, user in enumerate(self.known_users)}
-        
-        yunet_model_path = "face_detection_yunet_2023mar.onnx"
-        if not os.path.exists(yunet_model_path): messagebox.showerror("Ошибка", f"Модель '{yunet_model_path}' не найдена!"); return
-        face_detector, active_trackers, tracked_names = None, [], []
-        re_recognition_interval, frame_count, DETECTION_COOLDOWN_SECONDS = 15, 0, 30
-
-        while self.is_running:
-            ret, frame = self.rtsp_cap.read()
-            if not ret: time.sleep(0.1); continue
-            
-            boxes_for_drawing, names_for_drawing = [], []
-            if frame_count % re_recognition_interval == 0:
-                active_trackers, tracked_names = [], []
-                if face_detector is None and frame is not None: height, width, _ = frame.shape; face_detector = cv2.FaceDetectorYN.create(yunet_model_path, "", (width, height))
-                if face_detector is not None:
-                    h, w, _ = frame.shape; face_detector.setInputSize((w, h)); _, detected_faces = face_detector.detect(frame)
-                    if detected_faces is not None and self.known_users:
-                        # --- НАЧАЛО БЛОКА ДЛЯ ОТЛАДКИ ---
-                        print(f"[DEBUG] Найдено лиц на кадре: {len(detected_faces)}. Известных пользователей: {len(self.known_users)}")
-                        # --- КОНЕЦ БЛОКА ДЛЯ ОТЛАДКИ ---
-
-                        rgb_frame_proc = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        for face_data in detected_faces:
-                            box = face_data[0:4].astype(np.int32); (x,y,w,h) = box
-                            encodings = face_recognition.face_encodings(rgb_frame_proc, [(y, x + w, y + h, x)])
-                            
-                            # --- НАЧАЛО БЛОКА ДЛЯ ОТЛАДКИ ---
-                            if not encodings:
-                                print("[DEBUG] Не удалось создать кодировку для обнаруженного лица.")
-                                continue
-                            # --- КОНЕЦ БЛОКА ДЛЯ ОТЛАДКИ ---
-
-                            matches = face_recognition.compare_faces(known_encodings, encodings[0], tolerance=0.5)
-                            
-                            # --- НАЧАЛО БЛОКА ДЛЯ ОТЛАДКИ ---
-                            print(f"[DEBUG] Результат сравнения: {matches}")
-                            # --- КОНЕЦ БЛОКА ДЛЯ ОТЛАДКИ ---
-                            
-                            name, user_departament = "Unknown", None
-                            if True in matches:
-                                user = user_data_by_index.get(matches.index(True))
-                                if user: name, user_departament = f"{user['name']} (ID: {user['id']})", user['departament']
-                            
-                            access_granted = db.check_access(user_departament, room_id)
-                            last_seen = self.recent_detections.get((name, location_name))
-                            if last_seen and (time.time() - last_seen) < DETECTION_COOLDOWN_SECONDS: continue
-                            self.recent_detections[(name, location_name)] = time.time()
-                            
-                            event_msg = f"Обнаружен '{name}' в '{location_name}'."
-                            log_level = "denied"
-                            if access_granted: event_msg += " Доступ разрешен."; log_level = "granted"
-                            elif name != "Unknown": event_msg += f" Доступ в '{room_id}' для отдела '{user_departament}' запрещен."
-                            else: event_msg += " Доступ запрещен (неопознан)."
-                            self.log_event(event_msg, log_level)
-                            
-                            # Сохранение кадра и добавление трекера
-                            frame_to_save = frame.copy(); cv2.rectangle(frame_to_save, (x, y), (x + w, y + h), (0, 0, 255), 2)
-                            cv2.putText(frame_to_save, name, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                            safe_name = name.replace(" ", "_").replace(":", "-").replace("(", "").replace(")", "")
-                            filename = f"{SAVE_FOLDER}/{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{safe_name}.jpg"
-                            self.frame_saver.save(filename, frame_to_save)
-                            tracker = cv2.TrackerCSRT_create(); tracker.init(frame, tuple(box)); active_trackers.append(tracker); tracked_names.append(name)
-            else:
-                new_trackers, new_names = [], []
-                for i, tracker in enumerate(active_trackers):
-                    success, box = tracker.update(frame)
-                    if success: new_trackers.append(tracker); new_names.append(tracked_names[i]); boxes_for_drawing.append(box); names_for_drawing.append(tracked_names[i])
-                active_trackers, tracked_names = new_trackers, new_names
-            
-            frame_count += 1
-            for box, name in zip(boxes_for_drawing, names_for_drawing):
-                (x, y, w, h) = [int(v) for v in box]
-                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                cv2.putText(frame, name, (x + 6, y + h - 6), cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
-            
+        stream = self.camera_manager.get_stream(self.display_camera) if self.camera_manager and self.display_camera else None
+        if stream is not None:
             try:
-                if self.frame_queue.full(): self.frame_queue.get_nowait()
-                self.frame_queue.put_nowait(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            except queue.Full: pass
+                frame = stream.display_frame()
+                if frame is not None:
+                    img = Image.fromarray(frame); imgtk = ImageTk.PhotoImage(image=img)
+                    self.video_label.imgtk = imgtk; self.video_label.config(image=imgtk)
             except Exception as e: print(f"Ошибка в видеопотоке: {e}")
+        # Окно обновляется не чаще, чем камера выдает кадры (при перегрузке расписание снижает ее FPS)
+        delay = min(self.GUI_MAX_DELAY_MS, max(self.GUI_MIN_DELAY_MS, int(1000 / stream.fps))) if stream is not None and stream.fps else self.GUI_MIN_DELAY_MS
+        if self.is_running: self.root.after(delay, self.update_gui_frame)
 
 # --- Точка входа в программу ---
 if __name__ == "__main__":
+    # FAC_LOG_LEVEL=DEBUG включает отладочные сообщения распознавания; FAC_METRICS_INTERVAL=N - сводку метрик каждые N секунд
+    logging.basicConfig(level=os.environ.get('FAC_LOG_LEVEL', 'WARNING').upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if os.environ.get('FAC_METRICS_INTERVAL'): MetricsReporter(float(os.environ['FAC_METRICS_INTERVAL'])).start()
     if shutil.which("cmake") is None: messagebox.showerror("Критическая ошибка", "CMake не найден. Установите его и добавьте в PATH.")
     else: root = Tk(); app = App(root); root.mainloop()
\ No newline at end of file
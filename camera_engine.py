@@ -0,0 +1,494 @@
+import logging
+import os
+import threading
+import time
+import queue
+from collections import deque
+from datetime import datetime
+import numpy as np
+import cv2
+import database as db
+from encoder_pool import EncoderPool, EncoderPoolBusy
+from cooldown import CooldownCache
+from motion import MotionGate, MOTION_THRESHOLD, MOTION_MIN_AREA, roi_bounds, in_roi
+from recognition import Recognizer
+from tracking import TrackManager, DEFAULT_TRACKER, TRACKER_BACKENDS, create_tracker_backend
+from journal import AccessJournal
+from metrics import REGISTRY, MetricsReporter, serve_metrics
+from scheduler import AdaptiveScheduler
+from snapshots import SnapshotWriter
+from video_io import RTSPVideoCapture
+
+# --- Настройки по умолчанию ---
+DEFAULT_PORT = "1935"
+DEFAULT_DETECTION_INTERVAL = 15 # Каждый N-й кадр камеры отправляется на распознавание
+DETECTION_COOLDOWN_SECONDS = 30
+PIPELINE_STAGES = ('capture', 'detect', 'encode', 'match', 'access', 'track', 'display') # Этапы с гистограммами задержки
+
+
+def camera_url(camera):
+    """Строит URL видеопотока по записи камеры (поле 'url' имеет приоритет)."""
+    if camera.get('url'):
+        return camera['url']
+    return f"rtsp://admin:admin@{camera['camera_ip']}:{camera.get('port') or DEFAULT_PORT}"
+
+
+def parse_size(value):
+    """Разбирает размер '640x360' или [640, 360] в кортеж (ширина, высота); None - исходное разрешение."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.lower().split('x')
+    width, height = (int(v) for v in value)
+    return width, height
+
+
+def default_worker_count():
+    return max(1, min(8, (os.cpu_count() or 2) // 2))
+
+
+class InferenceScheduler:
+    """
+    Общий пул потоков распознавания для всех камер.
+
+    У каждой камеры не более одной задачи в очереди (новый кадр заменяет
+    ожидающий), а камеры обслуживаются по кругу, поэтому загруженная камера
+    на входе не может вытеснить остальные.
+    """
+
+    def __init__(self, handler, workers=None):
+        self.handler = handler  # handler(stream, ref); обработчик сам освобождает ссылку на кадр
+        self.workers = workers or default_worker_count()
+        self._pending = {}  # camera_ip -> (stream, FrameRef)
+        self._order = deque()
+        self._in_progress = set()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.is_running = False
+
+    def start(self):
+        if self.is_running: return
+        self.is_running = True
+        self._threads = [threading.Thread(target=self._worker, daemon=True, name=f"inference-{i}") for i in range(self.workers)]
+        for thread in self._threads: thread.start()
+
+    def stop(self):
+        with self._cond:
+            self.is_running = False; self._order.clear(); self._cond.notify_all()
+            for _, ref in self._pending.values(): ref.release()
+            self._pending.clear()
+        for thread in self._threads: thread.join(timeout=2)
+        self._threads = []
+
+    def submit(self, stream, ref):
+        """
+        Ставит кадр камеры (FrameRef) в очередь; возвращает False, если камера
+        еще обрабатывается. Ссылка переходит планировщику в любом случае.
+        """
+        key = stream.camera_ip
+        with self._cond:
+            if not self.is_running or key in self._in_progress:
+                ref.release(); stream.detect_rejected += 1
+                return False
+            previous = self._pending.get(key)
+            if previous is None:
+                self._order.append(key)
+            else:
+                previous[1].release(); stream.detect_replaced += 1 # Новый кадр заменяет ожидающий
+            self._pending[key] = (stream, ref)
+            self._cond.notify()
+            return True
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def discard(self, camera_ip):
+        with self._cond:
+            pending = self._pending.pop(camera_ip, None)
+            if pending is not None:
+                self._order.remove(camera_ip); pending[1].release()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self.is_running and not self._order:
+                    self._cond.wait(0.5)
+                if not self.is_running:
+                    return
+                key = self._order.popleft()
+                stream, ref = self._pending.pop(key)
+                self._in_progress.add(key)
+            try:
+                self.handler(stream, ref)
+            except Exception as e:
+                ref.release()
+                print(f"[Engine] Ошибка распознавания для камеры {key}: {e}")
+            finally:
+                with self._cond:
+                    self._in_progress.discard(key)
+
+
+class CameraStream:
+    """Один видеопоток: захват кадров, сопровождение лиц трекерами и выдача кадров для отображения."""
+
+    def __init__(self, manager, camera):
+        self.manager = manager
+        self.camera = camera
+        self.camera_ip = camera['camera_ip']
+        self.location = camera.get('location') or camera.get('name_rooms') or self.camera_ip
+        self.room_id = db.get_room_by_camera_ip(self.camera_ip)
+        self.detection_interval = camera.get('detection_interval') or manager.detection_interval
+        self.detection_size = parse_size(camera.get('detection_size')) or manager.detection_size
+        self.roi = camera.get('roi') # Многоугольники зоны интереса в долях кадра
+        self.motion_gate = None
+        if manager.motion_gating and camera.get('motion_gate', True):
+            self.motion_gate = MotionGate(self.roi, camera.get('motion_threshold') or MOTION_THRESHOLD,
+                                          camera.get('motion_min_area') or MOTION_MIN_AREA)
+        metrics = manager.metrics
+        self.latency = {stage: metrics.histogram('fac_stage_seconds', "Длительность этапа конвейера, с", camera=self.camera_ip, stage=stage)
+                        for stage in PIPELINE_STAGES}
+        self.frames = metrics.counter('fac_frames_total', "Кадры, обработанные потоком камеры", camera=self.camera_ip)
+        self.encoder_calls = metrics.counter('fac_encoder_calls_total', "Вызовы кодировщика лиц", camera=self.camera_ip)
+        self.capture = RTSPVideoCapture(camera_url(camera), camera.get('fps') or manager.fps, latency=self.latency['capture'])
+        self.display_queue = queue.Queue(maxsize=2) # (FrameRef, рамки треков)
+        self._display_buffer = None
+        self.tracks = TrackManager()
+        # Трекер задается в записи камеры ('tracker', 'tracking_scale') или по умолчанию для движка
+        self.tracker_backend = create_tracker_backend(camera.get('tracker') or manager.tracker,
+                                                      camera.get('tracking_scale'), max_age=2 * self.detection_interval)
+        self.encoded_faces = 0; self.reused_faces = 0 # Лица, отправленные в кодировщик / взятые из кэша трека
+        self.idle_skipped = 0 # Циклы обнаружения, пропущенные из-за отсутствия движения
+        self.detect_rejected = 0; self.detect_replaced = 0 # Кадры на обнаружение: камера занята / заменены более новым
+        self.display_dropped = 0
+        self.fps = 0.0 # Фактическая частота обработки кадров за последнюю секунду
+        self.is_running = False; self.thread = None
+
+    def start(self):
+        if not self.room_id: print(f"ВНИМАНИЕ: Камера с IP {self.camera_ip} не привязана к помещению.")
+        else: print(f"Камера {self.camera_ip} работает в помещении '{self.room_id}'")
+        self.is_running = True
+        self.capture.start()
+        self.thread = threading.Thread(target=self._loop, daemon=True, name=f"camera-{self.camera_ip}"); self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        if self.thread is not None: self.thread.join(timeout=1.0)
+        self._clear_display()
+        self.capture.stop()
+
+    def set_detection_interval(self, interval):
+        """Меняет интервал обнаружения на лету (адаптивное расписание); срок жизни рамок трекера растет вместе с ним."""
+        if interval == self.detection_interval: return
+        self.detection_interval = interval
+        if hasattr(self.tracker_backend, 'max_age'):
+            self.tracker_backend.max_age = 2 * interval
+            for track in self.tracks.tracks():
+                if hasattr(track.tracker, 'max_age'): track.tracker.max_age = 2 * interval
+
+    def _should_detect(self, frame):
+        """Обнаружение нужно при движении в зоне интереса или пока на кадре есть сопровождаемые лица."""
+        if self.motion_gate is None:
+            return True
+        moving = self.motion_gate.check(frame) # Фон обновляется на каждом цикле обнаружения
+        return moving or bool(self.tracks.tracks())
+
+    def _loop(self):
+        frame_count, last_seq = 0, -1
+        fps_count, fps_start = 0, time.monotonic()
+        while self.is_running:
+            ref = self.capture.read_latest(last_seq, timeout=0.5)
+            if ref is None: continue # Нового кадра нет (переподключение или камера молчит)
+            last_seq, frame = ref.seq, ref.frame
+
+            if frame_count % self.detection_interval == 0:
+                # Пул распознавания получает свою ссылку на кадр и освобождает ее сам
+                if self._should_detect(frame): self.manager.scheduler.submit(self, ref.retain())
+                else: self.idle_skipped += 1
+            boxes_for_drawing = []
+            start = time.perf_counter()
+            prepared = self.tracker_backend.prepare(frame)
+            for track in self.tracks.tracks():
+                tracker = track.tracker
+                if tracker is None: continue
+                success, box = self.tracker_backend.update(tracker, prepared)
+                if success: track.box = tuple(box); boxes_for_drawing.append((box, track.name))
+                else: self.tracks.set_tracker(track, None) # Трек сохраняет личность до следующего обнаружения
+            self.latency['track'].observe(time.perf_counter() - start)
+            frame_count += 1; fps_count += 1; self.frames.inc()
+            now = time.monotonic()
+            if now - fps_start >= 1.0:
+                self.fps, fps_count, fps_start = fps_count / (now - fps_start), 0, now
+
+            # В очередь отображения попадает ссылка на кадр буфера, а не его копия
+            if self.display_queue.full():
+                try: self.display_queue.get_nowait()[0].release(); self.display_dropped += 1
+                except queue.Empty: pass
+            try: self.display_queue.put_nowait((ref, boxes_for_drawing))
+            except queue.Full: ref.release()
+
+    def display_frame(self):
+        """
+        Последний кадр для отображения (RGB с рамками треков) или None. Перевод
+        в RGB и рисование выполняются только для показываемой камеры, в буфер,
+        который переиспользуется до следующего вызова.
+        """
+        try:
+            ref, boxes = self.display_queue.get_nowait()
+        except queue.Empty:
+            return None
+        start = time.perf_counter()
+        with ref:
+            if self._display_buffer is None or self._display_buffer.shape != ref.frame.shape:
+                self._display_buffer = np.empty_like(ref.frame)
+            display_frame = cv2.cvtColor(ref.frame, cv2.COLOR_BGR2RGB, dst=self._display_buffer)
+        for box, name in boxes:
+            (x, y, w, h) = [int(v) for v in box]
+            cv2.rectangle(display_frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            cv2.putText(display_frame, name, (x + 6, y + h - 6), cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
+        self.latency['display'].observe(time.perf_counter() - start)
+        return display_frame
+
+    def _clear_display(self):
+        while True:
+            try: self.display_queue.get_nowait()[0].release()
+            except queue.Empty: break
+
+
+class CameraManager:
+    """
+    Движок видеонаблюдения без GUI: запускает по потоку захвата на каждую
+    камеру и распределяет распознавание по общему пулу потоков. Графический
+    интерфейс и другие потребители подписываются на события через add_listener.
+    """
+
+    def __init__(self, matcher, snapshot_writer=None, workers=None, encoder_workers=0, tracker=DEFAULT_TRACKER,
+                 detection_interval=DEFAULT_DETECTION_INTERVAL, detection_size=None, motion_gating=True, fps=None,
+                 cooldown_seconds=DETECTION_COOLDOWN_SECONDS, metrics=None, adaptive=True):
+        # encoder_workers > 0: кодирование лиц в отдельных процессах, иначе в потоках пула распознавания
+        self.recognizer = Recognizer(matcher)
+        self.encoder_workers = encoder_workers
+        self.tracker = tracker
+        self.scheduler = InferenceScheduler(self._process, workers)
+        self.encoder_dropped = 0
+        self.snapshot_writer = snapshot_writer
+        self.detection_interval = detection_interval
+        self.detection_size = parse_size(detection_size) # None - обнаружение на исходном разрешении камеры
+        self.fps = fps # Частота декодирования кадров камеры; None - сколько успевает поток камеры
+        self.motion_gating = motion_gating # Пропускать обнаружение, пока в зоне интереса камеры нет движения
+        self.cooldown_seconds = cooldown_seconds
+        self.cooldowns = CooldownCache(cooldown_seconds) # Повтор события по той же личности в том же месте подавляется
+        self.streams = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+        self.metrics = metrics or REGISTRY
+        self._register_gauges()
+        # Адаптивное расписание: интервал обнаружения и FPS камер подстраиваются под стоимость и загрузку
+        self.adaptive = AdaptiveScheduler(self) if adaptive else None
+
+    def _register_gauges(self):
+        """Датчики вычисляются только при выгрузке метрик (Prometheus или периодическая сводка)."""
+        metrics = self.metrics
+        streams = lambda: list(self.streams.values())
+        metrics.gauge('fac_camera_fps', lambda: [({'camera': s.camera_ip}, round(s.fps, 2)) for s in streams()],
+                      "Фактическая частота обработки кадров камеры")
+        metrics.counters('fac_dropped_frames_total', lambda: [({'camera': s.camera_ip, 'reason': reason}, value) for s in streams()
+                                                              for reason, value in (('capture', s.capture.dropped), ('display', s.display_dropped),
+                                                                                    ('detect_busy', s.detect_rejected), ('detect_replaced', s.detect_replaced))],
+                         "Кадры, отброшенные на этапах конвейера")
+        metrics.counters('fac_detection_skipped_total', lambda: [({'camera': s.camera_ip}, s.idle_skipped) for s in streams()],
+                         "Циклы обнаружения, пропущенные без движения в кадре")
+        metrics.counters('fac_faces_total', lambda: [({'camera': s.camera_ip, 'source': source}, value) for s in streams()
+                                                     for source, value in (('encoded', s.encoded_faces), ('track_cache', s.reused_faces))],
+                         "Лица: закодированные и взятые из кэша трека")
+        metrics.counters('fac_encoder_dropped_total', lambda: [({}, self.encoder_dropped)], "Кадры, отброшенные из-за занятого пула кодирования")
+        metrics.gauge('fac_cooldown', lambda: [({'result': key}, value) for key, value in self.cooldowns.stats().items()],
+                      "Кэш подавления повторных событий")
+
+        def _queues():
+            depths = [({'queue': 'inference'}, self.scheduler.depth())]
+            depths += [({'queue': 'display', 'camera': s.camera_ip}, s.display_queue.qsize()) for s in streams()]
+            if self.snapshot_writer is not None: depths.append(({'queue': 'snapshots'}, self.snapshot_writer.depth()))
+            return depths
+        metrics.gauge('fac_queue_depth', _queues, "Глубина очередей конвейера", source='engine')
+
+    def add_listener(self, listener):
+        """listener(event) вызывается из потоков пула для каждого события доступа."""
+        self.listeners.append(listener)
+
+    def set_matcher(self, matcher):
+        self.recognizer.set_matcher(matcher)
+
+    def start_camera(self, camera):
+        """Запускает (или перезапускает) видеопоток камеры; camera - запись из cameras.json."""
+        self.stop_camera(camera['camera_ip'])
+        if self.encoder_workers and self.recognizer.encoder_pool is None:
+            self.recognizer.encoder_pool = EncoderPool(self.encoder_workers)
+        self.scheduler.start()
+        if self.adaptive is not None: self.adaptive.start()
+        stream = CameraStream(self, camera)
+        with self._lock:
+            self.streams[stream.camera_ip] = stream
+        stream.start()
+        return stream
+
+    def start_all(self, cameras):
+        for camera in cameras:
+            self.start_camera(camera)
+
+    def stop_camera(self, camera_ip):
+        with self._lock:
+            stream = self.streams.pop(camera_ip, None)
+        if stream is not None:
+            stream.stop(); self.scheduler.discard(camera_ip)
+
+    def stop(self):
+        for camera_ip in list(self.streams):
+            self.stop_camera(camera_ip)
+        self.scheduler.stop()
+        if self.adaptive is not None: self.adaptive.stop()
+        if self.recognizer.encoder_pool is not None:
+            self.recognizer.encoder_pool.close(); self.recognizer.encoder_pool = None
+        self.cooldowns.clear()
+
+    def get_stream(self, camera_ip):
+        return self.streams.get(camera_ip)
+
+    def _emit(self, event):
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"[Engine] Ошибка обработчика событий: {e}")
+
+    def _process(self, stream, ref):
+        """
+        Обнаруживает лица кадра (в потоке пула распознавания) внутри зоны
+        интереса камеры, привязывает их к трекам камеры и отправляет на кодирование только новые, неуверенные и
+        устаревшие треки; результат обрабатывается асинхронно в _on_recognized.
+        Ссылка на кадр буфера держится, пока кадр может понадобиться для снимка.
+        """
+        frame = ref.frame
+        height, width = frame.shape[:2]
+        with stream.latency['detect'].time():
+            detected_faces = self.recognizer.detect(frame, stream.detection_size, roi_bounds(stream.roi, width, height))
+        # Лицо учитывается, если его центр лежит внутри одного из многоугольников зоны
+        boxes = [face_data[0:4].astype(np.int32) for face_data in detected_faces
+                 if in_roi(stream.roi, (face_data[0] + face_data[2] / 2, face_data[1] + face_data[3] / 2), width, height)]
+        pending = []
+        backend = stream.tracker_backend
+        prepared = backend.prepare(frame)
+        for track, box, needs_encoding in stream.tracks.associate(boxes):
+            stream.tracks.set_tracker(track, backend.correct(track.tracker, prepared, box))
+            if needs_encoding: pending.append((track, box))
+        stream.encoded_faces += len(pending); stream.reused_faces += len(boxes) - len(pending)
+        if not pending:
+            ref.release()
+            return
+        timings = {}
+        try:
+            future = self.recognizer.identify_async(frame, [box for _, box in pending], timings)
+        except EncoderPoolBusy:
+            self.encoder_dropped += 1
+            ref.release()
+            return
+        stream.encoder_calls.inc()
+        tracks = [track for track, _ in pending]
+        future.add_done_callback(lambda done: self._on_recognized(stream, ref, tracks, done, timings))
+
+    def _on_recognized(self, stream, ref, tracks, future, timings=None):
+        """Обновляет личности треков, проверяет доступ и формирует события."""
+        with ref:
+            try:
+                faces = future.result()
+            except Exception as e:
+                print(f"[Engine] Ошибка кодирования лиц для камеры {stream.camera_ip}: {e}")
+                return
+            for stage, seconds in (timings or {}).items():
+                stream.latency[stage].observe(seconds)
+            self._handle_faces(stream, ref.frame, tracks, faces)
+
+    def _handle_faces(self, stream, frame, tracks, faces):
+        for track, face in zip(tracks, faces):
+            if not stream.tracks.set_identity(track, face['user'], face['distance'], face['encoding']):
+                continue # Личность трека не изменилась - событие уже сформировано ранее
+            (x, y, w, h) = [int(v) for v in face['box']]
+            user = track.user
+            name, user_departament = track.name, user['departament'] if user else None
+
+            start = time.perf_counter()
+            access_granted = db.check_access(user_departament, stream.room_id)
+            stream.latency['access'].observe(time.perf_counter() - start)
+            # Известный человек - по ID (тезки не глушат друг друга), неизвестный - по треку своей камеры
+            identity = ('user', user['id']) if user else ('track', stream.camera_ip, track.id)
+            if not self.cooldowns.allow((identity, stream.location)): continue
+
+            event_msg = f"Обнаружен '{name}' в '{stream.location}'."
+            log_level = "denied"
+            if access_granted: event_msg += " Доступ разрешен."; log_level = "granted"
+            elif name != "Unknown": event_msg += f" Доступ в '{stream.room_id}' для отдела '{user_departament}' запрещен."
+            else: event_msg += " Доступ запрещен (неопознан)."
+
+            # Сохранение кадра (копия кадра или вырезки делается при постановке в очередь)
+            now = time.time()
+            snapshot_path = None
+            if self.snapshot_writer is not None:
+                snapshot_path = self.snapshot_writer.submit(frame, (x, y, w, h), name, stream.camera_ip, now, track.id)
+
+            self._emit({'time': now, 'camera_ip': stream.camera_ip, 'location': stream.location,
+                        'room_id': stream.room_id, 'track_id': track.id, 'name': name, 'user': user, 'distance': track.distance,
+                        'access_granted': access_granted, 'message': event_msg, 'level': log_level,
+                        'snapshot_path': snapshot_path})
+
+
+def main():
+    import argparse
+    from matcher import FaceMatcher
+
+    parser = argparse.ArgumentParser(description="Запуск видеонаблюдения по всем камерам из cameras.json без GUI.")
+    parser.add_argument('--workers', type=int, default=None, help="Количество потоков распознавания")
+    parser.add_argument('--tracker', default=DEFAULT_TRACKER, choices=TRACKER_BACKENDS, help="Трекер лиц между обнаружениями")
+    parser.add_argument('--detection-size', default=None, help="Разрешение обнаружения лиц, например 640x360 (по умолчанию - исходное)")
+    parser.add_argument('--fps', type=float, default=None, help="Целевая частота обработки кадров каждой камеры")
+    parser.add_argument('--no-motion-gate', action='store_true', help="Запускать обнаружение независимо от движения в кадре")
+    parser.add_argument('--snapshot-workers', type=int, default=2, help="Количество потоков записи снимков")
+    parser.add_argument('--jpeg-quality', type=int, default=85, help="Качество JPEG снимков событий")
+    parser.add_argument('--crop-snapshots', action='store_true', help="Сохранять только вырезку лица вместо всего кадра")
+    parser.add_argument('--encoder-workers', type=int, default=0, help="Количество процессов кодирования лиц (0 - кодировать в потоках)")
+    parser.add_argument('--no-journal', action='store_true', help="Не записывать события в журнал access_journal.db")
+    parser.add_argument('--metrics-port', type=int, default=None, help="Порт HTTP /metrics в формате Prometheus")
+    parser.add_argument('--metrics-interval', type=float, default=0, help="Выводить сводку метрик каждые N секунд (0 - не выводить)")
+    parser.add_argument('--fixed-schedule', action='store_true', help="Не подстраивать интервал обнаружения и FPS камер под загрузку")
+    parser.add_argument('--log-level', default='WARNING', help="Уровень журнала (DEBUG - отладочные сообщения распознавания)")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db.initialize_database()
+    known_users = db.get_known_face_encodings()
+    print(f"Загружено {len(known_users)} пользователей из базы данных.")
+    snapshot_writer = SnapshotWriter(workers=args.snapshot_workers, quality=args.jpeg_quality, crop_only=args.crop_snapshots)
+    snapshot_writer.start()
+    manager = CameraManager(FaceMatcher(known_users, index=db.load_face_index()), snapshot_writer, workers=args.workers,
+                            encoder_workers=args.encoder_workers, tracker=args.tracker,
+                            detection_size=args.detection_size, motion_gating=not args.no_motion_gate, fps=args.fps,
+                            adaptive=not args.fixed_schedule)
+    manager.add_listener(lambda event: print(f"{datetime.fromtimestamp(event['time']).strftime('%Y-%m-%d %H:%M:%S')} - {event['message']}"))
+    journal = None
+    if not args.no_journal:
+        journal = AccessJournal(); journal.start()
+        manager.add_listener(journal.record)
+        REGISTRY.gauge('fac_queue_depth', lambda: [({'queue': 'journal'}, journal.stats()['queue_depth'])], source='journal')
+    if args.metrics_port: serve_metrics(args.metrics_port)
+    if args.metrics_interval: MetricsReporter(args.metrics_interval).start()
+    manager.start_all(db.get_all_camera_configs())
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.stop(); snapshot_writer.stop()
+        if journal is not None: journal.stop()
+
+
+if __name__ == "__main__":
+    main()
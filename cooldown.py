@@ -0,0 +1,73 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 10000
+
+
+class CooldownCache:
+    """
+    Ограниченный кэш «тишины» для событий доступа.
+
+    Ключ - идентичность (ID пользователя или трека) в конкретном месте; после
+    события по ключу повторные события подавляются ttl секунд. Истекшие ключи
+    удаляются по куче сроков, а при превышении max_size вытесняются самые
+    давно обновленные (LRU), поэтому память не растет за долгую работу, даже
+    если камеры видят много неизвестных лиц. Потокобезопасен.
+    """
+
+    def __init__(self, ttl, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expiry = OrderedDict() # ключ -> момент окончания тишины (порядок - давность обновления)
+        self._heap = [] # (момент окончания, ключ); устаревшие записи пропускаются при извлечении
+        self._lock = threading.Lock()
+        self.hits = 0 # Событие подавлено
+        self.misses = 0 # Событие разрешено
+        self.expired = 0
+        self.evictions = 0 # Вытеснено по размеру
+
+    def __len__(self):
+        with self._lock:
+            return len(self._expiry)
+
+    def _purge(self, now):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, key = heapq.heappop(heap)
+            if self._expiry.get(key) == expires:
+                del self._expiry[key]; self.expired += 1
+        if len(heap) > 2 * len(self._expiry) + 64:
+            # Слишком много устаревших записей кучи - перестраиваем ее
+            self._heap = [(expires, key) for key, expires in self._expiry.items()]
+            heapq.heapify(self._heap)
+
+    def allow(self, key, ttl=None, now=None):
+        """
+        Возвращает True, если событие по ключу можно сформировать (и начинает
+        для ключа новый период тишины), или False, если период еще не истек.
+        ttl переопределяет время тишины для этого ключа.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._purge(now)
+            if key in self._expiry:
+                self.hits += 1
+                return False
+            self.misses += 1
+            expires = now + (self.ttl if ttl is None else ttl)
+            self._expiry[key] = expires
+            heapq.heappush(self._heap, (expires, key))
+            while len(self._expiry) > self.max_size:
+                self._expiry.popitem(last=False); self.evictions += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear(); self._heap = []
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._expiry), 'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions}
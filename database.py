@@ -2,22 +2,96 @@ import json
 import os
 import shutil
 import io
+import re
+import sqlite3
+import threading
+import time
 import face_recognition
+from PIL import Image
+import face_cache
+import face_index
 
-# --- Константы для имен файлов ---
+# --- Константы для имен файлов (JSON-файлы используются только для переноса в SQLite) ---
 USERS_FILE = 'users.json'
 PHOTOS_DIR = 'user_photos' # Папка для хранения фотографий пользователей
 ROOMS_FILE = 'rooms.json'
 CAMERAS_FILE = 'cameras.json'
 ACCESS_RULES_FILE = 'access_rules.json'
+FACE_INDEX_DIR = 'users.index' # Индекс ближайших соседей рядом с users.json
 
-# --- Хранилища данных в памяти ---
-data_storage = {
-    'users': [],
-    'rooms': [],
-    'cameras': [],
-    'access_rules': []
-}
+DATABASE_FILE = 'access_control.db' # Основное хранилище (SQLite, режим WAL)
+USER_ID_PATTERN = re.compile(r"[\w-]{1,64}") # ID входит в имя файла фото: без разделителей путей и точек
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    first_name TEXT, last_name TEXT, passport_number TEXT, departament TEXT
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    id_rooms TEXT PRIMARY KEY,
+    name_rooms TEXT
+);
+CREATE TABLE IF NOT EXISTS cameras (
+    camera_ip TEXT PRIMARY KEY,
+    id_rooms TEXT,
+    config TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS cameras_room ON cameras (id_rooms);
+CREATE TABLE IF NOT EXISTS access_rules (
+    departament TEXT NOT NULL,
+    id_rooms TEXT NOT NULL,
+    PRIMARY KEY (departament, id_rooms)
+);
+CREATE INDEX IF NOT EXISTS access_rules_room ON access_rules (id_rooms);
+CREATE TABLE IF NOT EXISTS photos (
+    user_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Поля камеры, хранящиеся в отдельных столбцах; остальные (url, port, roi, fps...) - в config
+CAMERA_COLUMNS = ('camera_ip', 'id_rooms')
+
+_local = threading.local()
+
+# Индекс доступа: помещение -> frozenset отделов. Читается потоками камер без
+# блокировок: при изменении правил собирается новый словарь и подменяется целиком.
+_access_index = {}
+_access_lock = threading.Lock()
+
+# Сериализует загрузку, изменение и сохранение индекса лиц на диске: без нее
+# параллельные регистрации и удаления (потоки API) теряют изменения друг друга
+_face_index_lock = threading.RLock()
+
+def _connection():
+    """Соединение с базой для текущего потока (камеры и GUI работают в разных потоках)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_FILE, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def _query(sql, params=()):
+    return [dict(row) for row in _connection().execute(sql, params)]
+
+def _query_one(sql, params=()):
+    row = _connection().execute(sql, params).fetchone()
+    return dict(row) if row is not None else None
+
+def _execute(sql, params=()):
+    """Выполняет изменение в отдельной транзакции; возвращает число затронутых строк."""
+    conn = _connection()
+    with conn:
+        return conn.execute(sql, params).rowcount
 
 def _load_json(filename):
     """Загружает данные из JSON-файла."""
@@ -30,170 +104,408 @@ def _load_json(filename):
         print(f"Ошибка при чтении файла {filename}: {e}")
         return []
 
-def _save_json(filename, data):
-    """Сохраняет данные в JSON-файл."""
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-    except IOError as e:
-        print(f"Ошибка при сохранении файла {filename}: {e}")
+def _camera_row(camera):
+    config = {key: value for key, value in camera.items() if key not in CAMERA_COLUMNS}
+    return camera['camera_ip'], camera.get('id_rooms'), json.dumps(config, ensure_ascii=False)
+
+def _camera_from_row(row):
+    camera = json.loads(row.pop('config') or '{}')
+    camera.update(row)
+    return camera
+
+def migrate_from_json(force=False):
+    """
+    Однократно переносит users.json, rooms.json, cameras.json и access_rules.json
+    в базу SQLite одной транзакцией. Повторный запуск ничего не делает, пока не
+    задан force (тогда записи из JSON заменяют одноименные записи базы).
+    """
+    conn = _connection()
+    if not force and conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+        return False
+    users, rooms = _load_json(USERS_FILE), _load_json(ROOMS_FILE)
+    cameras, rules = _load_json(CAMERAS_FILE), _load_json(ACCESS_RULES_FILE)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO users (id, first_name, last_name, passport_number, departament) VALUES (?, ?, ?, ?, ?)",
+                         [(str(u['id']), u.get('first_name'), u.get('last_name'), u.get('passport_number'), u.get('departament'))
+                          for u in users])
+        conn.executemany("INSERT OR REPLACE INTO rooms (id_rooms, name_rooms) VALUES (?, ?)",
+                         [(room['id_rooms'], room.get('name_rooms')) for room in rooms])
+        conn.executemany("INSERT OR REPLACE INTO cameras (camera_ip, id_rooms, config) VALUES (?, ?, ?)",
+                         [_camera_row(camera) for camera in cameras])
+        conn.executemany("INSERT OR IGNORE INTO access_rules (departament, id_rooms) VALUES (?, ?)",
+                         [(rule['departament'], rule['id_rooms']) for rule in rules])
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (str(int(time.time())),))
+    print(f"Перенесено из JSON: пользователей {len(users)}, помещений {len(rooms)}, камер {len(cameras)}, правил {len(rules)}.")
+    return True
 
 def initialize_database():
-    """Инициализирует 'базу данных' путем загрузки всех JSON-файлов в память."""
-    data_storage['users'] = _load_json(USERS_FILE)
-    data_storage['rooms'] = _load_json(ROOMS_FILE)
-    data_storage['cameras'] = _load_json(CAMERAS_FILE)
-    data_storage['access_rules'] = _load_json(ACCESS_RULES_FILE)
-    
+    """Создает таблицы SQLite (при первом запуске переносит данные из JSON-файлов)."""
+    _connection().executescript(SCHEMA)
+    migrate_from_json()
+    _rebuild_access_index()
+
     os.makedirs(PHOTOS_DIR, exist_ok=True)
+    _index_photo_dir()
     
-    print("Данные из JSON-файлов загружены.")
+    print("База данных SQLite загружена.")
 
-# --- Функции для Пользователей (без изменений) ---
+# --- Функции для Пользователей ---
+
+def is_valid_user_id(user_id):
+    """ID пользователя безопасен как имя файла: буквы, цифры, '_' и '-'."""
+    return bool(USER_ID_PATTERN.fullmatch(str(user_id)))
 
 def add_user(user_id, first_name, last_name, passport, departament, photo_data):
-    if any(u['id'] == user_id for u in data_storage['users']):
-         # В исходном коде использовался photo_path, но GUI передает photo_data.
-         # Приводим к единому виду для согласованности.
-         return False
-    
-    new_user = {
-        "id": user_id, "first_name": first_name, "last_name": last_name,
-        "passport_number": passport, "departament": departament
-    }
-    data_storage['users'].append(new_user)
+    if not is_valid_user_id(user_id): # ID становится именем файла фото в PHOTOS_DIR
+        raise ValueError(f"ID '{user_id}' может содержать только буквы, цифры, '_' и '-'.")
+    try:
+        _execute("INSERT INTO users (id, first_name, last_name, passport_number, departament) VALUES (?, ?, ?, ?, ?)",
+                 (str(user_id), first_name, last_name, passport, departament))
+    except sqlite3.IntegrityError:
+        return False # Пользователь с таким ID уже существует
 
-    # Логика сохранения фото из GUI (требует бинарных данных)
     try:
-        image = Image.open(io.BytesIO(photo_data))
-        # Ищем существующее фото, чтобы определить расширение, или сохраняем как jpg
-        photo_filename = f"{user_id}.jpg" # Упрощаем до jpg
-        image.save(os.path.join(PHOTOS_DIR, photo_filename))
+        save_user_photo(user_id, photo_data)
     except Exception as e:
         print(f"Ошибка сохранения фото для пользователя {user_id}: {e}")
         # Если фото не удалось сохранить, пользователя все равно можно добавить
-        pass
+        return True
 
-    _save_json(USERS_FILE, data_storage['users'])
+    _update_face_index(user_id, photo_data)
     return True
 
-def get_all_users_with_photos():
-    users_with_photos = []
-    for user in data_storage['users']:
-        user_copy = user.copy()
-        photo_path = next((os.path.join(PHOTOS_DIR, f) for f in os.listdir(PHOTOS_DIR) if f.startswith(str(user['id']))), None)
-        if photo_path and os.path.exists(photo_path):
-             with open(photo_path, 'rb') as f:
-                 user_copy['photo'] = f.read()
-        else:
-            user_copy['photo'] = None
-        users_with_photos.append(user_copy)
-    return users_with_photos
+def get_all_users():
+    return _query("SELECT * FROM users ORDER BY rowid")
+
+def get_all_users_with_photos(load_photos=False):
+    """
+    Пользователи с данными их фото из индекса: photo_path и photo_hash (None,
+    если фото нет). Байты фото читаются только при load_photos (поле 'photo'),
+    иначе их можно загрузить по одному через get_user_photo.
+    """
+    users = _query("SELECT u.*, p.path AS photo_path, p.sha1 AS photo_hash FROM users u "
+                   "LEFT JOIN photos p ON p.user_id = u.id ORDER BY u.rowid")
+    if load_photos:
+        for user in users:
+            user['photo'] = _read_photo(user['photo_path'])
+    return users
 
 
+def _user_filter(query):
+    if not query:
+        return "", ()
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return ("WHERE u.id LIKE ? ESCAPE '\\' OR u.first_name LIKE ? ESCAPE '\\' OR u.last_name LIKE ? ESCAPE '\\' "
+            "OR u.departament LIKE ? ESCAPE '\\'"), (pattern,) * 4
+
+def count_users(query=""):
+    """Количество пользователей, подходящих под поиск (по ID, имени, фамилии или отделу)."""
+    where, params = _user_filter(query)
+    return _connection().execute(f"SELECT COUNT(*) FROM users u {where}", params).fetchone()[0]
+
+def search_users(query="", offset=0, limit=100):
+    """Страница пользователей (с photo_path и photo_hash, без байтов фото), подходящих под поиск."""
+    where, params = _user_filter(query)
+    return _query("SELECT u.*, p.path AS photo_path, p.sha1 AS photo_hash FROM users u "
+                  f"LEFT JOIN photos p ON p.user_id = u.id {where} ORDER BY u.rowid LIMIT ? OFFSET ?",
+                  params + (limit, offset))
+
+def existing_user_ids(user_ids, chunk=500):
+    """Какие из ID уже заняты (проверка пачками по chunk)."""
+    user_ids, existing = [str(user_id) for user_id in user_ids], set()
+    for start in range(0, len(user_ids), chunk):
+        part = user_ids[start:start + chunk]
+        rows = _connection().execute(f"SELECT id FROM users WHERE id IN ({','.join('?' * len(part))})", part)
+        existing.update(row[0] for row in rows)
+    return existing
+
+def import_users(users):
+    """
+    Массово добавляет проверенных пользователей (см. bulk_import.py): каждый -
+    поля пользователя плюс source_path, sha1, size, ext и encoding. Фото
+    копируются в PHOTOS_DIR, пользователи и индекс фото записываются одной
+    транзакцией (при ошибке скопированные фото удаляются), затем кэш
+    эмбеддингов и индекс лиц обновляются одной перезаписью.
+    """
+    invalid = [user['id'] for user in users if not is_valid_user_id(user['id'])]
+    if invalid:
+        raise ValueError(f"Недопустимые ID пользователей (имена файлов фото): {invalid[:10]}")
+    copied, photo_rows = [], []
+    try:
+        for user in users:
+            path = os.path.join(PHOTOS_DIR, f"{user['id']}{user['ext']}")
+            shutil.copyfile(user['source_path'], path); copied.append(path)
+            photo_rows.append((str(user['id']), path, user['sha1'], user['size']))
+        conn = _connection()
+        with conn:
+            conn.executemany("INSERT INTO users (id, first_name, last_name, passport_number, departament) VALUES (?, ?, ?, ?, ?)",
+                             [(str(u['id']), u['first_name'], u['last_name'], u.get('passport_number'), u.get('departament'))
+                              for u in users])
+            conn.executemany("INSERT OR REPLACE INTO photos (user_id, path, sha1, size) VALUES (?, ?, ?, ?)", photo_rows)
+    except Exception:
+        for path in copied:
+            try: os.remove(path)
+            except OSError: pass
+        raise
+    face_cache.update({str(u['id']): (u['sha1'], u['encoding']) for u in users})
+    with _face_index_lock:
+        index = face_index.load_index(FACE_INDEX_DIR)
+        if index is not None:
+            index.add([str(u['id']) for u in users], [u['encoding'] for u in users])
+            index.save(FACE_INDEX_DIR)
+
 def get_user_details(user_id):
-    return next((user for user in data_storage['users'] if str(user['id']) == str(user_id)), None)
+    return _query_one("SELECT * FROM users WHERE id = ?", (str(user_id),))
 
 
 def update_user(user_id, first_name, last_name, passport, departament):
-    user = get_user_details(user_id)
-    if user:
-        user['first_name'] = first_name
-        user['last_name'] = last_name
-        user['passport_number'] = passport
-        user['departament'] = departament
-        _save_json(USERS_FILE, data_storage['users'])
+    _execute("UPDATE users SET first_name = ?, last_name = ?, passport_number = ?, departament = ? WHERE id = ?",
+             (first_name, last_name, passport, departament, str(user_id)))
 
 def delete_user(user_id):
-    data_storage['users'] = [u for u in data_storage['users'] if str(u['id']) != str(user_id)]
-    photo_path = next((os.path.join(PHOTOS_DIR, f) for f in os.listdir(PHOTOS_DIR) if f.startswith(str(user_id))), None)
-    if photo_path and os.path.exists(photo_path):
-        os.remove(photo_path)
-    _save_json(USERS_FILE, data_storage['users'])
+    _execute("DELETE FROM users WHERE id = ?", (str(user_id),))
+    delete_user_photo(user_id)
+    _update_face_index(user_id)
+
+# --- Хранилище фотографий ---
+# Файлы лежат в PHOTOS_DIR под именем <id>.<расширение>; таблица photos связывает
+# ID пользователя с путем и хэшем содержимого, поэтому ни список пользователей,
+# ни удаление не просматривают папку.
+
+def _read_photo(path):
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        print(f"Ошибка чтения фото {path}: {e}")
+        return None
+
+def _index_photo_dir():
+    """Один раз заносит в индекс фото, сохраненные до его появления (имя файла - ID пользователя)."""
+    conn = _connection()
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'photos_indexed'").fetchone():
+        return
+    rows = []
+    for name in sorted(os.listdir(PHOTOS_DIR)):
+        path = os.path.join(PHOTOS_DIR, name)
+        user_id, ext = os.path.splitext(name)
+        if not ext or not os.path.isfile(path):
+            continue
+        data = _read_photo(path)
+        if data is not None:
+            rows.append((user_id, path, face_cache.photo_hash(data), len(data)))
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO photos (user_id, path, sha1, size) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('photos_indexed', ?)", (str(int(time.time())),))
+    print(f"Проиндексировано фото пользователей: {len(rows)}.")
+
+def get_photo_record(user_id):
+    """Запись индекса фото {'user_id', 'path', 'sha1', 'size'} или None."""
+    return _query_one("SELECT * FROM photos WHERE user_id = ?", (str(user_id),))
+
+def get_user_photo(user_id):
+    """Байты фото пользователя (ленивая загрузка) или None."""
+    record = get_photo_record(user_id)
+    return _read_photo(record['path']) if record else None
+
+def save_user_photo(user_id, photo_data):
+    """
+    Сохраняет фото пользователя без перекодирования (формат определяется по
+    содержимому) и обновляет индекс. Запись файла атомарная.
+    """
+    image_format = Image.open(io.BytesIO(photo_data)).format or 'JPEG' # Заодно проверяем, что это изображение
+    ext = '.jpg' if image_format == 'JPEG' else f".{image_format.lower()}"
+    path = os.path.join(PHOTOS_DIR, f"{user_id}{ext}")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(photo_data)
+    os.replace(tmp_path, path)
+    previous = get_photo_record(user_id)
+    _execute("INSERT OR REPLACE INTO photos (user_id, path, sha1, size) VALUES (?, ?, ?, ?)",
+             (str(user_id), path, face_cache.photo_hash(photo_data), len(photo_data)))
+    if previous and previous['path'] != path and os.path.exists(previous['path']):
+        os.remove(previous['path']) # Старое фото в другом формате
+
+def delete_user_photo(user_id):
+    record = get_photo_record(user_id)
+    if record is None:
+        return
+    _execute("DELETE FROM photos WHERE user_id = ?", (str(user_id),))
+    if os.path.exists(record['path']):
+        os.remove(record['path'])
+
+def _encode_photo(photo_data):
+    """Кодирует первое лицо на фотографии; None, если лицо не найдено."""
+    image = face_recognition.load_image_file(io.BytesIO(photo_data))
+    encodings = face_recognition.face_encodings(image)
+    return encodings[0] if encodings else None
+
+def _update_face_index(user_id, photo_data=None):
+    """Инкрементально обновляет сохраненный индекс лиц, если он построен."""
+    if not os.path.exists(os.path.join(FACE_INDEX_DIR, face_index.META_FILE)):
+        return
+    # Кодирование - вне блокировки индекса, под ней только загрузка, изменение и сохранение
+    if photo_data is None:
+        face_cache.forget(user_id); encoding = None
+    else:
+        encoding = face_cache.store_encoding(str(user_id), photo_data, _encode_photo)
+    with _face_index_lock:
+        index = face_index.load_index(FACE_INDEX_DIR)
+        if index is None:
+            return
+        if encoding is None:
+            index.remove([user_id])
+        else:
+            index.add([user_id], [encoding])
+        index.save(FACE_INDEX_DIR)
+
+def load_face_index():
+    """Возвращает сохраненный индекс лиц или None (тогда используется точный перебор)."""
+    return face_index.load_index(FACE_INDEX_DIR)
+
+def build_face_index(nlist=256, nprobe=8):
+    """Строит индекс лиц по всем известным пользователям и сохраняет его рядом с users.json."""
+    known_users = get_known_face_encodings()
+    index = face_index.IVFIndex(nlist=nlist, nprobe=nprobe)
+    index.build([str(user['id']) for user in known_users], [user['encoding'] for user in known_users])
+    with _face_index_lock:
+        index.save(FACE_INDEX_DIR)
+    return index
+
+def _known_user(user, encoding):
+    return {"name": f"{user['first_name']} {user['last_name']}",
+            "id": user['id'], "departament": user['departament'], "encoding": encoding}
+
+def get_known_user(user_id):
+    """
+    Пользователь с эмбеддингом (как в get_known_face_encodings) или None, если
+    пользователя нет, нет фото или на фото не найдено лицо. Кодируется только
+    фото этого пользователя и только если его нет в кэше эмбеддингов.
+    """
+    user, record = get_user_details(user_id), get_photo_record(user_id)
+    if not user or not record:
+        return None
+    encoding = face_cache.get_or_encode(str(user['id']), record['sha1'], lambda: _read_photo(record['path']), _encode_photo)
+    return _known_user(user, encoding) if encoding is not None else None
 
 def get_known_face_encodings():
+    """Возвращает пользователей с эмбеддингами, кодируя только новые/измененные фото."""
+    all_users = [user for user in get_all_users_with_photos() if user['photo_hash']]
+    # Фото читаются с диска только для пользователей, которых нет в кэше эмбеддингов
+    encodings = face_cache.load_encodings([(str(user['id']), user['photo_hash'], lambda path=user['photo_path']: _read_photo(path))
+                                           for user in all_users], _encode_photo)
     known_users = []
-    all_users = get_all_users_with_photos()
     for user in all_users:
-        if not user.get('photo'):
-            continue
-        try:
-            image_stream = io.BytesIO(user['photo'])
-            image = face_recognition.load_image_file(image_stream)
-            encodings = face_recognition.face_encodings(image)
-            if encodings:
-                known_users.append({
-                    "name": f"{user['first_name']} {user['last_name']}",
-                    "id": user['id'], "departament": user['departament'], "encoding": encodings[0]
-                })
-        except Exception as e:
-            print(f"Ошибка обработки фото для пользователя ID {user['id']}: {e}")
+        encoding = encodings.get(str(user['id']))
+        if encoding is not None:
+            known_users.append(_known_user(user, encoding))
     return known_users
 
-# --- Функции для Помещений и Доступа (без изменений) ---
+# --- Функции для Помещений и Доступа ---
 
 def get_all_rooms():
-    return sorted(data_storage['rooms'], key=lambda x: x['name_rooms'])
+    return _query("SELECT id_rooms, name_rooms FROM rooms ORDER BY name_rooms")
+
+def add_room(room_id, name):
+    """Добавляет помещение или переименовывает существующее."""
+    _execute("INSERT INTO rooms (id_rooms, name_rooms) VALUES (?, ?) ON CONFLICT(id_rooms) DO UPDATE SET name_rooms = excluded.name_rooms",
+             (room_id, name))
 
 def get_rules_for_room(room_id):
-    return [rule['departament'] for rule in data_storage['access_rules'] if rule['id_rooms'] == room_id]
+    return [row['departament'] for row in _query("SELECT departament FROM access_rules WHERE id_rooms = ? ORDER BY rowid", (room_id,))]
+
+def _rebuild_access_index():
+    """Полностью перестраивает индекс доступа по таблице access_rules."""
+    global _access_index
+    rooms = {}
+    for rule in _query("SELECT departament, id_rooms FROM access_rules"):
+        rooms.setdefault(rule['id_rooms'], set()).add(rule['departament'])
+    with _access_lock:
+        _access_index = {room_id: frozenset(departaments) for room_id, departaments in rooms.items()}
+
+def _set_access(departament, room_id, allowed):
+    """Обновляет правило в базе и только запись его помещения в индексе (копия словаря с заменой)."""
+    global _access_index
+    with _access_lock:
+        if allowed: _execute("INSERT OR IGNORE INTO access_rules (departament, id_rooms) VALUES (?, ?)", (departament, room_id))
+        else: _execute("DELETE FROM access_rules WHERE departament = ? AND id_rooms = ?", (departament, room_id))
+        departaments = set(_access_index.get(room_id, ()))
+        if allowed: departaments.add(departament)
+        else: departaments.discard(departament)
+        index = dict(_access_index)
+        if departaments: index[room_id] = frozenset(departaments)
+        else: index.pop(room_id, None)
+        _access_index = index
 
 def add_access_rule(departament, room_id):
-    rule = {'departament': departament, 'id_rooms': room_id}
-    if rule not in data_storage['access_rules']:
-        data_storage['access_rules'].append(rule)
-        _save_json(ACCESS_RULES_FILE, data_storage['access_rules'])
+    _set_access(departament, room_id, True)
 
 def remove_access_rule(departament, room_id):
-    data_storage['access_rules'] = [r for r in data_storage['access_rules'] if not (r['departament'] == departament and r['id_rooms'] == room_id)]
-    _save_json(ACCESS_RULES_FILE, data_storage['access_rules'])
+    _set_access(departament, room_id, False)
 
 def check_access(departament, room_id):
+    """Решение о доступе за O(1) по индексу в памяти, без обращения к базе и без блокировок."""
     if not departament or not room_id:
         return False
-    rules = get_rules_for_room(room_id)
-    return departament in rules
+    return departament in _access_index.get(room_id, ())
 
-# --- ИСПРАВЛЕННЫЕ Функции для Камер ---
+# --- Функции для Камер ---
 
 def get_room_by_camera_ip(camera_ip):
-    """[НОВАЯ ФУНКЦИЯ] Находит ID помещения, к которому привязана камера по IP."""
-    camera = next((cam for cam in data_storage['cameras'] if cam['camera_ip'] == camera_ip), None)
+    """Находит ID помещения, к которому привязана камера по IP."""
+    camera = _query_one("SELECT id_rooms FROM cameras WHERE camera_ip = ?", (camera_ip,))
     return camera['id_rooms'] if camera else None
 
 def get_all_cameras_with_rooms():
     """Возвращает список всех камер с их IP и названием привязанного помещения."""
-    cameras_info = []
-    rooms_map = {room['id_rooms']: room['name_rooms'] for room in data_storage['rooms']}
-    for cam in data_storage['cameras']:
-        cameras_info.append({
-            'camera_ip': cam['camera_ip'], # ИЗМЕНЕНО: camera_id -> camera_ip
-            'id_rooms': cam['id_rooms'],
-            'name_rooms': rooms_map.get(cam['id_rooms'])
-        })
-    return sorted(cameras_info, key=lambda x: x['camera_ip'])
+    return _query("SELECT c.camera_ip, c.id_rooms, r.name_rooms FROM cameras c LEFT JOIN rooms r ON r.id_rooms = c.id_rooms "
+                  "ORDER BY c.camera_ip")
+
+def get_all_camera_configs():
+    """Возвращает полные записи всех камер (с названием помещения) для запуска видеопотоков."""
+    rows = _query("SELECT c.camera_ip, c.id_rooms, c.config, r.name_rooms FROM cameras c "
+                  "LEFT JOIN rooms r ON r.id_rooms = c.id_rooms ORDER BY c.rowid")
+    return [_camera_from_row(row) for row in rows]
+
+def set_camera_roi(camera_ip, roi):
+    """
+    Задает зону интереса камеры: список многоугольников из точек [x, y] в долях
+    кадра (0..1). Пустой список или None снимает ограничение.
+    """
+    conn = _connection()
+    with conn:
+        row = conn.execute("SELECT config FROM cameras WHERE camera_ip = ?", (camera_ip,)).fetchone()
+        if row is None:
+            return False
+        config = json.loads(row['config'] or '{}')
+        if roi: config['roi'] = [[[float(x), float(y)] for x, y in polygon] for polygon in roi]
+        else: config.pop('roi', None)
+        conn.execute("UPDATE cameras SET config = ? WHERE camera_ip = ?", (json.dumps(config, ensure_ascii=False), camera_ip))
+    return True
 
 def get_cameras_for_room(room_id):
-    return [cam['camera_ip'] for cam in data_storage['cameras'] if cam['id_rooms'] == room_id] # ИЗМЕНЕНО: camera_id -> camera_ip
+    return [row['camera_ip'] for row in _query("SELECT camera_ip FROM cameras WHERE id_rooms = ? ORDER BY camera_ip", (room_id,))]
     
 def link_camera_to_room(camera_ip, room_id):
     """Привязывает или обновляет привязку камеры к помещению по IP."""
-    camera = next((cam for cam in data_storage['cameras'] if cam['camera_ip'] == camera_ip), None) # ИЗМЕНЕНО: camera_id -> camera_ip
-    if camera:
-        camera['id_rooms'] = room_id
-    else:
-        data_storage['cameras'].append({'camera_ip': camera_ip, 'id_rooms': room_id}) # ИЗМЕНЕНО: camera_id -> camera_ip
-    _save_json(CAMERAS_FILE, data_storage['cameras'])
+    _execute("INSERT INTO cameras (camera_ip, id_rooms) VALUES (?, ?) ON CONFLICT(camera_ip) DO UPDATE SET id_rooms = excluded.id_rooms",
+             (camera_ip, room_id))
 
 def update_camera(old_ip, new_ip, new_room_id):
-    """Обновляет IP камеры и/или ее привязку к помещению."""
-    camera = next((cam for cam in data_storage['cameras'] if cam['camera_ip'] == old_ip), None) # ИЗМЕНЕНО: camera_id -> camera_ip
-    if camera:
-        camera['camera_ip'] = new_ip # ИЗМЕНЕНО: camera_id -> camera_ip
-        camera['id_rooms'] = new_room_id
-        _save_json(CAMERAS_FILE, data_storage['cameras'])
+    """Обновляет IP камеры и/или ее привязку к помещению (sqlite3.IntegrityError, если новый IP занят)."""
+    _execute("UPDATE cameras SET camera_ip = ?, id_rooms = ? WHERE camera_ip = ?", (new_ip, new_room_id, old_ip))
 
 def delete_camera(camera_ip):
     """Удаляет камеру по IP."""
-    data_storage['cameras'] = [cam for cam in data_storage['cameras'] if cam['camera_ip'] != camera_ip] # ИЗМЕНЕНО: camera_id -> camera_ip
-    _save_json(CAMERAS_FILE, data_storage['cameras'])
\ No newline at end of file
+    _execute("DELETE FROM cameras WHERE camera_ip = ?", (camera_ip,))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных системы контроля доступа.")
+    parser.add_argument('--migrate', action='store_true', help="Повторно перенести данные из JSON-файлов в SQLite")
+    args = parser.parse_args()
+    initialize_database()
+    if args.migrate: migrate_from_json(force=True); _rebuild_access_index()
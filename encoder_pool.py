@@ -0,0 +1,181 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+
+DEFAULT_SLOT_BYTES = 16 * 1024 * 1024 # Размер одного буфера разделяемой памяти
+CROP_MARGIN = 0.25 # Запас вокруг рамки лица, чтобы точки лица не выходили за вырезку
+SUBMIT_TIMEOUT = 0.5
+HEALTH_CHECK_SECONDS = 1.0 # Как часто проверяется, живы ли процессы кодирования
+
+
+class EncoderPoolBusy(Exception):
+    """Все буферы пула заняты: кодировщики не успевают за потоком кадров."""
+
+
+def default_worker_count():
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def crop_faces(frame, boxes, margin=CROP_MARGIN):
+    """Вырезает области лиц с запасом; возвращает список (вырезка, рамка в координатах вырезки)."""
+    height, width = frame.shape[:2]
+    crops = []
+    for (x, y, w, h) in boxes:
+        mx, my = int(w * margin), int(h * margin)
+        x0, y0 = max(0, int(x) - mx), max(0, int(y) - my)
+        x1, y1 = min(width, int(x + w) + mx), min(height, int(y + h) + my)
+        crops.append((frame[y0:y1, x0:x1], (int(x) - x0, int(y) - y0, int(w), int(h))))
+    return crops
+
+
+def _worker_main(slot_names, tasks, results):
+    """Процесс кодирования: читает вырезки лиц из разделяемой памяти и возвращает эмбеддинги."""
+    from recognition import encode_face_batch
+    shms = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, slot, layout = task
+            try:
+                # Все вырезки задачи кодируются одним пакетом
+                items = [(np.ndarray(shape, dtype=np.uint8, buffer=shms[slot].buf, offset=offset), box)
+                         for offset, shape, box in layout]
+                results.put((task_id, encode_face_batch(items), None))
+            except Exception as e:
+                results.put((task_id, None, str(e)))
+            finally:
+                items = None  # Освобождаем представления буфера до закрытия разделяемой памяти
+    finally:
+        for shm in shms: shm.close()
+
+
+class EncoderPool:
+    """
+    Пул процессов кодирования лиц в обход GIL.
+
+    Вырезки лиц копируются в заранее выделенные буферы разделяемой памяти
+    (по одному буферу на задачу), процессам передаются только номер буфера и
+    разметка - numpy-массивы не сериализуются. Число буферов ограничивает
+    количество задач в работе: если кодировщики не успевают, submit ждет
+    освобождения буфера не дольше submit_timeout и выбрасывает EncoderPoolBusy.
+    Если процесс кодирования аварийно завершился (например, из-за сбоя dlib),
+    незавершенные задачи получают BrokenProcessPool, их буферы освобождаются,
+    а процессы пула перезапускаются.
+    """
+
+    def __init__(self, workers=None, slots=None, slot_bytes=DEFAULT_SLOT_BYTES, submit_timeout=SUBMIT_TIMEOUT):
+        self.workers = workers or default_worker_count()
+        self.slot_bytes = slot_bytes
+        self.submit_timeout = submit_timeout
+        self.busy_count = 0
+        self.restarts = 0
+        self._ctx = mp.get_context('spawn')
+        self._closed = False
+        self._shms = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slots or self.workers * 2)]
+        self._free = queue.Queue()
+        for slot in range(len(self._shms)): self._free.put(slot)
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._start_workers()
+        self._collector = threading.Thread(target=self._collect, daemon=True, name="encoder-results"); self._collector.start()
+
+    def _start_workers(self):
+        # Новые очереди: задачи и результаты погибшего пула не достаются новым процессам
+        self._tasks, self._results = self._ctx.Queue(), self._ctx.Queue()
+        names = [shm.name for shm in self._shms]
+        self._processes = [self._ctx.Process(target=_worker_main, args=(names, self._tasks, self._results), daemon=True)
+                           for _ in range(self.workers)]
+        for process in self._processes: process.start()
+
+    def pending(self):
+        """Количество задач, отправленных в пул и еще не завершенных."""
+        with self._lock:
+            return len(self._futures)
+
+    def submit(self, frame, boxes):
+        """Отправляет лица кадра на кодирование; Future со списком эмбеддингов (или None), выровненным с boxes."""
+        crops = crop_faces(frame, boxes)
+        total = sum(crop.nbytes for crop, _ in crops)
+        if total > self.slot_bytes:
+            raise ValueError(f"Вырезки лиц ({total} байт) не помещаются в буфер пула ({self.slot_bytes} байт).")
+        try:
+            slot = self._free.get(timeout=self.submit_timeout)
+        except queue.Empty:
+            self.busy_count += 1
+            raise EncoderPoolBusy("Пул кодирования перегружен, кадр пропущен.")
+
+        layout, offset, buffer = [], 0, self._shms[slot].buf
+        for crop, box in crops:
+            np.ndarray(crop.shape, dtype=np.uint8, buffer=buffer, offset=offset)[:] = crop
+            layout.append((offset, crop.shape, box)); offset += crop.nbytes
+        future = Future()
+        task_id = next(self._ids)
+        with self._lock:
+            self._futures[task_id] = (future, slot)
+            self._tasks.put((task_id, slot, layout)) # Под блокировкой: задача не попадет в очередь уже перезапущенного пула
+        return future
+
+    def _collect(self):
+        next_check = time.monotonic() + HEALTH_CHECK_SECONDS
+        while True:
+            if time.monotonic() >= next_check:
+                self._check_workers(); next_check = time.monotonic() + HEALTH_CHECK_SECONDS
+            try:
+                item = self._results.get(timeout=HEALTH_CHECK_SECONDS)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            task_id, encodings, error = item
+            with self._lock:
+                entry = self._futures.pop(task_id, None)
+            if entry is None:
+                continue # Задача уже завершена ошибкой при перезапуске пула
+            future, slot = entry
+            self._free.put(slot)
+            if error is not None: future.set_exception(RuntimeError(error))
+            else: future.set_result(encodings)
+
+    def _check_workers(self):
+        """Перезапускает пул, если какой-то процесс кодирования завершился, и завершает ошибкой его задачи."""
+        if self._closed or all(process.is_alive() for process in self._processes):
+            return
+        codes = [process.exitcode for process in self._processes if not process.is_alive()]
+        print(f"[EncoderPool] Процесс кодирования завершился аварийно (код {codes}), пул перезапускается.")
+        # Какую задачу держал погибший процесс, неизвестно, поэтому останавливаются все: буферы можно отдать только после этого
+        for process in self._processes:
+            if process.is_alive(): process.terminate()
+        for process in self._processes: process.join(timeout=2)
+        with self._lock:
+            if self._closed: return
+            failed = list(self._futures.values()); self._futures.clear()
+            for old in (self._tasks, self._results): old.cancel_join_thread(); old.close()
+            self._start_workers()
+            self.restarts += 1
+        for future, slot in failed:
+            self._free.put(slot)
+            future.set_exception(BrokenProcessPool("Процесс кодирования лиц аварийно завершился."))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        for _ in self._processes: self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=2)
+            if process.is_alive(): process.terminate()
+        self._results.put(None); self._collector.join(timeout=2)
+        with self._lock:
+            for future, _ in self._futures.values(): future.cancel()
+            self._futures.clear()
+        for shm in self._shms:
+            shm.close(); shm.unlink()
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+# --- Константы кэша эмбеддингов ---
+CACHE_DIR = 'database_faces' # Папка для сохраненных кодировок лиц
+INDEX_FILE = 'embeddings_index.json'
+EMBEDDING_DIM = 128
+NO_FACE_ROW = -1 # Строка-маркер: на фото не найдено лицо, повторно не кодируем
+COMPACT_RATIO = 0.25 # Доля мусорных строк матрицы, после которой кэш уплотняется
+COMPACT_MIN_ROWS = 1024 # Меньше мусора не уплотняем даже в маленькой базе
+MAX_LOG_RECORDS = 1000 # Записей журнала индекса до уплотнения (журнал читается при каждой загрузке)
+
+# Сериализует чтение-изменение-запись кэша: без нее параллельные обновления
+# (камеры, API, импорт) теряют записи друг друга и удаляют чужие матрицы
+_lock = threading.RLock()
+
+
+def photo_hash(photo_data):
+    """Возвращает хэш содержимого фотографии (ключ кэша)."""
+    return hashlib.sha1(photo_data).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Дисковое хранилище эмбеддингов лиц.
+
+    Эмбеддинги лежат в одной матрице float32 (N, 128), которая открывается через
+    memmap, а JSON-индекс связывает ID пользователя и хэш его фото со строкой
+    матрицы. Кодируются только новые или измененные фотографии. Точечные
+    изменения дописывают строки в конец матрицы и запись в журнал индекса,
+    не переписывая файлы целиком; замененные и удаленные строки становятся
+    мусором, который убирается уплотнением (compact).
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.entries = {}  # str(user_id) -> {"hash": ..., "row": ...}
+        self.matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.matrix_file = None
+        self.rows = 0 # Строк в матрице, включая мусор
+        self.log_records = 0 # Записей журнала индекса с последнего уплотнения
+        self._log_size = 0 # Байт журнала до конца последней целой записи
+
+    @staticmethod
+    def _log_name(matrix_file):
+        return matrix_file[:-len('.f32')] + '.log' # Журнал индекса относится к своему поколению матрицы
+
+    def load(self):
+        """Загружает индекс (с журналом изменений) и открывает матрицу эмбеддингов через memmap."""
+        self.entries, self.matrix_file, self.rows, self.log_records, self._log_size = {}, None, 0, 0, 0
+        self.matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        if not os.path.exists(self.index_path):
+            return self
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            entries, rows = index.get('entries', {}), index.get('rows', 0)
+            matrix_file = index.get('matrix_file')
+            log_path = os.path.join(self.directory, self._log_name(matrix_file)) if matrix_file else None
+            if log_path and os.path.exists(log_path):
+                with open(log_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line) if line.endswith(b'\n') else None
+                        except ValueError:
+                            record = None
+                        if record is None:
+                            break # Запись оборвана сбоем - следующее обновление ее перезапишет
+                        for user_id, entry in record['changes'].items():
+                            if entry is None: entries.pop(user_id, None)
+                            else: entries[user_id] = entry
+                        rows = record['rows']; self.log_records += 1; self._log_size += len(line)
+            if rows and matrix_file:
+                path = os.path.join(self.directory, matrix_file)
+                self.matrix = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, EMBEDDING_DIM))
+            self.matrix_file, self.rows, self.entries = matrix_file, rows, entries
+        except (json.JSONDecodeError, IOError, ValueError, KeyError) as e:
+            print(f"Ошибка чтения кэша эмбеддингов, кэш будет перестроен: {e}")
+            self.entries, self.matrix_file, self.rows = {}, None, 0
+        return self
+
+    def get(self, user_id, content_hash):
+        """
+        Возвращает (найдено, эмбеддинг). Эмбеддинг равен None, если на фото
+        ранее не удалось найти лицо.
+        """
+        entry = self.entries.get(str(user_id))
+        if not entry or entry['hash'] != content_hash:
+            return False, None
+        row = entry['row']
+        if row == NO_FACE_ROW or row >= len(self.matrix):
+            return row == NO_FACE_ROW, None
+        return True, self.matrix[row]
+
+    def garbage(self):
+        """Строки матрицы, на которые больше не ссылается индекс."""
+        return self.rows - sum(1 for entry in self.entries.values() if entry['row'] != NO_FACE_ROW)
+
+    def save(self, encodings, hashes):
+        """
+        Перезаписывает кэш. encodings: user_id -> эмбеддинг или None,
+        hashes: user_id -> хэш фото. Матрица пишется в новый файл, чтобы не
+        трогать файл, который еще может быть открыт через memmap.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entries, rows = {}, []
+        for user_id, encoding in encodings.items():
+            if encoding is None:
+                entries[str(user_id)] = {'hash': hashes[user_id], 'row': NO_FACE_ROW}
+            else:
+                entries[str(user_id)] = {'hash': hashes[user_id], 'row': len(rows)}
+                rows.append(np.asarray(encoding, dtype=np.float32))
+
+        generation = int(self.matrix_file.split('.')[1]) + 1 if self.matrix_file else 1
+        matrix_file = f"embeddings.{generation}.f32"
+        matrix = np.vstack(rows) if rows else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        matrix.tofile(os.path.join(self.directory, matrix_file))
+        log_path = os.path.join(self.directory, self._log_name(matrix_file))
+        if os.path.exists(log_path): os.remove(log_path) # Остаток прерванной записи того же поколения
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': EMBEDDING_DIM, 'rows': len(rows), 'matrix_file': matrix_file, 'entries': entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+        old_file = self.matrix_file
+        self.load()
+        if old_file and old_file != self.matrix_file:
+            try:
+                os.remove(os.path.join(self.directory, old_file))
+            except OSError:
+                pass  # Файл еще открыт (Windows) - удалим при следующей пересборке
+        self._remove_stale_files()
+
+    def compact(self, changes=None):
+        """
+        Переписывает кэш целиком (без мусорных строк и журнала), применяя
+        changes: user_id -> (хэш фото, эмбеддинг или None) либо None для удаления.
+        """
+        encodings, hashes = {}, {}
+        for user_id, entry in self.entries.items():
+            encodings[user_id] = None if entry['row'] == NO_FACE_ROW else self.matrix[entry['row']]
+            hashes[user_id] = entry['hash']
+        for user_id, change in (changes or {}).items():
+            user_id = str(user_id)
+            if change is None:
+                encodings.pop(user_id, None); hashes.pop(user_id, None)
+            else:
+                hashes[user_id], encodings[user_id] = change
+        self.save(encodings, hashes)
+
+    def update(self, changes):
+        """
+        Точечно обновляет кэш. changes: user_id -> (хэш фото, эмбеддинг или None)
+        либо None для удаления пользователя из кэша. Новые эмбеддинги
+        дописываются в конец матрицы, изменения индекса - одной строкой в
+        журнал, поэтому стоимость не зависит от размера базы; когда мусора
+        или записей журнала становится много, кэш уплотняется.
+        """
+        if self.matrix_file is None or self.garbage() + len(changes) > max(COMPACT_MIN_ROWS, COMPACT_RATIO * self.rows) \
+                or self.log_records >= MAX_LOG_RECORDS:
+            return self.compact(changes)
+        log_changes, rows = {}, []
+        for user_id, change in changes.items():
+            if change is None:
+                log_changes[str(user_id)] = None
+            elif change[1] is None:
+                log_changes[str(user_id)] = {'hash': change[0], 'row': NO_FACE_ROW}
+            else:
+                log_changes[str(user_id)] = {'hash': change[0], 'row': self.rows + len(rows)}
+                rows.append(np.asarray(change[1], dtype=np.float32))
+        if rows:
+            # Пишем строго после учтенных строк: хвост прерванной записи перезаписывается, открытые memmap не меняются
+            with open(os.path.join(self.directory, self.matrix_file), 'r+b') as f:
+                f.seek(self.rows * EMBEDDING_DIM * 4)
+                f.write(np.vstack(rows).astype(np.float32).tobytes())
+        with open(os.path.join(self.directory, self._log_name(self.matrix_file)), 'ab') as f:
+            f.truncate(self._log_size) # Отбрасываем оборванную запись, если она есть
+            f.write((json.dumps({'rows': self.rows + len(rows), 'changes': log_changes}) + '\n').encode('utf-8'))
+        self.load()
+
+    def _remove_stale_files(self):
+        current = (self.matrix_file, self._log_name(self.matrix_file) if self.matrix_file else None)
+        for name in os.listdir(self.directory):
+            if name.startswith('embeddings.') and name.endswith(('.f32', '.log')) and name not in current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+def _encode(photo_data, encode):
+    """
+    Кодирует фото: возвращает (кэшировать ли результат, эмбеддинг). None от
+    encode - на фото нет лица, это запоминается; нечитаемое фото или
+    исключение при кодировании - сбой, который не кэшируется, чтобы фото
+    закодировалось при следующем обращении.
+    """
+    if photo_data is None:
+        return False, None
+    try:
+        return True, encode(photo_data)
+    except Exception as e:
+        print(f"Ошибка кодирования фото: {e}")
+        return False, None
+
+
+def load_encodings(photos, encode):
+    """
+    Возвращает эмбеддинги для списка (user_id, хэш фото, load_photo), кодируя
+    функцией encode(photo_data) -> эмбеддинг или None (нет лица) только
+    новые/измененные фото; load_photo() читает байты фото и вызывается только
+    для них. Результат: user_id -> эмбеддинг (пользователи без лица на фото
+    и с ошибкой кодирования пропускаются).
+    """
+    with _lock:
+        cache = EmbeddingCache().load()
+    changes, hashes, result = {}, {}, {}
+    encoded_count = 0
+    for user_id, content_hash, load_photo in photos:
+        found, encoding = cache.get(user_id, content_hash)
+        hashes[user_id] = content_hash
+        if not found:
+            cacheable, encoding = _encode(load_photo(), encode); encoded_count += 1
+            if cacheable: changes[user_id] = (content_hash, encoding)
+        if encoding is not None:
+            result[user_id] = encoding
+
+    with _lock:
+        # Кодирование шло без блокировки: изменения накладываются на актуальный кэш
+        cache = EmbeddingCache().load()
+        changes.update({user_id: None for user_id in cache.entries if user_id not in hashes})
+        if changes or cache.garbage() or cache.log_records:
+            cache.compact(changes) # Полная загрузка базы - удобный момент уплотнить кэш
+        # Возвращаем строки из актуальной memmap-матрицы, а не временные массивы
+        for user_id in result:
+            found, encoding = cache.get(user_id, hashes[user_id])
+            if found and encoding is not None: result[user_id] = encoding
+    print(f"Кэш эмбеддингов: закодировано {encoded_count}, из кэша {len(hashes) - encoded_count}.")
+    return result
+
+
+def update(changes):
+    """Точечно обновляет кэш на диске (см. EmbeddingCache.update) под общей блокировкой."""
+    with _lock:
+        EmbeddingCache().load().update(changes)
+
+
+def get_or_encode(user_id, content_hash, load_photo, encode):
+    """
+    Эмбеддинг одного пользователя: из кэша по хэшу фото, а если фото новое -
+    кодирует его (load_photo() читает байты) и сохраняет в кэш.
+    """
+    with _lock:
+        found, encoding = EmbeddingCache().load().get(user_id, content_hash)
+    if not found:
+        cacheable, encoding = _encode(load_photo(), encode)
+        if cacheable: update({user_id: (content_hash, encoding)})
+    return encoding
+
+
+def store_encoding(user_id, photo_data, encode):
+    """Кодирует одно фото, сохраняет результат в кэш и возвращает эмбеддинг (или None, если лица нет или сбой)."""
+    content_hash = photo_hash(photo_data)
+    with _lock:
+        found, encoding = EmbeddingCache().load().get(user_id, content_hash)
+    if not found:
+        cacheable, encoding = _encode(photo_data, encode)
+        if cacheable: update({user_id: (content_hash, encoding)})
+    return encoding
+
+
+def forget(user_id):
+    """Удаляет эмбеддинг пользователя из кэша."""
+    with _lock:
+        cache = EmbeddingCache().load()
+        if str(user_id) in cache.entries:
+            cache.update({user_id: None})
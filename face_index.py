@@ -0,0 +1,315 @@
+import copy
+import json
+import os
+import numpy as np
+
+EMBEDDING_DIM = 128
+META_FILE = 'meta.json'
+BASE_FILES = ('vectors', 'sq_norms', 'centroids', 'offsets', 'labels') # Файлы основной части: <имя>.<поколение>.npy
+COMPACT_RATIO = 0.05 # Доля изменений, после которой индекс уплотняется при сохранении
+
+
+def _as_matrix(vectors):
+    return np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+
+
+def _sq_norms(matrix):
+    return np.einsum('ij,ij->i', matrix, matrix)
+
+
+def _pairwise_distances(queries, matrix, matrix_sq_norms=None):
+    """Евклидовы расстояния (M, N) между запросами и матрицей."""
+    if matrix_sq_norms is None:
+        matrix_sq_norms = _sq_norms(matrix)
+    d2 = _sq_norms(queries)[:, None] + matrix_sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+
+def _top_k(distances, k):
+    """Индексы k наименьших значений строки в порядке возрастания."""
+    k = min(k, len(distances))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+    return idx[np.argsort(distances[idx])]
+
+
+class BruteForceIndex:
+    """Точный полный перебор по всей базе - эталонный индекс."""
+
+    kind = 'exact'
+
+    def __init__(self):
+        self.vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.labels = np.empty(0, dtype=object)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def ids(self):
+        return set(self.labels.tolist())
+
+    def copy(self):
+        """Независимая копия: массивы не изменяются на месте, поэтому общие массивы не копируются."""
+        clone = BruteForceIndex()
+        clone.vectors, clone.labels, clone.sq_norms = self.vectors, self.labels, self.sq_norms
+        return clone
+
+    def add(self, ids, vectors):
+        ids = [str(i) for i in ids]
+        self.remove(ids)
+        vectors = _as_matrix(vectors)
+        self.vectors = np.ascontiguousarray(np.vstack([self.vectors, vectors]))
+        self.labels = np.concatenate([self.labels, np.array(ids, dtype=object)])
+        self.sq_norms = _sq_norms(self.vectors)
+
+    def remove(self, ids):
+        ids = {str(i) for i in ids}
+        if not len(self.labels) or not ids:
+            return
+        keep = np.array([label not in ids for label in self.labels], dtype=bool)
+        if not keep.all():
+            self.vectors = np.ascontiguousarray(self.vectors[keep])
+            self.labels = self.labels[keep]
+            self.sq_norms = self.sq_norms[keep]
+
+    def search(self, queries, k=1):
+        """Для каждого запроса возвращает до k пар (id, расстояние) по возрастанию."""
+        queries = _as_matrix(queries)
+        if not len(self.labels):
+            return [[] for _ in queries]
+        dist = _pairwise_distances(queries, self.vectors, self.sq_norms)
+        return [[(self.labels[i], float(row[i])) for i in _top_k(row, k)] for row in dist]
+
+
+class IVFIndex:
+    """
+    Приближенный индекс IVF-Flat для больших баз (50k-500k лиц).
+
+    Векторы разбиты k-means на nlist кластеров и хранятся подряд по кластерам;
+    поиск сканирует только nprobe ближайших кластеров. Сохраненный индекс
+    открывается через memmap, добавления копятся в небольшом буфере, удаления
+    помечаются и физически убираются при следующем сохранении.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, nlist=256, nprobe=8):
+        self.nlist, self.nprobe = nlist, nprobe
+        self.centroids = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.vectors = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.sq_norms = np.empty(0, dtype=np.float32)
+        self.labels = np.empty(0, dtype=object)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.pending = BruteForceIndex()  # Добавленные после последнего сохранения
+        self.removed = set()  # Удаленные из основной части id
+        self._base_ids = set()
+        self.generation = 0
+        self.base_dirty = False  # Основная часть изменена в памяти и не сохранена
+
+    def __len__(self):
+        return len(self._base_ids - self.removed) + len(self.pending)
+
+    def ids(self):
+        return (self._base_ids - self.removed) | self.pending.ids()
+
+    def copy(self):
+        """
+        Копия для изменения без влияния на оригинал: основная часть (в том
+        числе memmap) общая, копируются только буфер добавлений и удаления.
+        """
+        clone = copy.copy(self)
+        clone.pending, clone.removed = self.pending.copy(), set(self.removed)
+        return clone
+
+    def train(self, vectors, iterations=10, seed=0):
+        """Обучает центроиды кластеров k-means на выборке векторов."""
+        vectors = _as_matrix(vectors)
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(self.nlist, len(vectors)))
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        self.centroids = np.ascontiguousarray(centroids)
+        self.nlist = nlist
+        return self
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk=16384):
+        result = np.empty(len(vectors), dtype=np.int64)
+        c_sq = _sq_norms(centroids)
+        for start in range(0, len(vectors), chunk):
+            part = vectors[start:start + chunk]
+            result[start:start + chunk] = np.argmin(_pairwise_distances(part, centroids, c_sq), axis=1)
+        return result
+
+    def build(self, ids, vectors):
+        """Строит индекс с нуля: обучение центроидов и раскладка векторов по кластерам."""
+        self._set_base([str(i) for i in ids], _as_matrix(vectors))
+        self.pending, self.removed, self.base_dirty = BruteForceIndex(), set(), True
+        return self
+
+    def _set_base(self, ids, vectors):
+        if not len(self.centroids) and len(vectors):
+            self.train(vectors)
+        assignment = self._assign(vectors, self.centroids) if len(vectors) else np.empty(0, dtype=np.int64)
+        order = np.argsort(assignment, kind='stable')
+        self.vectors = np.ascontiguousarray(vectors[order])
+        self.sq_norms = _sq_norms(self.vectors)
+        self.labels = np.array(ids, dtype=object)[order] if ids else np.empty(0, dtype=object)
+        counts = np.bincount(assignment, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._base_ids = set(ids)
+
+    def add(self, ids, vectors):
+        ids = [str(i) for i in ids]
+        self.removed.update(i for i in ids if i in self._base_ids)
+        self.pending.add(ids, vectors)
+
+    def remove(self, ids):
+        ids = {str(i) for i in ids}
+        self.removed.update(ids & self._base_ids)
+        self.pending.remove(ids)
+        if len(self.removed) > COMPACT_RATIO * max(len(self.labels), 1):
+            self.compact()
+
+    def search(self, queries, k=1, nprobe=None):
+        queries = _as_matrix(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        pending_results = self.pending.search(queries, k)
+        if not len(self.labels):
+            return pending_results
+        centroid_dist = _pairwise_distances(queries, self.centroids)
+        results = []
+        for q, query in enumerate(queries):
+            lists = _top_k(centroid_dist[q], nprobe)
+            candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists])
+            found = []
+            if len(candidates):
+                dist = _pairwise_distances(query[None, :], self.vectors[candidates], self.sq_norms[candidates])[0]
+                # Берем с запасом на случай удаленных записей
+                for i in _top_k(dist, k + len(self.removed)):
+                    label = self.labels[candidates[i]]
+                    if label not in self.removed:
+                        found.append((label, float(dist[i])))
+                        if len(found) == k:
+                            break
+            results.append(sorted(found + pending_results[q], key=lambda item: item[1])[:k])
+        return results
+
+    def compact(self):
+        """Переносит буфер добавлений в основную часть и удаляет помеченные записи."""
+        keep = np.array([label not in self.removed for label in self.labels], dtype=bool)
+        ids = self.labels[keep].tolist() + self.pending.labels.tolist()
+        vectors = np.vstack([np.asarray(self.vectors[keep]), self.pending.vectors])
+        self._set_base(ids, vectors)
+        self.pending, self.removed = BruteForceIndex(), set()
+        self.base_dirty = True
+
+    def save(self, directory):
+        """
+        Сохраняет индекс в папку. Пока изменений немного, на диск пишется только
+        буфер добавлений и список удалений; основная часть перезаписывается
+        целиком лишь при уплотнении. Все файлы версионные (поколение основной
+        части и номер изменений), а переключение на них - одна атомарная замена
+        meta.json, поэтому читатель никогда не видит смесь старых и новых файлов.
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta = self._read_meta(directory)
+        changes = len(self.pending) + len(self.removed)
+        if (meta is None or meta.get('generation') != self.generation or self.base_dirty
+                or changes > COMPACT_RATIO * max(len(self.labels), 1)):
+            self._save_base(directory, meta)
+            delta = 1
+        else:
+            delta = meta.get('delta', 0) + 1
+        suffix = f"{self.generation}.{delta}"
+        np.save(os.path.join(directory, f"pending_vectors.{suffix}.npy"), self.pending.vectors)
+        np.save(os.path.join(directory, f"pending_labels.{suffix}.npy"), self.pending.labels.astype(str))
+        with open(os.path.join(directory, f"removed.{suffix}.json"), 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.removed), f)
+        tmp_path = os.path.join(directory, META_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'kind': self.kind, 'nlist': self.nlist, 'nprobe': self.nprobe,
+                       'size': len(self.labels), 'generation': self.generation, 'delta': delta}, f)
+        os.replace(tmp_path, os.path.join(directory, META_FILE))
+        self._remove_stale_files(directory, delta)
+
+    def _save_base(self, directory, meta):
+        self.compact()
+        # Основная часть пишется в файлы нового поколения, чтобы не трогать открытые memmap и файлы читателей
+        self.generation = max(self.generation, meta.get('generation', 0) if meta else 0) + 1
+        for name, array in (('vectors', self.vectors), ('sq_norms', self.sq_norms), ('centroids', self.centroids),
+                            ('offsets', self.offsets), ('labels', self.labels.astype(str))):
+            np.save(os.path.join(directory, f"{name}.{self.generation}.npy"), np.asarray(array))
+        self.base_dirty = False
+
+    def _remove_stale_files(self, directory, delta):
+        current = {f"{name}.{self.generation}.npy" for name in BASE_FILES}
+        current |= {f"pending_vectors.{self.generation}.{delta}.npy", f"pending_labels.{self.generation}.{delta}.npy",
+                    f"removed.{self.generation}.{delta}.json", META_FILE}
+        for name in os.listdir(directory):
+            if name not in current and name.endswith(('.npy', '.json')):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass  # Файл еще открыт через memmap - удалим при следующем сохранении
+
+    @staticmethod
+    def _read_meta(directory):
+        path = os.path.join(directory, META_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, directory):
+        """Загружает индекс из папки; векторы открываются через memmap."""
+        meta = cls._read_meta(directory)
+        generation, suffix = meta['generation'], f"{meta['generation']}.{meta['delta']}"
+        index = cls(nlist=meta['nlist'], nprobe=meta['nprobe'])
+        index.generation = generation
+        index.centroids = np.load(os.path.join(directory, f"centroids.{generation}.npy"))
+        index.vectors = np.load(os.path.join(directory, f"vectors.{generation}.npy"), mmap_mode='r')
+        index.sq_norms = np.load(os.path.join(directory, f"sq_norms.{generation}.npy"), mmap_mode='r')
+        index.offsets = np.load(os.path.join(directory, f"offsets.{generation}.npy"))
+        index.labels = np.load(os.path.join(directory, f"labels.{generation}.npy")).astype(object)
+        index._base_ids = set(index.labels.tolist())
+        pending_labels = np.load(os.path.join(directory, f"pending_labels.{suffix}.npy")).tolist()
+        if pending_labels:
+            index.pending.add(pending_labels, np.load(os.path.join(directory, f"pending_vectors.{suffix}.npy")))
+        with open(os.path.join(directory, f"removed.{suffix}.json"), 'r', encoding='utf-8') as f:
+            index.removed = set(json.load(f)) & index._base_ids
+        return index
+
+
+def load_index(directory):
+    """Загружает сохраненный индекс или возвращает None, если он еще не построен."""
+    if not os.path.exists(os.path.join(directory, META_FILE)):
+        return None
+    try:
+        return IVFIndex.load(directory)
+    except (IOError, ValueError, KeyError, json.JSONDecodeError) as e:
+        print(f"Ошибка загрузки индекса лиц из {directory}: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+    import database as db
+
+    parser = argparse.ArgumentParser(description="Построение индекса лиц по базе пользователей (офлайн).")
+    parser.add_argument('--nlist', type=int, default=256, help="Количество кластеров IVF")
+    parser.add_argument('--nprobe', type=int, default=8, help="Количество просматриваемых кластеров при поиске")
+    args = parser.parse_args()
+    db.initialize_database()
+    built = db.build_face_index(nlist=args.nlist, nprobe=args.nprobe)
+    print(f"Индекс построен: {len(built)} лиц, {built.nlist} кластеров, сохранен в '{db.FACE_INDEX_DIR}'.")
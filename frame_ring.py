@@ -0,0 +1,121 @@
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+DEFAULT_RING_SLOTS = 8 # Захват + последний кадр + очередь отображения + задачи распознавания
+
+
+class FrameRef:
+    """
+    Ссылка на кадр в кольцевом буфере. Пока ссылка не освобождена (release
+    или выход из with), слот не перезаписывается. Массив frame - представление
+    разделяемой памяти, а не копия: изменять его нельзя.
+    """
+
+    def __init__(self, ring, slot, seq, timestamp):
+        self.ring = ring
+        self.slot = slot
+        self.seq = seq
+        self.timestamp = timestamp
+        self.frame = ring.view(slot)
+        self._released = False
+
+    def retain(self):
+        """Новая ссылка на тот же кадр (для передачи другому потребителю)."""
+        return self.ring._retain(self.slot, self.seq, self.timestamp)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.frame = None
+            self.ring._release(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    """
+    Кольцевой буфер кадров одной камеры в разделяемой памяти.
+
+    Слоты выделяются один раз под размер кадра камеры; захват декодирует кадр
+    прямо в свободный слот, а обнаружение, сохранение и отображение читают его
+    без копирования по FrameRef со счетчиком ссылок. Слот с ненулевым
+    счетчиком не перезаписывается; если свободных слотов нет, захват пропускает
+    кадр.
+    """
+
+    def __init__(self, shape, slots=DEFAULT_RING_SLOTS):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.slot_bytes = int(np.prod(self.shape))
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * slots)
+        self.name = self._shm.name
+        self._views = [np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf, offset=i * self.slot_bytes)
+                       for i in range(slots)]
+        self._refs = [0] * slots
+        self._latest = None # (слот, номер, время) последнего опубликованного кадра
+        self._next = 0
+        self._lock = threading.Lock()
+        self.dropped = 0 # Кадры, пропущенные из-за отсутствия свободного слота
+
+    def view(self, slot):
+        return self._views[slot]
+
+    def acquire(self):
+        """Захватывает свободный слот для записи; возвращает номер слота или None."""
+        with self._lock:
+            for i in range(self.slots):
+                slot = (self._next + i) % self.slots
+                if self._refs[slot] == 0:
+                    self._refs[slot] = 1
+                    self._next = (slot + 1) % self.slots
+                    return slot
+            self.dropped += 1
+            return None
+
+    def publish(self, slot, seq, timestamp):
+        """Делает записанный слот последним кадром камеры; ссылка записи переходит к буферу."""
+        with self._lock:
+            previous = self._latest
+            self._latest = (slot, seq, timestamp)
+        if previous is not None:
+            self._release(previous[0])
+
+    def cancel(self, slot):
+        """Возвращает слот, запись в который не удалась."""
+        self._release(slot)
+
+    def latest(self):
+        """FrameRef на последний кадр (или None); вызывающий обязан освободить ссылку."""
+        with self._lock:
+            if self._latest is None:
+                return None
+            slot, seq, timestamp = self._latest
+            self._refs[slot] += 1
+        return FrameRef(self, slot, seq, timestamp)
+
+    def _retain(self, slot, seq, timestamp):
+        with self._lock:
+            self._refs[slot] += 1
+        return FrameRef(self, slot, seq, timestamp)
+
+    def _release(self, slot):
+        with self._lock:
+            self._refs[slot] -= 1
+
+    def in_use(self):
+        """Количество слотов, на которые есть ссылки."""
+        with self._lock:
+            return sum(1 for refs in self._refs if refs)
+
+    def close(self):
+        self._views = []
+        try:
+            self._shm.close()
+        except BufferError:
+            pass # На слоты еще есть ссылки - память освободится вместе с ними
+        self._shm.unlink()
@@ -0,0 +1,87 @@
+import threading
+import database as db
+from matcher import FaceMatcher
+
+
+class Gallery:
+    """
+    Версионируемая галерея известных лиц.
+
+    Текущий снимок - неизменяемый FaceMatcher. Каждое изменение (добавление,
+    обновление или удаление пользователя) строит новый снимок копированием
+    при записи и кодирует только затронутого пользователя; подписчики
+    (например, CameraManager.set_matcher) получают новый снимок атомарной
+    заменой ссылки, не останавливая видеопотоки и распознавание.
+    """
+
+    def __init__(self, matcher=None):
+        self._matcher = matcher if matcher is not None else FaceMatcher([])
+        self.version = 0
+        self._lock = threading.Lock() # Сериализует только изменения; чтение снимка без блокировок
+        self._listeners = []
+        self._changes = {} # str(user_id) -> номер последнего изменения пользователя (см. refresh_user)
+
+    @property
+    def matcher(self):
+        return self._matcher
+
+    def __len__(self):
+        return len(self._matcher)
+
+    def subscribe(self, listener):
+        """listener(matcher, version) вызывается после каждого изменения галереи."""
+        self._listeners.append(listener)
+
+    def _publish(self, matcher):
+        # Вызывается под self._lock: версии публикуются по порядку
+        self._matcher = matcher
+        self.version += 1
+        for listener in list(self._listeners):
+            try:
+                listener(matcher, self.version)
+            except Exception as e:
+                print(f"[Gallery] Ошибка обработчика обновления галереи: {e}")
+
+    def load(self, known_users=None, index=None):
+        """Полностью перезагружает галерею (при запуске): по умолчанию - из базы данных."""
+        if known_users is None:
+            known_users, index = db.get_known_face_encodings(), db.load_face_index()
+        matcher = FaceMatcher(known_users, index=index)
+        with self._lock:
+            self._publish(matcher)
+        return self.version
+
+    def apply(self, upserts=(), removals=()):
+        """Применяет пакет изменений одним новым снимком; возвращает номер версии."""
+        with self._lock:
+            return self._apply(upserts, removals)
+
+    def _apply(self, upserts, removals):
+        # Вызывается под self._lock
+        upserts = list(upserts)
+        for user_id in [user['id'] for user in upserts] + list(removals):
+            self._changes[str(user_id)] = self._changes.get(str(user_id), 0) + 1
+        self._publish(self._matcher.updated(upserts, removals))
+        return self.version
+
+    def refresh_user(self, user_id):
+        """
+        Перечитывает пользователя из базы после добавления или редактирования:
+        эмбеддинг берется из кэша, кодируется только новое фото. Пользователь без
+        фото или без лица на фото убирается из галереи. Кодирование идет без
+        блокировки, поэтому результат отбрасывается, если пользователь успел
+        измениться или быть удаленным (иначе поздний refresh вернул бы
+        удаленного пользователя).
+        """
+        with self._lock:
+            change = self._changes.get(str(user_id), 0)
+        user = db.get_known_user(user_id)
+        with self._lock:
+            if self._changes.get(str(user_id), 0) != change:
+                return self.version # Более позднее изменение уже применено
+            if user is None:
+                return self._apply((), [user_id])
+            return self._apply([user], ())
+
+    def remove_user(self, user_id):
+        return self.apply(removals=[user_id])
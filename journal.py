@@ -0,0 +1,214 @@
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+JOURNAL_FILE = "access_journal.db"
+MAX_QUEUE = 10000 # Максимум событий, ожидающих записи
+BATCH_SIZE = 500 # Максимум событий в одной транзакции
+FLUSH_SECONDS = 0.5 # Сколько ждать, чтобы набрать пакет
+DROPPED_SNAPSHOT_SECONDS = 60.0 # Сколько помнить отброшенные снимки для событий, еще не дошедших до записи
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera_ip TEXT,
+    location TEXT,
+    room_id TEXT,
+    user_id TEXT,
+    name TEXT,
+    track_id INTEGER,
+    distance REAL,
+    granted INTEGER NOT NULL,
+    snapshot_path TEXT
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_room_ts ON events (room_id, ts);
+CREATE INDEX IF NOT EXISTS events_user_ts ON events (user_id, ts);
+"""
+
+COLUMNS = ('ts', 'camera_ip', 'location', 'room_id', 'user_id', 'name', 'track_id', 'distance', 'granted', 'snapshot_path')
+
+
+def _event_row(event):
+    user = event.get('user')
+    distance = event.get('distance')
+    return (event.get('time') or time.time(), event.get('camera_ip'), event.get('location'), event.get('room_id'),
+            user['id'] if user else None, event.get('name'), event.get('track_id'),
+            float(distance) if distance is not None else None, 1 if event.get('access_granted') else 0,
+            event.get('snapshot_path'))
+
+
+class AccessJournal:
+    """
+    Журнал событий доступа только на добавление (SQLite, режим WAL).
+
+    События от CameraManager ставятся в ограниченную очередь (record можно
+    передать прямо в add_listener) и записываются фоновым потоком пакетами -
+    одна транзакция на пакет, поэтому поток распознавания не ждет диска.
+    Индексы по времени, помещению и пользователю позволяют отвечать на
+    запросы вида «кто входил в A1 с t1 по t2» за миллисекунды и на журнале
+    за многие месяцы.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, max_queue=MAX_QUEUE, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._dropped_snapshots = deque() # (путь, время события) от SnapshotWriter
+        self._cleared = {} # путь -> время получения; только поток записи
+        self._local = threading.local()
+        self._thread = None
+        self.is_running = False
+        self.written = 0; self.dropped = 0; self.batches = 0; self.errors = 0
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        """Соединение для текущего потока: запись идет из фонового потока, запросы - из любых."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def start(self):
+        if self.is_running: return
+        self.is_running = True
+        self._thread = threading.Thread(target=self._writer, daemon=True, name="journal"); self._thread.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток записи."""
+        if not self.is_running: return
+        self.is_running = False
+        self._thread.join(timeout=10); self._thread = None
+
+    def record(self, event):
+        """Ставит событие в очередь записи; при переполнении событие отбрасывается (False)."""
+        try:
+            self._queue.put_nowait(_event_row(event))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def discard_snapshot(self, path, timestamp):
+        """
+        Убирает ссылку на снимок, который не будет записан (передается в
+        SnapshotWriter.add_drop_listener): у записанных событий с момента
+        timestamp и у событий, еще ожидающих записи.
+        """
+        self._dropped_snapshots.append((path, timestamp))
+
+    def _writer(self):
+        while self.is_running or not self._queue.empty() or self._dropped_snapshots:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_seconds))
+            except queue.Empty:
+                pass
+            deadline = time.monotonic() + self.flush_seconds
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            dropped, now = [], time.monotonic()
+            while self._dropped_snapshots:
+                path, timestamp = self._dropped_snapshots.popleft()
+                dropped.append((timestamp, path)); self._cleared[path] = now
+            for path in [path for path, seen in self._cleared.items() if now - seen > DROPPED_SNAPSHOT_SECONDS]:
+                del self._cleared[path]
+            if not batch and not dropped:
+                continue
+            if self._cleared:
+                batch = [row[:-1] + (None,) if row[-1] in self._cleared else row for row in batch]
+            try:
+                conn = self._connection()
+                with conn:
+                    if batch:
+                        conn.executemany(f"INSERT INTO events ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", batch)
+                    if dropped:
+                        conn.executemany("UPDATE events SET snapshot_path = NULL WHERE ts >= ? AND snapshot_path = ?", dropped)
+                if batch: self.written += len(batch); self.batches += 1
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"[Journal] Ошибка записи {len(batch)} событий: {e}")
+
+    def query(self, room_id=None, start=None, end=None, user_id=None, camera_ip=None, granted=None, limit=1000):
+        """
+        События по фильтрам (все необязательны): помещение, интервал времени
+        [start, end) в секундах Unix, пользователь, камера, решение. Новые первыми.
+        """
+        where, params = [], []
+        for column, value in (('room_id', room_id), ('user_id', user_id), ('camera_ip', camera_ip)):
+            if value is not None:
+                where.append(f"{column} = ?"); params.append(value)
+        if granted is not None:
+            where.append("granted = ?"); params.append(1 if granted else 0)
+        if start is not None:
+            where.append("ts >= ?"); params.append(start)
+        if end is not None:
+            where.append("ts < ?"); params.append(end)
+        sql = f"SELECT id, {', '.join(COLUMNS)} FROM events"
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC"
+        if limit: sql += f" LIMIT {int(limit)}"
+        rows = [dict(row) for row in self._connection().execute(sql, params)]
+        for row in rows: row['granted'] = bool(row['granted'])
+        return rows
+
+    def visitors(self, room_id, start=None, end=None):
+        """Кто входил в помещение за интервал: пользователь, первый и последний проход, число проходов."""
+        sql = ("SELECT user_id, MAX(name) AS name, MIN(ts) AS first_ts, MAX(ts) AS last_ts, COUNT(*) AS passes "
+               "FROM events WHERE room_id = ? AND granted = 1 AND user_id IS NOT NULL")
+        params = [room_id]
+        if start is not None: sql += " AND ts >= ?"; params.append(start)
+        if end is not None: sql += " AND ts < ?"; params.append(end)
+        sql += " GROUP BY user_id ORDER BY first_ts"
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def stats(self):
+        return {'queue_depth': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped,
+                'batches': self.batches, 'errors': self.errors}
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запросы к журналу событий доступа.")
+    parser.add_argument('--room', default=None, help="ID помещения")
+    parser.add_argument('--user', default=None, help="ID пользователя")
+    parser.add_argument('--camera', default=None, help="IP камеры")
+    parser.add_argument('--from', dest='start', default=None, help="Начало интервала, например 2024-05-01T08:00")
+    parser.add_argument('--to', dest='end', default=None, help="Конец интервала")
+    parser.add_argument('--granted', action='store_true', help="Только разрешенные проходы")
+    parser.add_argument('--visitors', action='store_true', help="Список вошедших в помещение (--room) вместо событий")
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    journal = AccessJournal()
+    started = time.perf_counter()
+    if args.visitors:
+        if not args.room: parser.error("--visitors требует --room")
+        rows = journal.visitors(args.room, _parse_time(args.start), _parse_time(args.end))
+        for row in rows:
+            print(f"{row['user_id']}\t{row['name']}\t{datetime.fromtimestamp(row['first_ts']):%Y-%m-%d %H:%M:%S}"
+                  f" - {datetime.fromtimestamp(row['last_ts']):%Y-%m-%d %H:%M:%S}\tпроходов: {row['passes']}")
+    else:
+        rows = journal.query(args.room, _parse_time(args.start), _parse_time(args.end), args.user, args.camera,
+                             True if args.granted else None, args.limit)
+        for row in rows:
+            decision = "разрешен" if row['granted'] else "запрещен"
+            print(f"{datetime.fromtimestamp(row['ts']):%Y-%m-%d %H:%M:%S}\t{row['location']}\t{row['name']}\t{decision}\t{row['snapshot_path'] or ''}")
+    print(f"Найдено: {len(rows)} за {(time.perf_counter() - started) * 1000:.1f} мс")
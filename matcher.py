@@ -0,0 +1,87 @@
+import numpy as np
+from face_index import BruteForceIndex
+
+DEFAULT_TOLERANCE = 0.5
+
+
+class FaceMatcher:
+    """
+    Сопоставление эмбеддингов лиц с базой известных пользователей.
+
+    Поиск выполняется через подключаемый индекс: по умолчанию точный перебор
+    (BruteForceIndex) - непрерывная матрица float32 (N, 128) с заранее
+    посчитанными квадратами норм, все лица кадра сравниваются с базой одним
+    матричным умножением. Для больших баз можно передать IVFIndex.
+    """
+
+    def __init__(self, known_users, tolerance=DEFAULT_TOLERANCE, index=None):
+        self.users = list(known_users)
+        self.users_by_id = {str(user['id']): user for user in self.users}
+        self.tolerance = tolerance
+        if index is None:
+            index = BruteForceIndex()
+            if self.users:
+                index.add(list(self.users_by_id), [user['encoding'] for user in self.users_by_id.values()])
+        else:
+            self._sync_index(index)
+        self.index = index
+
+    def _sync_index(self, index):
+        """Приводит готовый индекс в соответствие с текущим списком пользователей."""
+        indexed = index.ids()
+        stale = indexed - self.users_by_id.keys()
+        if stale:
+            index.remove(stale)
+        missing = [user_id for user_id in self.users_by_id if user_id not in indexed]
+        if missing:
+            index.add(missing, [self.users_by_id[user_id]['encoding'] for user_id in missing])
+
+    def updated(self, upserts=(), removals=()):
+        """
+        Возвращает новый сопоставитель с добавленными/измененными (upserts -
+        пользователи с эмбеддингами) и удаленными (removals - ID) пользователями.
+        Текущий объект не меняется, поэтому потоки распознавания, которые им
+        пользуются, не видят промежуточного состояния.
+        """
+        users_by_id = dict(self.users_by_id)
+        index = self.index.copy()
+        removed = {str(user_id) for user_id in removals}
+        for user_id in removed:
+            users_by_id.pop(user_id, None)
+        if removed:
+            index.remove(removed)
+        upserts = list(upserts)
+        for user in upserts:
+            users_by_id[str(user['id'])] = user
+        if upserts:
+            index.add([str(user['id']) for user in upserts], [user['encoding'] for user in upserts])
+        matcher = FaceMatcher.__new__(FaceMatcher)
+        matcher.users, matcher.users_by_id = list(users_by_id.values()), users_by_id
+        matcher.tolerance, matcher.index = self.tolerance, index
+        return matcher
+
+    def __len__(self):
+        return len(self.users)
+
+    def top_k(self, encodings, k=1):
+        """Для каждого эмбеддинга возвращает до k пар (пользователь, расстояние) по возрастанию расстояния."""
+        if not len(encodings):
+            return []
+        if not self.users:
+            return [[] for _ in encodings]
+        results = self.index.search(np.asarray(encodings, dtype=np.float32), k)
+        return [[(self.users_by_id[user_id], distance) for user_id, distance in candidates if user_id in self.users_by_id]
+                for candidates in results]
+
+    def match(self, encodings):
+        """
+        Для каждого эмбеддинга возвращает (пользователь, расстояние) ближайшего
+        совпадения; пользователь равен None, если расстояние больше допуска.
+        """
+        matches = []
+        for candidates in self.top_k(encodings, k=1):
+            if candidates and candidates[0][1] <= self.tolerance:
+                matches.append(candidates[0])
+            else:
+                matches.append((None, candidates[0][1] if candidates else None))
+        return matches
@@ -0,0 +1,252 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    items = ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for key, value in labels)
+    return "{" + items + "}"
+
+
+class Counter:
+    """Монотонный счетчик."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами: observe стоит один bisect и
+    инкремент под блокировкой, поэтому ее можно вызывать на каждом кадре.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Последняя корзина - больше всех границ
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1; self.sum += value; self.count += 1
+
+    def time(self):
+        """Контекстный менеджер: наблюдает длительность блока."""
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, snapshot=None):
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)."""
+        counts, _, count = snapshot or self.snapshot()
+        if not count:
+            return None
+        rank, seen = q * count, 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                low = self.buckets[index - 1] if index else 0.0
+                high = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик конвейера: гистограммы и счетчики с метками (камера, этап)
+    создаются при первом обращении, а датчики (глубины очередей, FPS,
+    отброшенные кадры) - функции, которые вызываются только при выгрузке,
+    поэтому ничего не стоят на горячем пути.
+    """
+
+    def __init__(self):
+        self._metrics = {} # (имя, метки) -> Counter/Histogram
+        self._kinds = {} # имя -> ('counter' | 'histogram' | 'gauge', описание)
+        self._gauges = {} # имя -> {источник: функция, возвращающая [(метки, значение)]} (датчики и счетчики-функции)
+        self._lock = threading.Lock()
+
+    def _get(self, kind, factory, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = factory()
+                    self._kinds.setdefault(name, (kind, help))
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get('counter', Counter, name, help, labels)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get('histogram', lambda: Histogram(buckets), name, help, labels)
+
+    def gauge(self, name, collect, help="", source=None):
+        """
+        collect() возвращает список (dict меток, значение). Несколько источников
+        могут отдавать одну метрику (например, глубины разных очередей);
+        повторная регистрация того же источника заменяет функцию.
+        """
+        self._register('gauge', name, collect, help, source)
+
+    def counters(self, name, collect, help="", source=None):
+        """
+        Как gauge, но для нарастающих итогов, которые ведет сам объект
+        (целые поля потока камеры): выгружаются с типом counter, чтобы
+        Prometheus считал rate() и учитывал сбросы. Имя - с суффиксом _total.
+        """
+        self._register('counter', name, collect, help, source)
+
+    def _register(self, kind, name, collect, help, source):
+        with self._lock:
+            self._gauges.setdefault(name, {})[source or name] = collect
+            self._kinds.setdefault(name, (kind, help))
+
+    def _collect(self):
+        with self._lock:
+            metrics, kinds = dict(self._metrics), dict(self._kinds)
+            gauges = [(name, collect) for name, sources in self._gauges.items() for collect in sources.values()]
+        samples = {}
+        for (name, labels), metric in metrics.items():
+            samples.setdefault(name, []).append((labels, metric))
+        for name, collect in gauges:
+            try:
+                samples.setdefault(name, []).extend((tuple(sorted(labels.items())), value) for labels, value in collect())
+            except Exception as e:
+                print(f"[Metrics] Ошибка датчика {name}: {e}")
+        return kinds, samples
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        kinds, samples = self._collect()
+        lines = []
+        for name in sorted(samples):
+            kind, help = kinds.get(name, ('gauge', ''))
+            if help: lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in sorted(samples[name], key=lambda sample: sample[0]):
+                if kind == 'counter':
+                    lines.append(f"{name}{_label_text(labels)} {metric.value if isinstance(metric, Counter) else metric}")
+                elif kind == 'histogram':
+                    counts, total, count = metric.snapshot()
+                    cumulative = 0
+                    for bucket, bucket_count in zip(metric.buckets + ('+Inf',), counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_label_text(labels + (('le', bucket),))} {cumulative}")
+                    lines.append(f"{name}_sum{_label_text(labels)} {total}")
+                    lines.append(f"{name}_count{_label_text(labels)} {count}")
+                else:
+                    lines.append(f"{name}{_label_text(labels)} {metric}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Сводка для периодической выгрузки: для гистограмм - число наблюдений и
+        p50/p95 (мс), для счетчиков и датчиков - значения. Ключ - имя{метки}.
+        """
+        kinds, samples = self._collect()
+        result = {}
+        for name, items in samples.items():
+            kind = kinds.get(name, ('gauge', ''))[0]
+            for labels, metric in items:
+                key = name + _label_text(labels)
+                if kind == 'histogram':
+                    snapshot = metric.snapshot()
+                    p50, p95 = metric.quantile(0.5, snapshot), metric.quantile(0.95, snapshot)
+                    result[key] = {'count': snapshot[2], 'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+                                   'p95_ms': round(p95 * 1000, 2) if p95 is not None else None}
+                else:
+                    result[key] = metric.value if isinstance(metric, Counter) else metric
+        return result
+
+
+REGISTRY = MetricsRegistry() # Общий реестр процесса
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY):
+    """Запускает в фоновом потоке HTTP-сервер с /metrics в формате Prometheus; возвращает сервер."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404); return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers(); self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass # Опросы Prometheus не засоряют вывод
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
+
+
+class MetricsReporter:
+    """Периодически выводит сводку метрик; для счетчиков добавляет скорость (в секунду) за интервал."""
+
+    def __init__(self, interval=60.0, registry=REGISTRY, output=print):
+        self.interval = interval
+        self.registry = registry
+        self.output = output
+        self._stop = threading.Event()
+        self._previous = {}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="metrics-reporter"); self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        last = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            summary = self.registry.summary()
+            lines = []
+            for key in sorted(summary):
+                value = summary[key]
+                if isinstance(value, dict):
+                    if not value['count']: continue
+                    lines.append(f"{key} n={value['count']} p50={value['p50_ms']}мс p95={value['p95_ms']}мс")
+                elif key.split('{')[0].endswith('_total'):
+                    rate = (value - self._previous.get(key, 0)) / (now - last)
+                    self._previous[key] = value
+                    lines.append(f"{key} {value} ({rate:.1f}/с)")
+                else:
+                    lines.append(f"{key} {value}")
+            last = now
+            self.output("[Metrics]\n  " + "\n  ".join(lines))
@@ -0,0 +1,110 @@
+import time
+import numpy as np
+import cv2
+
+# --- Настройки детектора движения ---
+MOTION_WIDTH = 160 # Ширина уменьшенного серого кадра для сравнения
+MOTION_THRESHOLD = 25 # Минимальное изменение яркости пикселя, считающееся движением
+MOTION_MIN_AREA = 0.002 # Доля пикселей зоны интереса, которая должна измениться
+MOTION_HOLD_SECONDS = 2.0 # Сколько секунд после движения обнаружение продолжает работать
+BACKGROUND_ALPHA = 0.05 # Скорость подстройки фона под освещение
+
+
+def roi_polygons(roi, width, height):
+    """
+    Переводит зону интереса камеры в многоугольники в пикселях кадра.
+    roi - список многоугольников из точек [x, y] в долях кадра (0..1),
+    поэтому одна запись подходит для любого разрешения.
+    """
+    return [np.round(np.asarray(polygon, dtype=np.float32) * [width - 1, height - 1]).astype(np.int32)
+            for polygon in roi or [] if len(polygon) >= 3]
+
+
+def roi_bounds(roi, width, height):
+    """Ограничивающий прямоугольник зоны интереса (x0, y0, x1, y1) или None, если зона не задана."""
+    polygons = roi_polygons(roi, width, height)
+    if not polygons:
+        return None
+    points = np.concatenate(polygons)
+    x0, y0 = np.maximum(points.min(axis=0), 0)
+    x1, y1 = np.minimum(points.max(axis=0) + 1, [width, height])
+    return int(x0), int(y0), int(x1), int(y1)
+
+
+def roi_mask(roi, width, height):
+    """Маска зоны интереса (uint8, 255 внутри) или None, если зона не задана."""
+    polygons = roi_polygons(roi, width, height)
+    if not polygons:
+        return None
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, polygons, 255)
+    return mask
+
+
+def in_roi(roi, point, width, height):
+    """Лежит ли точка (x, y) кадра в зоне интереса; без зоны - всегда True."""
+    polygons = roi_polygons(roi, width, height)
+    if not polygons:
+        return True
+    point = (float(point[0]), float(point[1]))
+    return any(cv2.pointPolygonTest(polygon, point, False) >= 0 for polygon in polygons)
+
+
+class MotionGate:
+    """
+    Дешевый фильтр перед обнаружением лиц: кадр уменьшается до MOTION_WIDTH,
+    переводится в серый и сравнивается с медленно обновляемым фоном только
+    внутри зоны интереса. Пока в зоне нет движения, YuNet не запускается;
+    после движения обнаружение работает еще hold_seconds.
+    """
+
+    def __init__(self, roi=None, threshold=MOTION_THRESHOLD, min_area=MOTION_MIN_AREA,
+                 hold_seconds=MOTION_HOLD_SECONDS, width=MOTION_WIDTH):
+        self.roi = roi
+        self.threshold = threshold
+        self.min_area = min_area
+        self.hold_seconds = hold_seconds
+        self.width = width
+        self.checks = 0; self.skipped = 0 # Проверенные кадры / кадры без движения
+        self._background = None
+        self._mask = None
+        self._mask_size = None
+        self._active_until = 0.0
+
+    def _prepare(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.width / width)
+        small = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def active(self, now=None):
+        """Было ли движение в зоне на последних проверках (с учетом hold_seconds)."""
+        return (time.time() if now is None else now) <= self._active_until
+
+    def check(self, frame, now=None):
+        """Возвращает True, если в зоне интереса есть движение (или оно было недавно)."""
+        now = time.time() if now is None else now
+        gray = self._prepare(frame)
+        self.checks += 1
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            self._active_until = now + self.hold_seconds
+            return True # Первый кадр: фона еще нет, обнаружение разрешено
+
+        if self._mask_size != gray.shape:
+            self._mask = roi_mask(self.roi, gray.shape[1], gray.shape[0]); self._mask_size = gray.shape
+        changed = cv2.absdiff(gray, cv2.convertScaleAbs(self._background)) > self.threshold
+        if self._mask is not None:
+            changed &= self._mask > 0
+            area = max(1, cv2.countNonZero(self._mask))
+        else:
+            area = changed.size
+        cv2.accumulateWeighted(gray, self._background, BACKGROUND_ALPHA)
+
+        if np.count_nonzero(changed) >= self.min_area * area:
+            self._active_until = now + self.hold_seconds
+        if now <= self._active_until:
+            return True
+        self.skipped += 1
+        return False
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import cv2
+import dlib
+import face_recognition
+import face_recognition.api
+
+YUNET_MODEL_PATH = "face_detection_yunet_2023mar.onnx"
+# Параметры выравнивания, с которыми face_recognition кодирует фото пользователей
+CHIP_SIZE, CHIP_PADDING = 150, 0.25
+
+log = logging.getLogger(__name__)
+
+
+def encode_face_batch(items):
+    """
+    Кодирует пакет лиц одним вызовом сети. items - список (BGR-изображение,
+    рамка (x, y, w, h)); изображения могут повторяться (несколько лиц одного
+    кадра) - цвет каждого конвертируется один раз. Каждое лицо выравнивается по
+    5 точкам dlib в чип 150x150, и весь пакет чипов кодируется за один вызов.
+    """
+    if not items:
+        return []
+    rgb_images, chips = {}, []
+    for image, (x, y, w, h) in items:
+        rgb_image = rgb_images.get(id(image))
+        if rgb_image is None:
+            rgb_image = rgb_images[id(image)] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        shape = face_recognition.api.pose_predictor_5_point(rgb_image, dlib.rectangle(int(x), int(y), int(x + w), int(y + h)))
+        chips.append(dlib.get_face_chip(rgb_image, shape, size=CHIP_SIZE, padding=CHIP_PADDING))
+    return [np.array(descriptor) for descriptor in face_recognition.api.face_encoder.compute_face_descriptor(chips)]
+
+
+def encode_faces(frame, boxes):
+    """
+    Кодирует все лица BGR-кадра по рамкам (x, y, w, h) одним пакетом. Возвращает
+    список эмбеддингов, выровненный с boxes. Используется и в потоках, и в
+    процессах пула кодирования.
+    """
+    return encode_face_batch([(frame, box) for box in boxes])
+
+
+def _chain(future, fn):
+    """Возвращает Future, который завершится результатом fn(future.result())."""
+    chained = Future()
+    def _done(source):
+        try:
+            chained.set_result(fn(source.result()))
+        except Exception as e:
+            chained.set_exception(e)
+    future.add_done_callback(_done)
+    return chained
+
+
+def _completed(value):
+    future = Future(); future.set_result(value)
+    return future
+
+
+class Recognizer:
+    """
+    Обнаружение (YuNet), кодирование и сопоставление лиц на кадре.
+
+    Может вызываться одновременно из нескольких потоков пула распознавания:
+    у каждого потока свой экземпляр детектора YuNet. Кодирование можно вынести
+    в пул процессов EncoderPool, чтобы задействовать все ядра в обход GIL.
+    """
+
+    def __init__(self, matcher, model_path=YUNET_MODEL_PATH, encoder_pool=None):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Модель '{model_path}' не найдена!")
+        self.matcher = matcher
+        self.encoder_pool = encoder_pool
+        self.model_path = model_path
+        self._local = threading.local()
+
+    def set_matcher(self, matcher):
+        self.matcher = matcher
+
+    def _detector(self, width, height):
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(self.model_path, "", (width, height))
+            self._local.detector = detector
+        detector.setInputSize((width, height))
+        return detector
+
+    def _letterbox(self, frame, size):
+        """
+        Вписывает кадр в size=(ширина, высота) с сохранением пропорций. Холст
+        с полями переиспользуется потоком между кадрами. Возвращает
+        (изображение, масштаб, отступ_x, отступ_y).
+        """
+        height, width = frame.shape[:2]
+        target_w, target_h = size
+        scale = min(target_w / width, target_h / height)
+        if scale >= 1.0:
+            return frame, 1.0, 0, 0 # Кадр и так не больше размера обнаружения
+        new_w, new_h = int(round(width * scale)), int(round(height * scale))
+        pad_x, pad_y = (target_w - new_w) // 2, (target_h - new_h) // 2
+        key = (target_w, target_h, width, height)
+        canvas = getattr(self._local, 'canvases', {}).get(key)
+        if canvas is None:
+            canvas = np.zeros((target_h, target_w, 3), dtype=np.uint8)
+            self._local.canvases = {key: canvas} # Размер кадра камеры меняется редко - храним один холст
+        canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        return canvas, scale, pad_x, pad_y
+
+    def detect(self, frame, size=None, region=None):
+        """
+        Возвращает массив лиц YuNet (x, y, w, h, 5 точек, оценка) в координатах
+        исходного кадра или пустой список. Если задан size=(ширина, высота),
+        обнаружение выполняется на уменьшенном кадре с полями, а рамки и точки
+        пересчитываются обратно, так что стоимость зависит от size, а не от
+        разрешения камеры. region=(x0, y0, x1, y1) ограничивает обнаружение
+        прямоугольником кадра (зоной интереса камеры).
+        """
+        offset_x, offset_y = 0, 0
+        if region is not None:
+            offset_x, offset_y, x1, y1 = region
+            frame = frame[offset_y:y1, offset_x:x1]
+        image, scale, pad_x, pad_y = self._letterbox(frame, size) if size else (frame, 1.0, 0, 0)
+        image = np.ascontiguousarray(image) # Вырезка зоны - представление с шагом строки кадра; у холста и целого кадра копии нет
+        height, width = image.shape[:2]
+        _, detected_faces = self._detector(width, height).detect(image)
+        if detected_faces is None:
+            return []
+        if scale != 1.0 or offset_x or offset_y:
+            # Столбцы: x, y, w, h, затем 5 точек (x, y); поля и смещение зоны применяются к координатам, но не к w/h
+            shift_x, shift_y = pad_x - offset_x * scale, pad_y - offset_y * scale
+            detected_faces = detected_faces.copy()
+            detected_faces[:, 0:14:2] = (detected_faces[:, 0:14:2] - [shift_x, 0, shift_x, shift_x, shift_x, shift_x, shift_x]) / scale
+            detected_faces[:, 1:14:2] = (detected_faces[:, 1:14:2] - [shift_y, 0, shift_y, shift_y, shift_y, shift_y, shift_y]) / scale
+        return detected_faces
+
+    def encode_async(self, frame, boxes):
+        """
+        Кодирует лица по рамкам (x, y, w, h); Future со списком эмбеддингов,
+        выровненным с boxes. С пулом процессов кодирование выполняется
+        асинхронно, иначе - сразу в текущем потоке.
+        """
+        if self.encoder_pool is not None:
+            return self.encoder_pool.submit(frame, boxes)
+        return _completed(encode_faces(frame, boxes))
+
+    def encode(self, frame, boxes):
+        return self.encode_async(frame, boxes).result()
+
+    def identify_async(self, frame, boxes, timings=None):
+        """
+        Кодирует и сопоставляет с базой лица по рамкам. Future со списком
+        словарей {'box', 'encoding', 'user', 'distance'}, выровненным с boxes;
+        user равен None для неизвестных. При пустой базе лица не кодируются.
+        В словарь timings (если передан) записываются длительности этапов
+        'encode' (с ожиданием пула) и 'match' в секундах.
+        """
+        matcher = self.matcher
+        if not len(boxes) or not len(matcher):
+            return _completed([])
+        start = time.perf_counter()
+
+        def _match(encodings):
+            # Все лица кадра сравниваются с базой одним вызовом, выбирается ближайшее совпадение
+            encoded = time.perf_counter()
+            matches = matcher.match(encodings)
+            if timings is not None:
+                timings['encode'], timings['match'] = encoded - start, time.perf_counter() - encoded
+            debug = log.isEnabledFor(logging.DEBUG)
+            results = []
+            for box, encoding, (user, distance) in zip(boxes, encodings, matches):
+                if debug: log.debug("Ближайшее совпадение: %s, расстояние: %s", user['id'] if user else None, distance)
+                results.append({'box': box, 'encoding': encoding, 'user': user, 'distance': distance})
+            return results
+        return _chain(self.encode_async(frame, boxes), _match)
+
+    def recognize_async(self, frame, detection_size=None):
+        """
+        Полный цикл распознавания кадра: обнаружение выполняется сразу (при
+        заданном detection_size - на уменьшенном кадре), кодирование - по
+        вырезкам исходного разрешения, в пуле процессов (если задан).
+        Future как у identify_async.
+        """
+        detected_faces = self.detect(frame, detection_size)
+        if len(detected_faces) and log.isEnabledFor(logging.DEBUG):
+            log.debug("Найдено лиц на кадре: %d. Известных пользователей: %d", len(detected_faces), len(self.matcher))
+        return self.identify_async(frame, [face_data[0:4].astype(np.int32) for face_data in detected_faces])
+
+    def recognize(self, frame, detection_size=None):
+        return self.recognize_async(frame, detection_size).result()
@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+import time
+
+TICK_SECONDS = 1.0 # Как часто пересчитывается расписание
+TARGET_UTILIZATION = 0.75 # Доля пула распознавания (и ядер CPU), которую можно занять
+MAX_INTERVAL = 60 # Самый редкий интервал обнаружения (кадров)
+IDLE_FPS = 5.0 # Частота обработки кадров камеры без лиц и движения при перегрузке
+DEFAULT_COST = 0.05 # Оценка стоимости обнаружения с кодированием (с), пока нет измерений
+DEFAULT_FPS = 25.0 # Частота кадров камеры, пока нет измерений
+SMOOTHING = 0.3 # Вес нового измерения в скользящем среднем стоимости
+RECOVERY = 0.8 # Перегрузка снимается, когда нагрузка опустилась ниже этой доли бюджета
+BUSY_WEIGHT, IDLE_WEIGHT = 4.0, 1.0 # Доли бюджета камер с лицами/движением и без них
+
+
+class AdaptiveScheduler:
+    """
+    Адаптивное расписание обнаружения для всех камер CameraManager.
+
+    Раз в секунду по гистограммам этапов измеряет стоимость обнаружения с
+    кодированием на каждой камере и делит бюджет пула распознавания (workers *
+    target_utilization секунд работы в секунду) между камерами: камеры с
+    лицами в кадре или движением получают больший вес и могут обнаруживать
+    чаще настроенного интервала, пустые - реже. Интервал обнаружения каждой
+    камеры выводится из выделенной доли, поэтому очередь распознавания не
+    растет, а задержка на входе остается ограниченной при росте числа камер.
+    Если бюджета не хватает даже на самый редкий интервал или загружен CPU,
+    пустые камеры дополнительно снижают частоту обработки кадров (idle_fps).
+    Текущее расписание и причины решений - в snapshot().
+    """
+
+    def __init__(self, manager, target_utilization=TARGET_UTILIZATION, tick=TICK_SECONDS, max_interval=MAX_INTERVAL,
+                 idle_fps=IDLE_FPS):
+        self.manager = manager
+        self.target_utilization = target_utilization
+        self.tick = tick
+        self.max_interval = max_interval
+        self.idle_fps = idle_fps
+        self.schedule = {} # camera_ip -> текущее решение для камеры
+        self.overloaded = False
+        self.cpu_load = None
+        self._state = {} # camera_ip -> измерения с прошлого пересчета
+        self._stop = threading.Event()
+        self._thread = None
+        metrics = manager.metrics
+        metrics.gauge('fac_detection_interval', lambda: [({'camera': ip}, row['detection_interval']) for ip, row in list(self.schedule.items())],
+                      "Текущий интервал обнаружения камеры (кадров)")
+        metrics.gauge('fac_target_fps', lambda: [({'camera': ip}, row['fps'] or 0) for ip, row in list(self.schedule.items())],
+                      "Целевая частота обработки кадров камеры (0 - без ограничения)")
+
+    def start(self):
+        if self._thread is not None: return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="adaptive-scheduler"); self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None: self._thread.join(timeout=2)
+        self._thread = None
+        self._state.clear(); self.schedule = {}
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.update()
+            except Exception as e:
+                print(f"[Scheduler] Ошибка пересчета расписания: {e}")
+
+    def _measure(self, stream):
+        """Обновляет скользящую оценку стоимости одного обнаружения (обнаружение + кодирование) для камеры."""
+        state = self._state.get(stream.camera_ip)
+        detect, encode = stream.latency['detect'].snapshot(), stream.latency['encode'].snapshot()
+        blocked = stream.detect_rejected + stream.detect_replaced
+        if state is None or state['stream'] is not stream: # Новая камера или перезапуск
+            state = self._state[stream.camera_ip] = {'stream': stream, 'cost': DEFAULT_COST, 'detect': detect, 'encode': encode,
+                                                     'blocked': blocked, 'base_interval': stream.detection_interval,
+                                                     'base_fps': stream.capture.fps}
+            return state, 0
+        count = detect[2] - state['detect'][2]
+        if count:
+            cost = (detect[1] - state['detect'][1] + encode[1] - state['encode'][1]) / count
+            state['cost'] += SMOOTHING * (cost - state['cost'])
+        state['detect'], state['encode'] = detect, encode
+        blocked, state['blocked'] = blocked - state['blocked'], blocked
+        return state, blocked
+
+    def update(self, now=None):
+        """Пересчитывает и применяет расписание; возвращает его."""
+        now = time.time() if now is None else now
+        streams = [stream for stream in list(self.manager.streams.values()) if stream.is_running]
+        for camera_ip in set(self._state) - {stream.camera_ip for stream in streams}:
+            self._state.pop(camera_ip, None)
+        if not streams:
+            self.schedule = {}
+            return self.schedule
+        cpus = os.cpu_count() or 1
+        self.cpu_load = round(os.getloadavg()[0] / cpus, 2) if hasattr(os, 'getloadavg') else None
+        budget = self.manager.scheduler.workers * self.target_utilization # Секунд распознавания в секунду
+
+        cameras = []
+        for stream in streams:
+            state, blocked = self._measure(stream)
+            faces = len(stream.tracks.tracks())
+            motion = stream.motion_gate is not None and stream.motion_gate.active(now)
+            busy = bool(faces) or motion
+            fps = stream.fps or stream.capture.fps or DEFAULT_FPS
+            if stream.capture.fps == state['base_fps']:
+                state['free_fps'] = fps # Частота без снижения расписанием - по ней оценивается перегрузка
+            base = state['base_interval']
+            min_interval = max(1, base // 3) if busy else base # Камера с лицами может обнаруживать чаще настроенного
+            cameras.append({'stream': stream, 'state': state, 'busy': busy, 'faces': faces, 'motion': motion, 'blocked': blocked,
+                            'fps': fps, 'min_interval': min_interval, 'weight': BUSY_WEIGHT if busy else IDLE_WEIGHT,
+                            'demand': fps / min_interval * state['cost']}) # Секунд распознавания в секунду при min_interval
+
+        # Распределение бюджета «заполнением»: камерам, которым хватает доли, дается сколько нужно, остаток делится между прочими
+        remaining, pending = budget, list(cameras)
+        while pending:
+            share = remaining / sum(camera['weight'] for camera in pending)
+            satisfied = [camera for camera in pending if camera['demand'] <= share * camera['weight']]
+            if not satisfied:
+                for camera in pending: camera['allocated'] = share * camera['weight']
+                break
+            for camera in satisfied:
+                camera['allocated'] = camera['demand']; remaining -= camera['demand']; pending.remove(camera)
+
+        # Перегрузка: бюджета не хватает даже на самый редкий интервал при исходной частоте кадров
+        floor_demand = sum(camera['state'].get('free_fps', camera['fps']) / self.max_interval * camera['state']['cost'] for camera in cameras)
+        limit = budget * RECOVERY if self.overloaded else budget
+        self.overloaded = floor_demand > limit or (self.cpu_load is not None and self.cpu_load > (RECOVERY if self.overloaded else 1.0))
+        schedule = {}
+        for camera in cameras:
+            stream, state = camera['stream'], camera['state']
+            rate = camera['allocated'] / state['cost'] if state['cost'] else float('inf') # Обнаружений в секунду
+            interval = camera['min_interval'] if rate == float('inf') or not rate else math.ceil(camera['fps'] / rate)
+            interval = min(self.max_interval, max(camera['min_interval'], interval))
+            if interval < stream.detection_interval:
+                interval = max(interval, stream.detection_interval // 2) # Ускоряемся постепенно, замедляемся сразу
+            limited = camera['allocated'] < camera['demand']
+            fps = state['base_fps']
+            if self.overloaded and not camera['busy']:
+                fps = min(fps, self.idle_fps) if fps else self.idle_fps
+            reasons = ["лица в кадре" if camera['faces'] else "движение" if camera['motion'] else "нет лиц и движения"]
+            if limited: reasons.append("ограничено бюджетом распознавания")
+            if camera['blocked']: reasons.append("кадры ждали распознавания")
+            if fps != state['base_fps']: reasons.append("снижен FPS из-за перегрузки")
+            stream.set_detection_interval(interval)
+            stream.capture.fps = fps
+            schedule[stream.camera_ip] = {'detection_interval': interval, 'fps': fps, 'measured_fps': round(camera['fps'], 1),
+                                          'priority': 'busy' if camera['busy'] else 'idle', 'cost_ms': round(state['cost'] * 1000, 1),
+                                          'budget_share': round(camera['allocated'] / budget, 3) if budget else None,
+                                          'reason': ", ".join(reasons)}
+        self.schedule = schedule
+        return schedule
+
+    def snapshot(self):
+        """Текущее расписание и общее состояние (для /health, /schedule и отладки)."""
+        return {'overloaded': self.overloaded, 'cpu_load': self.cpu_load, 'target_utilization': self.target_utilization,
+                'workers': self.manager.scheduler.workers, 'cameras': dict(self.schedule)}
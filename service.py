@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
+import numpy as np
+import cv2
+import database as db
+from camera_engine import CameraManager, parse_size
+from gallery import Gallery
+from journal import AccessJournal
+from metrics import REGISTRY, PROMETHEUS_CONTENT_TYPE
+from recognition import encode_face_batch
+from snapshots import SnapshotWriter
+
+DEFAULT_HOST, DEFAULT_PORT = "127.0.0.1", 8080
+MAX_BODY = 16 * 1024 ** 2 # Максимальный размер тела запроса (изображение или пользователь с фото)
+MAX_BATCH_FACES = 32 # Максимум лиц в одном пакете кодирования
+BATCH_WAIT = 0.005 # Сколько ждать другие запросы, чтобы набрать пакет (с)
+EVENT_QUEUE = 256 # События, ожидающие отправки одному подписчику SSE
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _number_param(query, key, default=None, kind=int):
+    """Числовой параметр строки запроса; некорректное значение - ошибка 400, а не 500."""
+    value = query.get(key)
+    if value in (None, ''):
+        return default
+    try:
+        return kind(value)
+    except ValueError:
+        raise HttpError(400, f"параметр {key} должен быть числом, получено '{value}'")
+
+
+def _json_value(value):
+    if isinstance(value, np.generic): return value.item()
+    if isinstance(value, np.ndarray): return value.tolist()
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, default=_json_value).encode('utf-8')
+
+
+def public_event(event):
+    """Событие CameraManager для внешних клиентов: вместо словаря пользователя - его ID."""
+    event = dict(event)
+    user = event.pop('user', None)
+    event['user_id'] = user['id'] if user else None
+    return event
+
+
+class FaceBatcher:
+    """
+    Объединяет лица из одновременных запросов /recognize в общий пакет: все
+    лица пакета кодируются одним вызовом сети и сопоставляются с базой одним
+    вызовом matcher.match, поэтому много контроллеров дверей обслуживаются
+    одним процессом без пропорционального роста затрат.
+    """
+
+    def __init__(self, recognizer, executor, max_faces=MAX_BATCH_FACES, wait=BATCH_WAIT):
+        self.recognizer = recognizer
+        self.executor = executor
+        self.max_faces = max_faces
+        self.wait = wait
+        self._queue = None
+        self._task = None
+        self.batches = 0; self.faces = 0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    async def identify(self, image, boxes):
+        """Список {'box', 'user', 'distance'} для рамок изображения (как Recognizer.identify_async)."""
+        if not len(boxes) or not len(self.recognizer.matcher):
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, boxes, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            faces = len(batch[0][1])
+            deadline = loop.time() + self.wait
+            while faces < self.max_faces:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item); faces += len(item[1])
+            try:
+                results = await loop.run_in_executor(self.executor, self._identify_batch, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done(): future.set_exception(e)
+                continue
+            self.batches += 1; self.faces += faces
+            for (_, _, future), result in zip(batch, results):
+                if not future.done(): future.set_result(result)
+
+    def _identify_batch(self, batch):
+        matcher = self.recognizer.matcher # Один снимок галереи на весь пакет
+        items = [(image, box) for image, boxes, _ in batch for box in boxes]
+        matches = matcher.match(encode_face_batch(items))
+        results, position = [], 0
+        for _, boxes, _ in batch:
+            results.append([{'box': [int(v) for v in box], 'user': user, 'distance': None if distance is None else float(distance)}
+                            for box, (user, distance) in zip(boxes, matches[position:position + len(boxes)])])
+            position += len(boxes)
+        return results
+
+
+class RecognitionService:
+    """
+    Локальный HTTP API распознавания без GUI (asyncio, только стандартная библиотека):
+
+    - POST /recognize?room_id=...|camera_ip=... - тело: JPEG/PNG; лица, личности и решения о доступе
+    - GET /events - поток событий доступа камер (Server-Sent Events)
+    - GET /journal?room_id=&user_id=&start=&end=&granted=&limit= - запросы к журналу событий
+    - GET /users?q=&offset=&limit=, POST /users (JSON, фото в base64), DELETE /users/<id>
+    - GET /health - состояние камер, галереи и очередей; GET /metrics - метрики в формате Prometheus
+    - GET /schedule - текущее адаптивное расписание камер и причины решений
+    """
+
+    def __init__(self, gallery, manager, journal=None, detection_size=None, workers=4):
+        self.gallery = gallery
+        self.manager = manager
+        self.journal = journal
+        self.detection_size = parse_size(detection_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="service")
+        self.batcher = FaceBatcher(manager.recognizer, self.executor)
+        self.recognize_latency = REGISTRY.histogram('fac_api_recognize_seconds', "Время ответа POST /recognize, с")
+        REGISTRY.gauge('fac_api_batch', lambda: [({'value': 'batches'}, self.batcher.batches), ({'value': 'faces'}, self.batcher.faces)],
+                       "Пакеты кодирования API и лица в них")
+        if journal is not None:
+            REGISTRY.gauge('fac_queue_depth', lambda: [({'queue': 'journal'}, journal.stats()['queue_depth'])], source='journal')
+        self.started = time.time()
+        self.requests = 0
+        self._subscribers = set()
+        self._loop = None
+        manager.add_listener(self._on_event)
+
+    # --- События камер ---
+    def _on_event(self, event):
+        # Вызывается из потоков CameraManager: передаем событие в цикл asyncio
+        if self._loop is not None and self._subscribers:
+            self._loop.call_soon_threadsafe(self._broadcast, public_event(event))
+
+    def _broadcast(self, event):
+        for subscriber in list(self._subscribers):
+            if subscriber.full():
+                subscriber.get_nowait() # Медленный клиент теряет самые старые события, а не память сервера
+            subscriber.put_nowait(event)
+
+    # --- HTTP ---
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self._loop = asyncio.get_running_loop()
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"[Service] API слушает http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+            self.executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self._read_request(reader, writer)
+                if request is None:
+                    break
+                method, path, query, headers, body = request
+                self.requests += 1
+                if method == 'GET' and path == '/events':
+                    await self._stream_events(writer)
+                    break
+                try:
+                    status, data = await self._route(method, path, query, body)
+                except HttpError as e:
+                    status, data = e.status, {'error': str(e)}
+                except Exception as e:
+                    print(f"[Service] Ошибка обработки {method} {path}: {e}")
+                    status, data = 500, {'error': str(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, data, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            await self._respond(writer, 400, {'error': "некорректная строка запроса"}, False)
+            return None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._respond(writer, 400, {'error': "некорректный Content-Length"}, False)
+            return None
+        if length > MAX_BODY:
+            await self._respond(writer, 413, {'error': "слишком большое тело запроса"}, False)
+            return None
+        body = await reader.readexactly(length) if length else b''
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        return method.upper(), url.path.rstrip('/') or '/', query, headers, body
+
+    async def _respond(self, writer, status, data, keep_alive=True):
+        # Строка отдается как текст метрик Prometheus, остальное - как JSON
+        body, content_type = (data.encode('utf-8'), PROMETHEUS_CONTENT_TYPE) if isinstance(data, str) else (_dumps(data), "application/json; charset=utf-8")
+        writer.write((f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                      f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _stream_events(self, writer):
+        subscriber = asyncio.Queue(maxsize=EVENT_QUEUE)
+        self._subscribers.add(subscriber)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            await writer.drain()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), 15.0)
+                    writer.write(b"event: access\ndata: " + _dumps(event) + b"\n\n")
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n") # Иначе прокси и клиенты закрывают молчащее соединение
+                await writer.drain()
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def _route(self, method, path, query, body):
+        if path == '/health':
+            return 200, self.health()
+        if path == '/metrics':
+            return 200, REGISTRY.render()
+        if path == '/schedule':
+            if self.manager.adaptive is None: raise HttpError(404, "адаптивное расписание отключено")
+            return 200, self.manager.adaptive.snapshot()
+        if path == '/recognize':
+            if method != 'POST': raise HttpError(405, "используйте POST")
+            return 200, await self.recognize(body, query.get('room_id'), query.get('camera_ip'))
+        if path == '/journal':
+            if self.journal is None: raise HttpError(404, "журнал событий отключен")
+            return 200, await self._run(self.query_journal, query)
+        if path == '/users':
+            if method == 'GET':
+                return 200, await self._run(self.list_users, query.get('q', ''), _number_param(query, 'offset', 0),
+                                            _number_param(query, 'limit', 100))
+            if method == 'POST':
+                return 201, await self.enroll(body)
+            raise HttpError(405, "используйте GET или POST")
+        if path.startswith('/users/'):
+            if method != 'DELETE': raise HttpError(405, "используйте DELETE")
+            return 200, await self.delete_user(unquote(path[len('/users/'):]))
+        raise HttpError(404, f"неизвестный путь {path}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    # --- Операции API ---
+    @staticmethod
+    def _decode_image(data, what="тело запроса"):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise HttpError(400, f"{what} должно быть изображением JPEG или PNG")
+        return image
+
+    def _detect(self, body):
+        image = self._decode_image(body)
+        faces = self.manager.recognizer.detect(image, self.detection_size)
+        return image, [face[0:4].astype(np.int32) for face in faces]
+
+    async def recognize(self, body, room_id=None, camera_ip=None):
+        """Лица на изображении: рамка, пользователь, расстояние и решение о доступе в помещение."""
+        if not body:
+            raise HttpError(400, "пустое тело запроса")
+        start = time.perf_counter()
+        if room_id is None and camera_ip:
+            room_id = await self._run(db.get_room_by_camera_ip, camera_ip) # Запрос к SQLite - не в цикле событий
+        image, boxes = await self._run(self._detect, body)
+        faces = await self.batcher.identify(image, boxes)
+        for face in faces:
+            user = face.pop('user')
+            face['user_id'] = user['id'] if user else None
+            face['name'] = user['name'] if user else "Unknown"
+            face['access_granted'] = db.check_access(user['departament'] if user else None, room_id)
+        self.recognize_latency.observe(time.perf_counter() - start)
+        return {'room_id': room_id, 'faces': faces, 'gallery_version': self.gallery.version}
+
+    def list_users(self, query, offset, limit):
+        users = db.search_users(query, offset, min(limit, 1000))
+        for user in users: user.pop('photo_path', None)
+        return {'total': db.count_users(query), 'users': users}
+
+    async def enroll(self, body):
+        """Регистрация пользователя: JSON {id, first_name, last_name, passport_number, departament, photo (base64)}."""
+        try:
+            user = json.loads(body or b'{}')
+            photo = base64.b64decode(user['photo'], validate=True)
+            user_id, first_name, last_name = str(user['id']).strip(), user['first_name'].strip(), user['last_name'].strip()
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise HttpError(400, f"некорректный пользователь: {e}")
+        if not user_id or not first_name or not last_name or not photo:
+            raise HttpError(400, "обязательны id, first_name, last_name и photo")
+        if not db.is_valid_user_id(user_id):
+            raise HttpError(400, "id может содержать только буквы, цифры, '_' и '-' (до 64 символов)")
+        await self._run(self._decode_image, photo, "photo") # До записи пользователя: иначе останется пользователь без фото
+        added = await self._run(db.add_user, user_id, first_name, last_name, user.get('passport_number', ''),
+                                user.get('departament', ''), photo)
+        if not added:
+            raise HttpError(409, f"пользователь с ID {user_id} уже существует")
+        version = await self._run(self.gallery.refresh_user, user_id)
+        return {'id': user_id, 'gallery_version': version, 'recognizable': user_id in self.gallery.matcher.users_by_id}
+
+    async def delete_user(self, user_id):
+        if await self._run(db.get_user_details, user_id) is None:
+            raise HttpError(404, f"пользователь с ID {user_id} не найден")
+        await self._run(db.delete_user, user_id)
+        return {'id': user_id, 'gallery_version': await self._run(self.gallery.remove_user, user_id)}
+
+    def query_journal(self, query):
+        granted = query.get('granted')
+        return {'events': self.journal.query(query.get('room_id'), _number_param(query, 'start', kind=float),
+                                             _number_param(query, 'end', kind=float), query.get('user_id'), query.get('camera_ip'),
+                                             None if granted is None else granted in ('1', 'true'), _number_param(query, 'limit', 100))}
+
+    def health(self):
+        cameras = {camera_ip: {'location': stream.location, 'room_id': stream.room_id, 'alive': stream.thread.is_alive() if stream.thread else False}
+                   for camera_ip, stream in list(self.manager.streams.items())}
+        data = {'uptime': round(time.time() - self.started, 1), 'requests': self.requests, 'cameras': cameras,
+                'gallery': {'version': self.gallery.version, 'users': len(self.gallery)},
+                'batches': {'count': self.batcher.batches, 'faces': self.batcher.faces},
+                'event_subscribers': len(self._subscribers), 'cooldown': self.manager.cooldowns.stats()}
+        if self.manager.snapshot_writer is not None: data['snapshots'] = self.manager.snapshot_writer.stats()
+        if self.journal is not None: data['journal'] = self.journal.stats()
+        if self.manager.adaptive is not None: data['schedule'] = self.manager.adaptive.snapshot()
+        return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служба распознавания без GUI: камеры из базы и локальный HTTP API.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="Адрес API (по умолчанию только локальный)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--no-cameras', action='store_true', help="Не запускать камеры, только API распознавания")
+    parser.add_argument('--workers', type=int, default=None, help="Количество потоков распознавания камер")
+    parser.add_argument('--api-workers', type=int, default=4, help="Количество потоков обработки запросов API")
+    parser.add_argument('--encoder-workers', type=int, default=0, help="Количество процессов кодирования лиц камер")
+    parser.add_argument('--detection-size', default=None, help="Разрешение обнаружения лиц, например 640x360")
+    parser.add_argument('--no-journal', action='store_true', help="Не записывать события в журнал")
+    parser.add_argument('--fixed-schedule', action='store_true', help="Не подстраивать интервал обнаружения и FPS камер под загрузку")
+    parser.add_argument('--log-level', default='WARNING', help="Уровень журнала (DEBUG - отладочные сообщения распознавания)")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    db.initialize_database()
+    gallery = Gallery(); gallery.load()
+    print(f"Загружено {len(gallery)} пользователей из базы данных.")
+    snapshot_writer = SnapshotWriter(); snapshot_writer.start()
+    manager = CameraManager(gallery.matcher, snapshot_writer, workers=args.workers, encoder_workers=args.encoder_workers,
+                            detection_size=args.detection_size, adaptive=not args.fixed_schedule)
+    gallery.subscribe(lambda matcher, version: manager.set_matcher(matcher))
+    journal = None
+    if not args.no_journal:
+        journal = AccessJournal(); journal.start()
+        manager.add_listener(journal.record); snapshot_writer.add_drop_listener(journal.discard_snapshot)
+    service = RecognitionService(gallery, manager, journal, args.detection_size, args.api_workers)
+    if not args.no_cameras:
+        manager.start_all(db.get_all_camera_configs())
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.stop(); snapshot_writer.stop()
+        if journal is not None: journal.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+import itertools
+import cv2
+
+# --- Настройки сохранения снимков ---
+SAVE_FOLDER = "detected_faces"
+JPEG_QUALITY = 85
+MAX_QUEUE = 32 # Максимум снимков, ожидающих записи
+CROP_MARGIN = 0.5 # Запас вокруг лица при сохранении только вырезки
+MAX_AGE_DAYS = 30 # Снимки старше удаляются
+MAX_BYTES = 2 * 1024 ** 3 # Бюджет диска на папку снимков
+RETENTION_INTERVAL = 60.0 # Как часто проверяется срок хранения
+DROP_OLDEST, DROP_NEWEST = 'drop_oldest', 'drop_newest'
+
+
+def safe_filename(name):
+    return name.replace(" ", "_").replace(":", "-").replace("/", "_").replace("\\", "_").replace("(", "").replace(")", "")
+
+
+class SnapshotWriter:
+    """
+    Ограниченная очередь снимков событий с пулом потоков кодирования JPEG.
+
+    Снимки с одинаковым ключом (камера, человек и трек), еще ожидающие записи,
+    объединяются: остается только последний. При переполнении очереди
+    отбрасывается самый старый (drop_oldest) или новый (drop_newest) снимок,
+    так что всплеск событий не расходует память без ограничений; о снимках,
+    отброшенных после того, как их путь уже отдан событию, сообщается
+    обработчикам add_drop_listener. Файлы раскладываются по папкам дат;
+    снимки старше срока хранения и сверх бюджета диска удаляются.
+    """
+
+    def __init__(self, folder=SAVE_FOLDER, workers=2, max_queue=MAX_QUEUE, quality=JPEG_QUALITY, crop_only=False,
+                 policy=DROP_OLDEST, max_age_days=MAX_AGE_DAYS, max_bytes=MAX_BYTES):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Неизвестная политика очереди снимков '{policy}'.")
+        self.folder = folder
+        self.workers = workers
+        self.max_queue = max_queue
+        self.quality = quality
+        self.crop_only = crop_only
+        self.policy = policy
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.is_running = False
+        self._pending = OrderedDict() # ключ -> (путь, изображение, время события)
+        self._drop_listeners = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._dirs = set()
+        self._files = deque() # (путь, размер, время записи) в порядке записи - для удаления самых старых
+        self._bytes = 0
+        self._last_retention = 0.0
+        self._latencies = deque(maxlen=256)
+        self.written = 0; self.dropped = 0; self.coalesced = 0; self.errors = 0; self.deleted = 0; self.max_depth = 0
+
+    def start(self):
+        if self.is_running: return
+        os.makedirs(self.folder, exist_ok=True)
+        self._scan()
+        self.is_running = True
+        self._threads = [threading.Thread(target=self._worker, daemon=True, name=f"snapshots-{i}") for i in range(self.workers)]
+        for thread in self._threads: thread.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает потоки."""
+        with self._cond:
+            self.is_running = False; self._cond.notify_all()
+        for thread in self._threads: thread.join(timeout=5)
+        self._threads = []
+
+    def add_drop_listener(self, listener):
+        """listener(path, timestamp) вызывается, если снимок, путь которого вернул submit, не будет записан."""
+        self._drop_listeners.append(listener)
+
+    def _notify_dropped(self, path, timestamp):
+        for listener in list(self._drop_listeners):
+            try:
+                listener(path, timestamp)
+            except Exception as e:
+                print(f"[Snapshots] Ошибка обработчика отброшенного снимка: {e}")
+
+    def submit(self, frame, box, label, camera_ip=None, timestamp=None, track_id=None):
+        """
+        Ставит снимок в очередь: рамка и подпись рисуются на копии кадра (или
+        на вырезке лица при crop_only). Возвращает путь будущего файла или None,
+        если снимок отброшен; если файл так и не будет записан (вытеснен из
+        очереди или ошибка записи), вызываются обработчики add_drop_listener.
+        """
+        if not self.is_running:
+            return None
+        timestamp = time.time() if timestamp is None else timestamp
+        (x, y, w, h) = [int(v) for v in box]
+        if self.crop_only:
+            height, width = frame.shape[:2]
+            mx, my = int(w * CROP_MARGIN), int(h * CROP_MARGIN)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            image = frame[y0:min(height, y + h + my), x0:min(width, x + w + mx)].copy()
+            x, y = x - x0, y - y0
+        else:
+            image = frame.copy()
+        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 255), 2)
+        cv2.putText(image, label, (x, max(12, y - 10)), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+        moment = datetime.fromtimestamp(timestamp)
+        # Камера и порядковый номер в имени: снимки разных камер и треков одной секунды не перезаписывают друг друга
+        name = f"{moment.strftime('%H-%M-%S')}_{safe_filename(str(camera_ip)) + '_' if camera_ip else ''}{safe_filename(label)}_{next(self._sequence)}.jpg"
+        path = os.path.join(self.folder, moment.strftime('%Y-%m-%d'), name)
+        key = (camera_ip, label, track_id) # Трек различает разных людей с одной подписью (например, "Unknown")
+        dropped = None
+        with self._cond:
+            if key in self._pending:
+                self.coalesced += 1 # Более свежий снимок того же человека заменяет ожидающий
+                path, _, timestamp = self._pending.pop(key) # под прежним именем: на него уже ссылается событие
+            elif len(self._pending) >= self.max_queue:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return None
+                _, (dropped_path, _, dropped_time) = self._pending.popitem(last=False)
+                dropped = (dropped_path, dropped_time)
+            self._pending[key] = (path, image, timestamp)
+            self.max_depth = max(self.max_depth, len(self._pending))
+            self._cond.notify()
+        if dropped is not None:
+            self._notify_dropped(*dropped)
+        return path
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        """Метрики: глубина очереди, счетчики и время записи (мс)."""
+        latencies = sorted(self._latencies)
+        return {'queue_depth': self.depth(), 'max_depth': self.max_depth, 'written': self.written, 'dropped': self.dropped,
+                'coalesced': self.coalesced, 'errors': self.errors, 'deleted': self.deleted, 'bytes_on_disk': self._bytes,
+                'write_ms_avg': round(sum(latencies) / len(latencies), 2) if latencies else None,
+                'write_ms_max': round(latencies[-1], 2) if latencies else None}
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self.is_running and not self._pending:
+                    self._cond.wait(1.0)
+                if not self._pending:
+                    return # Остановлен и очередь пуста
+                _, (path, image, timestamp) = self._pending.popitem(last=False)
+            start = time.perf_counter()
+            try:
+                self._write(path, image)
+            except Exception as e:
+                self.errors += 1
+                print(f"[Snapshots] Ошибка при сохранении файла {path}: {e}")
+                self._notify_dropped(path, timestamp)
+            self._latencies.append((time.perf_counter() - start) * 1000)
+            self._retention()
+
+    def _write(self, path, image):
+        ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)])
+        if not ok:
+            raise IOError("не удалось закодировать JPEG")
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True); self._dirs.add(directory)
+        with open(path, 'wb') as f:
+            f.write(data.tobytes())
+        with self._cond:
+            self._files.append((path, len(data), time.time())); self._bytes += len(data)
+            self.written += 1
+
+    def _scan(self):
+        """Учитывает уже сохраненные снимки (от старых к новым) для бюджета диска."""
+        files = []
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                if name.startswith('.'): continue # .gitkeep и служебные файлы не трогаем
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        files.sort()
+        self._files = deque((path, size, mtime) for mtime, path, size in files)
+        self._bytes = sum(size for _, _, size in files)
+
+    def _retention(self):
+        """
+        Удаляет снимки старше max_age_days (по времени записи, в том числе
+        файлы вне папок дат) и самые старые файлы сверх max_bytes.
+        """
+        now = time.time()
+        with self._cond:
+            over_budget = self.max_bytes and self._bytes > self.max_bytes
+            if not over_budget and now - self._last_retention < RETENTION_INTERVAL:
+                return
+            self._last_retention = now
+            victims = []
+            if self.max_age_days:
+                cutoff = now - self.max_age_days * 86400
+                while self._files and self._files[0][2] < cutoff:
+                    victims.append(self._files.popleft()); self._bytes -= victims[-1][1]
+            while self.max_bytes and self._bytes > self.max_bytes and self._files:
+                victims.append(self._files.popleft()); self._bytes -= victims[-1][1]
+        for path, _, _ in victims:
+            try:
+                os.remove(path); self.deleted += 1
+            except OSError:
+                pass
+        for directory in {os.path.dirname(path) for path, _, _ in victims}:
+            if os.path.normpath(directory) == os.path.normpath(self.folder): continue
+            try:
+                os.rmdir(directory); self._dirs.discard(directory) # Удаляется только опустевшая папка даты
+            except OSError:
+                pass
@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from PIL import Image
+from face_cache import CACHE_DIR
+
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, 'thumbnails')
+THUMBNAIL_SIZE = (100, 100)
+MEMORY_ITEMS = 1024 # Сколько миниатюр держать в памяти
+
+
+class ThumbnailCache:
+    """
+    Миниатюры фото пользователей. На диске хранятся по хэшу содержимого фото
+    (<sha1>.jpg), поэтому переименование или повторная загрузка того же фото
+    не требует пересчета, а измененное фото получает новую миниатюру.
+    Миниатюры готовятся фоновым потоком: GUI запрашивает их через request и
+    забирает готовые через ready, не блокируясь на чтении и масштабировании.
+    """
+
+    def __init__(self, directory=THUMBNAIL_DIR, size=THUMBNAIL_SIZE, memory_items=MEMORY_ITEMS):
+        self.directory = directory
+        self.size = size
+        self.memory_items = memory_items
+        self._memory = OrderedDict() # хэш -> PIL.Image (LRU)
+        self._requested = set()
+        self._ready = []
+        self._queue = queue.LifoQueue() # Последние запрошенные (видимые сейчас) строки - первыми
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, photo_hash):
+        """Миниатюра из памяти или None (тогда ее нужно запросить через request)."""
+        with self._lock:
+            image = self._memory.get(photo_hash)
+            if image is not None:
+                self._memory.move_to_end(photo_hash)
+            return image
+
+    def request(self, photo_hash, photo_path):
+        """Ставит миниатюру в очередь фонового потока (повторные запросы игнорируются)."""
+        with self._lock:
+            if photo_hash in self._memory or photo_hash in self._requested:
+                return
+            self._requested.add(photo_hash)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, daemon=True, name="thumbnails"); self._thread.start()
+        self._queue.put((photo_hash, photo_path))
+
+    def ready(self):
+        """Хэши миниатюр, подготовленных с прошлого вызова."""
+        with self._lock:
+            ready, self._ready = self._ready, []
+            return ready
+
+    def _worker(self):
+        while True:
+            photo_hash, photo_path = self._queue.get()
+            try:
+                image = self._load(photo_hash, photo_path)
+            except Exception as e:
+                print(f"Ошибка загрузки фото для GUI: {e}")
+                image = None
+            with self._lock:
+                self._requested.discard(photo_hash)
+                if image is None:
+                    continue
+                self._memory[photo_hash] = image
+                while len(self._memory) > self.memory_items:
+                    self._memory.popitem(last=False)
+                self._ready.append(photo_hash)
+
+    def _load(self, photo_hash, photo_path):
+        path = os.path.join(self.directory, f"{photo_hash}.jpg")
+        if os.path.exists(path):
+            image = Image.open(path); image.load()
+            return image
+        image = Image.open(photo_path)
+        image.draft('RGB', (self.size[0] * 2, self.size[1] * 2)) # JPEG декодируется сразу в уменьшенном масштабе
+        image = image.convert('RGB').resize(self.size, Image.Resampling.LANCZOS)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        image.save(tmp_path, 'JPEG', quality=90)
+        os.replace(tmp_path, path)
+        return image
@@ -0,0 +1,250 @@
+import itertools
+import threading
+import time
+import numpy as np
+import cv2
+
+# --- Настройки сопровождения лиц ---
+IOU_THRESHOLD = 0.3 # Минимальное перекрытие рамок для привязки обнаружения к треку
+CONFIDENT_DISTANCE = 0.4 # Совпадение ближе этого расстояния считается уверенным
+REENCODE_SECONDS = 10.0 # Уверенный трек перекодируется не чаще этого интервала
+RETRY_SECONDS = 1.0 # Неизвестный/неуверенный трек перекодируется не чаще этого интервала
+IDENTITY_SWITCH_DISTANCE = 0.6 # Новый эмбеддинг трека дальше этого - в рамке другой человек
+MAX_MISSES = 2 # Сколько циклов обнаружения подряд трек может не находиться
+
+
+def iou(box_a, box_b):
+    """Пересечение над объединением для рамок (x, y, w, h)."""
+    ax, ay, aw, ah = box_a; bx, by, bw, bh = box_b
+    ix = max(0.0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0.0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """Сопровождаемое лицо: рамка, трекер и закэшированная личность."""
+
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = tuple(box)
+        self.tracker = None
+        self.user = None
+        self.distance = None
+        self.encoding = None
+        self.encoded_at = None
+        self.last_seen = now
+        self.misses = 0
+
+    @property
+    def name(self):
+        return f"{self.user['name']} (ID: {self.user['id']})" if self.user else "Unknown"
+
+    @property
+    def confident(self):
+        return self.user is not None and self.distance is not None and self.distance <= CONFIDENT_DISTANCE
+
+    def needs_encoding(self, now):
+        if self.encoded_at is None:
+            return True
+        budget = REENCODE_SECONDS if self.confident else RETRY_SECONDS
+        return now - self.encoded_at >= budget
+
+
+class TrackManager:
+    """
+    Треки лиц одной камеры. На каждом цикле обнаружения новые рамки
+    привязываются к существующим трекам по IoU, а кодировщик запускается
+    только для новых треков, неуверенных треков и треков, у которых истек
+    бюджет возраста. Личность остальных берется из кэша трека.
+    """
+
+    def __init__(self):
+        self._tracks = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def tracks(self):
+        with self._lock:
+            return list(self._tracks.values())
+
+    def associate(self, boxes, now=None):
+        """
+        Привязывает обнаруженные рамки к трекам (жадно по убыванию IoU).
+        Возвращает список (трек, рамка, нужно_кодировать) для каждой рамки;
+        для непривязанных рамок создаются новые треки, давно не найденные
+        треки удаляются.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            tracks = list(self._tracks.values())
+            pairs = sorted(((iou(track.box, box), t, b) for t, track in enumerate(tracks) for b, box in enumerate(boxes)),
+                           reverse=True)
+            used_tracks, assigned = set(), {}
+            for overlap, t, b in pairs:
+                if overlap < IOU_THRESHOLD:
+                    break
+                if t in used_tracks or b in assigned:
+                    continue
+                used_tracks.add(t); assigned[b] = tracks[t]
+
+            result = []
+            for b, box in enumerate(boxes):
+                track = assigned.get(b)
+                if track is None:
+                    track = Track(next(self._ids), box, now); self._tracks[track.id] = track
+                track.box, track.last_seen, track.misses = tuple(box), now, 0
+                result.append((track, box, track.needs_encoding(now)))
+            for t, track in enumerate(tracks):
+                if t not in used_tracks:
+                    track.misses += 1
+                    if track.misses > MAX_MISSES:
+                        self._tracks.pop(track.id, None)
+            return result
+
+    def set_identity(self, track, user, distance, encoding, now=None):
+        """
+        Обновляет личность трека по результату кодирования. Возвращает True, если
+        личность установлена впервые или изменилась (нужно новое событие).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if track.id not in self._tracks:
+                return False
+            if (track.encoding is not None and encoding is not None
+                    and np.linalg.norm(np.asarray(track.encoding) - np.asarray(encoding)) > IDENTITY_SWITCH_DISTANCE):
+                track.user = None  # В рамке трека оказался другой человек
+            previous = track.user['id'] if track.user else None
+            first = track.encoded_at is None
+            # Уверенная личность не сбрасывается одним неудачным кодированием
+            if user is not None or not track.confident:
+                track.user, track.distance = user, distance
+            track.encoding, track.encoded_at = encoding, now
+            current = track.user['id'] if track.user else None
+            return first or current != previous
+
+    def set_tracker(self, track, tracker):
+        with self._lock:
+            track.tracker = tracker
+
+    def drop(self, track):
+        with self._lock:
+            self._tracks.pop(track.id, None)
+
+    def clear(self):
+        with self._lock:
+            self._tracks.clear()
+
+
+# --- Подключаемые трекеры ---
+
+class KalmanBoxTracker:
+    """
+    Фильтр Калмана с постоянной скоростью для рамки (cx, cy, w, h). Изображение
+    не обрабатывается: между обнаружениями рамка экстраполируется, а на кадрах
+    обнаружения корректируется новой рамкой YuNet.
+    """
+
+    F = np.eye(6); F[0, 4] = F[1, 5] = 1.0
+    H = np.eye(4, 6)
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.5, 0.5])
+    R = np.diag([4.0, 4.0, 16.0, 16.0])
+
+    def __init__(self, box, max_age):
+        x, y, w, h = [float(v) for v in box]
+        self.state = np.array([x + w / 2, y + h / 2, w, h, 0.0, 0.0])
+        self.covariance = np.diag([10.0, 10.0, 10.0, 10.0, 1000.0, 1000.0])
+        self.max_age = max_age
+        self.age = 0
+        self._measurement = None
+
+    def correct(self, box):
+        """Запоминает измерение; применяется при следующем update в потоке камеры."""
+        self._measurement = box
+
+    def update(self):
+        self.state = self.F @ self.state
+        self.covariance = self.F @ self.covariance @ self.F.T + self.Q
+        self.age += 1
+        measurement, self._measurement = self._measurement, None
+        if measurement is not None:
+            x, y, w, h = [float(v) for v in measurement]
+            residual = np.array([x + w / 2, y + h / 2, w, h]) - self.H @ self.state
+            s = self.H @ self.covariance @ self.H.T + self.R
+            gain = self.covariance @ self.H.T @ np.linalg.inv(s)
+            self.state = self.state + gain @ residual
+            self.covariance = (np.eye(6) - gain @ self.H) @ self.covariance
+            self.age = 0
+        cx, cy, w, h = self.state[:4]
+        return self.age <= self.max_age, (float(cx - w / 2), float(cy - h / 2), float(w), float(h))
+
+
+class KalmanBackend:
+    """Самый дешевый вариант: обнаружение раз в N кадров + Калман/IoU между ними."""
+
+    name = 'kalman'
+
+    def __init__(self, max_age=30):
+        self.max_age = max_age # Сколько кадров рамка живет без подтверждения обнаружением
+
+    def prepare(self, frame):
+        return None
+
+    def correct(self, tracker, prepared, box):
+        if isinstance(tracker, KalmanBoxTracker):
+            tracker.correct(box)
+            return tracker
+        return KalmanBoxTracker(box, self.max_age)
+
+    def update(self, tracker, prepared):
+        return tracker.update()
+
+
+class OpenCVBackend:
+    """
+    Трекеры OpenCV (CSRT, KCF, MOSSE). Все трекеры камеры работают на одном
+    уменьшенном кадре (scale), который готовится один раз на кадр.
+    """
+
+    FACTORIES = {
+        'csrt': lambda: cv2.TrackerCSRT_create(),
+        'kcf': lambda: cv2.TrackerKCF_create(),
+        'mosse': lambda: cv2.legacy.TrackerMOSSE_create(),
+    }
+
+    def __init__(self, name, scale=1.0):
+        if name not in self.FACTORIES:
+            raise ValueError(f"Неизвестный трекер '{name}'. Доступны: {', '.join(TRACKER_BACKENDS)}")
+        self.name, self.scale = name, scale
+
+    def prepare(self, frame):
+        if self.scale == 1.0:
+            return frame
+        return cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def correct(self, tracker, prepared, box):
+        tracker = self.FACTORIES[self.name]()
+        tracker.init(prepared, tuple(int(round(v * self.scale)) for v in box))
+        return tracker
+
+    def update(self, tracker, prepared):
+        success, box = tracker.update(prepared)
+        return success, tuple(v / self.scale for v in box)
+
+
+TRACKER_BACKENDS = ('kalman', 'csrt', 'kcf', 'mosse')
+DEFAULT_TRACKER = 'kalman'
+DEFAULT_TRACKING_SCALE = 0.5 # Масштаб кадра для быстрых трекеров OpenCV
+
+
+def create_tracker_backend(name=DEFAULT_TRACKER, scale=None, max_age=30):
+    """
+    Создает трекер по имени: 'kalman' (по умолчанию), 'kcf' и 'mosse' на
+    уменьшенном кадре или 'csrt' на полном разрешении (точнее, но дороже).
+    """
+    if name == 'kalman':
+        return KalmanBackend(max_age)
+    if scale is None:
+        scale = 1.0 if name == 'csrt' else DEFAULT_TRACKING_SCALE
+    return OpenCVBackend(name, scale)
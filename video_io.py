@@ -0,0 +1,119 @@
+import threading
+import time
+import cv2
+from frame_ring import FrameRing, DEFAULT_RING_SLOTS
+
+# --- Захват видеопотока ---
+class RTSPVideoCapture:
+    """
+    Захват RTSP-потока с декодированием по требованию.
+
+    Поток захвата непрерывно вызывает grab(), чтобы буфер сети не отставал от
+    камеры, а retrieve() (перевод в BGR и копирование кадра) выполняет только
+    когда потребитель ждет кадр и с последнего выданного кадра прошло не
+    меньше 1/fps. Кадр декодируется прямо в слот кольцевого буфера FrameRing
+    и выдается потребителям по ссылке без копирования. Каждый кадр получает
+    порядковый номер и время захвата, поэтому потребитель никогда не
+    обрабатывает один и тот же кадр дважды.
+    """
+
+    def __init__(self, rtsp_url, fps=None, ring_slots=DEFAULT_RING_SLOTS, latency=None):
+        self.rtsp_url = rtsp_url
+        self.fps = fps # Целевая частота выдачи кадров; None - сколько успевает потребитель
+        self.latency = latency # Гистограмма длительности декодирования кадра (metrics.Histogram) или None
+        self.ring_slots = ring_slots
+        self.ring = None # Создается по размеру первого кадра
+        self.ret = False; self.seq = -1; self.timestamp = None
+        self.grabbed = 0; self.retrieved = 0 # Кадры, прочитанные из потока / декодированные для потребителей
+        self.dropped = 0 # Нужные потребителю кадры, которые не удалось выдать (заняты слоты буфера, ошибка декодирования)
+        self.is_running = False; self.thread = None; self.cap = None
+        self._waiting = 0
+        self._last_retrieve = 0.0
+        self._cond = threading.Condition()
+
+    def start(self):
+        if self.is_running: return
+        self.is_running = True; self.thread = threading.Thread(target=self.update, args=()); self.thread.daemon = True; self.thread.start()
+
+    def _wanted(self, now):
+        with self._cond:
+            if not self._waiting:
+                return False
+        return not self.fps or now - self._last_retrieve >= 1.0 / self.fps
+
+    def _retrieve(self):
+        """Декодирует текущий кадр в свободный слот буфера; возвращает номер слота или None."""
+        ring = self.ring
+        slot = ring.acquire() if ring is not None else None
+        if ring is not None and slot is None:
+            return None # Все слоты заняты потребителями - кадр пропускается
+        view = ring.view(slot) if ring is not None else None
+        ret, frame = self.cap.retrieve(view) if view is not None else self.cap.retrieve()
+        if not ret or frame is None:
+            if slot is not None: ring.cancel(slot)
+            return None
+        if view is not None and frame is not view:
+            if frame.shape == view.shape: view[:] = frame # Привязка OpenCV вернула новый массив того же размера
+            else: ring.cancel(slot); ring = slot = None # Камера сменила разрешение
+        if ring is None:
+            # Первый кадр или новое разрешение: буфер создается заново, старые ссылки остаются действительными
+            if self.ring is not None: self.ring.close()
+            ring = self.ring = FrameRing(frame.shape, self.ring_slots)
+            slot = ring.acquire(); ring.view(slot)[:] = frame
+        return slot
+
+    def update(self):
+        while self.is_running:
+            if self.cap is None or not self.cap.isOpened():
+                print(f"[RTSP] Попытка подключения к {self.rtsp_url}..."); self.cap = cv2.VideoCapture(self.rtsp_url)
+                if not self.cap.isOpened(): self.cap.release(); self.cap = None; time.sleep(5); continue
+                else: print("[RTSP] Соединение установлено успешно.")
+            if not self.cap.grab(): self.cap.release(); self.cap = None; self.ret = False; time.sleep(1); continue
+            now = time.time(); self.grabbed += 1
+            if not self._wanted(now):
+                continue # Кадр никому не нужен - не декодируем
+            start = time.perf_counter()
+            slot = self._retrieve()
+            if slot is None: self.dropped += 1; continue
+            if self.latency is not None: self.latency.observe(time.perf_counter() - start)
+            self._last_retrieve = now; self.retrieved += 1
+            self.ring.publish(slot, self.grabbed, now)
+            with self._cond:
+                self.ret, self.seq, self.timestamp = True, self.grabbed, now
+                self._cond.notify_all()
+        if self.cap is not None: self.cap.release(); self.cap = None
+
+    def read(self):
+        """Копия последнего выданного кадра (ret, frame) без ожидания; кадр может быть уже обработан."""
+        ref = self.ring.latest() if self.ring is not None else None
+        if ref is None:
+            return False, None
+        with ref:
+            return self.ret, ref.frame.copy()
+
+    def read_latest(self, after_seq=-1, timeout=1.0):
+        """
+        Ждет кадр новее after_seq и возвращает FrameRef (номер seq, время
+        захвата timestamp, кадр frame) или None по таймауту. Ссылку нужно
+        освободить. Номер - позиция кадра в потоке, поэтому разрыв между
+        номерами показывает, сколько кадров было пропущено без декодирования.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self.is_running and self.seq <= after_seq:
+                    remaining = deadline - time.time()
+                    if remaining <= 0: return None
+                    self._cond.wait(remaining)
+                if self.seq <= after_seq: return None
+            finally:
+                self._waiting -= 1
+        ring = self.ring
+        return ring.latest() if ring is not None else None
+
+    def stop(self):
+        self.is_running = False
+        with self._cond: self._cond.notify_all()
+        if self.thread is not None and self.thread.is_alive(): self.thread.join(timeout=2)
+        if self.ring is not None: self.ring.close(); self.ring = None